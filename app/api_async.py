@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Request, Response, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import date as date_type
+from . import schemas, crud, crud_async, database, serialization
+
+# Async variants of the hot endpoints; main.py includes this router ahead of the sync routes when DB_ASYNC is on.
+# Reads take the replica-routed session and answer like the sync routes (reference ETags, fast JSON lists).
+router = APIRouter()
+get_db = database.get_async_db
+get_read_db = database.get_async_read_db
+
+@router.get("/departments/", response_model=List[schemas.DepartmentOut])
+async def read_departments(request: Request, db: AsyncSession = Depends(get_read_db)): return serialization.reference_response(request, "departments", await crud_async.get_departments(db))
+@router.get("/doctors/")
+async def read_doctors(request: Request, specialization: str = None, db: AsyncSession = Depends(get_read_db)):
+    return serialization.reference_response(request, "doctors", await crud_async.get_doctors(db, specialization), f"-{specialization}" if specialization else "")
+@router.get("/patients/", response_model=List[schemas.PatientOut])
+async def read_patients(response: Response, search: Optional[str] = None, cursor: Optional[int] = None, limit: int = Query(crud.PATIENT_PAGE_SIZE, ge=1, le=crud.PATIENT_PAGE_MAX), db: AsyncSession = Depends(get_read_db)):
+    patients = await crud_async.get_patients(db, search, cursor, limit)
+    headers = {"X-Next-Cursor": str(patients[-1]["id"])} if len(patients) == limit else {}
+    response.headers.update(headers)
+    return serialization.respond(patients, headers)
+
+@router.get("/doctors/{doctor_id}/slots", response_model=List[schemas.TimeSlot])
+async def get_slots(doctor_id: int, date: str, db: AsyncSession = Depends(get_read_db)): return await crud_async.get_slots_for_doctor(db, doctor_id, date)
+@router.get("/availability", response_model=List[schemas.AvailableSlot])
+async def get_availability(specialization: Optional[str] = None, department_id: Optional[int] = None, date_from: Optional[date_type] = None, date_to: Optional[date_type] = None, limit: Optional[int] = Query(None, ge=1, le=crud.AVAILABILITY_LIMIT_MAX), db: AsyncSession = Depends(get_read_db)):
+    return await crud_async.get_availability(db, specialization, department_id, date_from, date_to, limit)
+
+@router.post("/appointments/", response_model=schemas.AppointmentOut)
+async def book_appointment(appt: schemas.AppointmentCreate, db: AsyncSession = Depends(get_db)): return await crud_async.create_appointment(db, appt)
+@router.get("/doctors/{doctor_id}/appointments", response_model=List[schemas.AppointmentOut])
+async def get_doc_appointments(doctor_id: int, db: AsyncSession = Depends(get_read_db)): return serialization.respond(await crud_async.get_doctor_appointments(db, doctor_id))
+@router.post("/appointments/{appt_id}/cancel")
+async def cancel_appointment(appt_id: int, db: AsyncSession = Depends(get_db)): return await crud_async.cancel_appointment(db, appt_id)
+@router.get("/patients/{patient_id}/history", response_model=List[schemas.MedicalRecordOut])
+async def get_history(patient_id: int, db: AsyncSession = Depends(get_read_db)): return await crud_async.get_patient_history(db, patient_id)
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "60"))
+
+
+# In-process cache for small, rarely changing tables: entries expire after `ttl` seconds and are
+# dropped by the write paths. A value loaded across an invalidation is returned but not stored.
+class TTLCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        etag = hashlib.md5(json.dumps(value, default=str, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            if generation == self._generation: self._data[key] = (now + self.ttl, value, etag)
+        return value
+
+    def etag(self, key: str):
+        entry = self._data.get(key)
+        return entry[2] if entry else None
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            self._generation += 1
+            for key in keys: self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0, "entries": len(self._data)}
+
+
+reference = TTLCache(REFERENCE_CACHE_TTL)
@@ -0,0 +1,87 @@
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+WEEKDAYS = ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця", "Субота", "Неділя"]
+DEFAULT_SLOT_MINUTES = 20
+CALENDAR_DAYS = int(os.getenv("CALENDAR_DAYS", "120"))
+DAY = 24 * 60
+
+
+def _minutes(t): return t.hour * 60 + t.minute
+
+
+# A doctor's effective working time: the weekly rule for each weekday, replaced on specific dates by an
+# exception (another shift, or None for a day off). The window [first, first + days) is flattened into
+# sorted, disjoint [start, end) minute offsets from `first`, so a booking check is one bisect; dates
+# outside the window fall back to the rules, still without a query.
+class DoctorCalendar:
+    __slots__ = ("slot_minutes", "weekly", "exceptions", "first", "days", "starts", "ends")
+
+    def __init__(self, slot_minutes: int, weekly: dict, exceptions: dict, first: date, days: int = CALENDAR_DAYS):
+        self.slot_minutes = slot_minutes or DEFAULT_SLOT_MINUTES
+        self.weekly, self.exceptions, self.first, self.days = weekly, exceptions, first, days
+        self.starts, self.ends = [], []
+        for i in range(days):
+            h = self._rule(first + timedelta(days=i))
+            if h: self.starts.append(i * DAY + h[0]); self.ends.append(i * DAY + h[1])
+
+    def _rule(self, day: date):
+        return self.exceptions[day] if day in self.exceptions else self.weekly.get(day.weekday())
+
+    def hours(self, day: date):
+        # (start, end) minutes of the working interval on `day`, or None
+        i = (day - self.first).days
+        if not 0 <= i < self.days: return self._rule(day)
+        k = bisect_left(self.starts, i * DAY)
+        if k == len(self.starts) or self.starts[k] >= (i + 1) * DAY: return None
+        return self.starts[k] - i * DAY, self.ends[k] - i * DAY
+
+    def is_slot(self, dt: datetime):
+        # dt starts a whole slot inside working time, on the grid counted from the interval start
+        if dt.second or dt.microsecond: return False
+        i, m = (dt.date() - self.first).days, _minutes(dt)
+        if 0 <= i < self.days:
+            x = i * DAY + m
+            k = bisect_right(self.starts, x) - 1
+            return k >= 0 and x + self.slot_minutes <= self.ends[k] and (x - self.starts[k]) % self.slot_minutes == 0
+        h = self._rule(dt.date())
+        return bool(h) and h[0] <= m and m + self.slot_minutes <= h[1] and (m - h[0]) % self.slot_minutes == 0
+
+    def slots(self, day: date):
+        h = self.hours(day)
+        return range(h[0], h[1] - self.slot_minutes + 1, self.slot_minutes) if h else range(0)
+
+
+def compile_calendar(doctor: dict, rules: list, exceptions: list, first: date, days: int = CALENDAR_DAYS):
+    # rules: cached schedules rows of the doctor; exceptions: cached schedule_exceptions rows
+    weekly = {r["weekday"]: (_minutes(r["start_time"]), _minutes(r["end_time"])) for r in rules if r["weekday"] is not None and r["start_time"] and r["end_time"] and r["start_time"] < r["end_time"]}
+    overrides = {e["day"]: (_minutes(e["start_time"]), _minutes(e["end_time"])) if e["start_time"] and e["end_time"] else None for e in exceptions}
+    return DoctorCalendar(doctor.get("slot_minutes"), weekly, overrides, first, days)
+
+
+class CompiledCalendars:
+    # calendars are compiled lazily per doctor from the reference-cache entries and dropped as soon as
+    # any of those entries is reloaded (a write invalidated it) or the day rolls over
+    def __init__(self, days: int = CALENDAR_DAYS):
+        self.days = days
+        self._inputs = None
+        self._by_doctor = {}
+        self._lock = threading.Lock()
+
+    def get(self, doctor_id: int, doctors: dict, rules: dict, exceptions: dict, today: date):
+        inputs = (doctors, rules, exceptions, today)
+        with self._lock:
+            if self._inputs is None or any(a is not b for a, b in zip(inputs[:3], self._inputs[:3])) or today != self._inputs[3]:
+                self._inputs, self._by_doctor = inputs, {}
+            cal = self._by_doctor.get(doctor_id)
+            if cal is None and doctor_id in doctors:
+                cal = self._by_doctor[doctor_id] = compile_calendar(doctors[doctor_id], rules.get(doctor_id, []), exceptions.get(doctor_id, []), today - timedelta(days=1), self.days)
+            return cal
+
+    def clear(self):
+        with self._lock: self._inputs, self._by_doctor = None, {}
+
+
+compiled = CompiledCalendars()
@@ -0,0 +1,70 @@
+import argparse
+from datetime import timedelta
+from . import crud, database, idempotency, migrations, seed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Hospital System maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-stats", help="Rebuild doctor_daily_stats from the appointments history")
+    summaries = sub.add_parser("rebuild-summaries", help="Rebuild patient_summaries from the visit history")
+    summaries.add_argument("--patient", type=int, action="append", dest="patients", help="only this patient (repeatable)")
+    migrate = sub.add_parser("migrate", help="Apply pending schema migrations")
+    migrate.add_argument("--target", type=int, help="stop after this version")
+    migrate.add_argument("--status", action="store_true", help="only list pending migrations")
+    init = sub.add_parser("init-db", help="Apply migrations and seed demo data into an empty database")
+    init.add_argument("--no-seed", action="store_true")
+    seed_cmd = sub.add_parser("seed", help="Fill an empty database with synthetic data (bulk inserts)")
+    for p in (init, seed_cmd):
+        p.add_argument("--doctors", type=int, default=15)
+        p.add_argument("--patients", type=int, default=25)
+        p.add_argument("--appointments", type=int, default=0)
+        p.add_argument("--medications", type=int, default=len(seed.MEDICATIONS))
+        p.add_argument("--seed", type=int, default=42, help="random seed")
+    archive = sub.add_parser("archive", help="Move finished visits past the retention window to the archive tables")
+    archive.add_argument("--older-than-days", type=int, default=crud.ARCHIVE_RETENTION_DAYS)
+    archive.add_argument("--batch-size", type=int, default=crud.ARCHIVE_BATCH_SIZE)
+    archive.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    sub.add_parser("purge-idempotency", help="Delete stored Idempotency-Key responses older than IDEMPOTENCY_TTL")
+    args = parser.parse_args(argv)
+
+    if args.command in ("init-db", "seed"):
+        if args.command == "init-db":
+            for version, name in migrations.migrate(database.engine): print(f"--- APPLIED {version:03d} {name} ---")
+            if args.no_seed or not seed.is_empty(database.engine): return
+        try: stats = seed.generate(database.engine, args.doctors, args.patients, args.appointments, args.medications, args.seed)
+        except RuntimeError as e: raise SystemExit(f"--- SEED SKIPPED: {e} ---")
+        print(f"--- SEEDED: {stats} ---")
+        if args.appointments:
+            db = database.SessionLocal()
+            try:
+                print(f"--- STATS REBUILT: {crud.rebuild_doctor_stats(db)} doctor/day rows ---")
+                print(f"--- SUMMARIES REBUILT: {crud.rebuild_patient_summaries(db)} patients ---"); db.commit()
+            finally: db.close()
+        return
+
+    if args.command == "migrate":
+        if args.status:
+            for version, name, _ in migrations.pending(database.engine): print(f"pending {version:03d} {name}")
+            return
+        for version, name in migrations.migrate(database.engine, args.target): print(f"--- APPLIED {version:03d} {name} ---")
+        print(f"--- SCHEMA AT VERSION {max(migrations.applied_versions(database.engine), default=0)} ---")
+        return
+
+    if args.command == "purge-idempotency":
+        print(f"--- PURGED: {idempotency.TableStore(database.engine).purge()} idempotency keys ---")
+        return
+
+    db = database.SessionLocal()
+    try:
+        if args.command == "rebuild-stats":
+            print(f"--- STATS REBUILT: {crud.rebuild_doctor_stats(db)} doctor/day rows ---")
+        elif args.command == "rebuild-summaries":
+            print(f"--- SUMMARIES REBUILT: {crud.rebuild_patient_summaries(db, args.patients)} patients ---"); db.commit()
+        elif args.command == "archive":
+            before = crud.get_kyiv_time() - timedelta(days=args.older_than_days)
+            print(f"--- ARCHIVED: {crud.archive_appointments(db, before, args.batch_size, args.pause)} appointments before {before:%Y-%m-%d} ---")
+    finally: db.close()
+
+
+if __name__ == "__main__": main()
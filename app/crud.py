@@ -1,204 +1,617 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, cast, String
+from sqlalchemy import func, or_, and_, literal, select, insert, update, delete, union_all
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta, date, time
-import random
-from . import models, schemas
+from time import sleep
+from . import models, schemas, cache, events, calendars
+from .calendars import WEEKDAYS
 from fastapi import HTTPException
 
 
+SLOT_MINUTES = calendars.DEFAULT_SLOT_MINUTES
+EXCEPTIONS_LOOKBACK_DAYS = 31
+MAX_EXCEPTION_DAYS = 366
+MAX_AVAILABILITY_DAYS = 31
+AVAILABILITY_LIMIT_MAX = 500
+PATIENT_PAGE_SIZE = 50
+PATIENT_PAGE_MAX = 200
+ARCHIVE_RETENTION_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+CASCADE_BATCH_SIZE = 500
+EXPORT_ENTITIES = ("patients", "appointments", "history")
+TIMELINE_PAGE_SIZE = 20
+TIMELINE_PAGE_MAX = 100
+WAITLIST_CANDIDATES = 10
+WAITLIST_SWEEP_LIMIT = 200
+
+
 def get_kyiv_time():
     return datetime.utcnow() + timedelta(hours=2)
 
 
-def seed_data(db: Session):
-    if db.query(models.Department).first(): return 
-    print("--- 🚀 SEEDING ---")
-    departments_data = [{"name": "Хірургія", "loc": "A"}, {"name": "Терапія", "loc": "B"}, {"name": "Неврологія", "loc": "C"}, {"name": "Педіатрія", "loc": "D"}, {"name": "Кардіологія", "loc": "E"}]
-    depts = []
-    for d in departments_data:
-        dept = models.Department(name=d["name"], location=d["loc"])
-        db.add(dept); depts.append(dept)
-    db.commit()
-    for d in depts: db.refresh(d)
-
-    names = ["Олександр", "Андрій", "Василь", "Ірина", "Олена", "Марія", "Світлана", "Віктор", "Наталія", "Дмитро"]
-    surnames = ["Шевченко", "Коваленко", "Бойко", "Ткаченко", "Кравчук", "Олійник", "Вовк", "Поліщук", "Бондар", "Мельник"]
-    doctors = []
-    for i in range(15):
-        dept = depts[i % 5]
-        doc = models.Doctor(
-            first_name=random.choice(names), last_name=random.choice(surnames),
-            specialization=dept.name[:-2] if len(dept.name)>5 else "Лікар",
-            department_id=dept.id, price_per_visit=random.choice([500, 700, 1000]),
-            availability_status="Available"
-        )
-        db.add(doc); doctors.append(doc)
-    db.commit()
-    
-    for doc in doctors:
-        db.refresh(doc)
-        for day in ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця"]:
-            db.add(models.Schedule(doctor_id=doc.id, day_of_week=day, start_time=time(9,0), end_time=time(17,0)))
-    db.commit()
+def _rows(q): return [dict(r._mapping) for r in q]
 
-    for m in [("Аспірин", "Bayer", "Жар"), ("Ібупрофен", "Дарниця", "Біль"), ("Вітамін C", "Віт", "Імун")]:
-        db.add(models.Medication(medication_name=m[0], manufacturer=m[1], description=m[2]))
-    
-    pat_names = ["Іван", "Петро", "Максим", "Анна"]
-    for i in range(25):
-        db.add(models.Patient(first_name=random.choice(pat_names), last_name=random.choice(surnames), date_of_birth=date(1990,1,1), phone_number=f"+380{random.randint(100000000, 999999999)}"))
-    db.commit()
-    print("--- SEEDING DONE ---")
+# reference data is served from cache.reference as plain dicts; write paths invalidate their keys.
+# A replica session loads through its primary so the shared cache never stores pre-write rows
+def _reference(db: Session, key: str, load):
+    def loader():
+        primary = db.info.get("primary")
+        if primary is None: return load(db)
+        with primary() as s: return load(s)
+    return cache.reference.get(key, loader)
+
+def _doctors_by_id(db: Session):
+    return _reference(db, "doctors", lambda s: {d["id"]: d for d in _rows(s.query(*models.Doctor.__table__.c).order_by(models.Doctor.id))})
+
+def _schedules_by_doctor(db: Session):
+    def load(s):
+        res = {}
+        for row in _rows(s.query(*models.Schedule.__table__.c).order_by(models.Schedule.id)): res.setdefault(row["doctor_id"], []).append(row)
+        return res
+    return _reference(db, "schedules", load)
+
+def _exceptions_by_doctor(db: Session):
+    # recent and future exceptions only; older dates no longer matter for booking or the board
+    def load(s):
+        res, e = {}, models.ScheduleException
+        since = get_kyiv_time().date() - timedelta(days=EXCEPTIONS_LOOKBACK_DAYS)
+        for row in _rows(s.query(*e.__table__.c).filter(e.day >= since).order_by(e.doctor_id, e.day)): res.setdefault(row["doctor_id"], []).append(row)
+        return res
+    return _reference(db, "exceptions", load)
+
+def _calendar(db: Session, doctor_id: int):
+    # compiled availability of a doctor (calendars.DoctorCalendar), or None for an unknown doctor
+    return calendars.compiled.get(doctor_id, _doctors_by_id(db), _schedules_by_doctor(db), _exceptions_by_doctor(db), get_kyiv_time().date())
 
+def _minutes(t): return t.hour * 60 + t.minute
+def _past_cutoff(now: datetime): return _minutes(now) + (1 if now.second or now.microsecond else 0)  # first minute not yet started
+
+def warm_reference_cache(db: Session):
+    # startup: the first requests of a fresh worker should not all miss the reference cache
+    _doctors_by_id(db); _schedules_by_doctor(db); _exceptions_by_doctor(db); get_departments(db); get_medications(db)
+
+def _slot_error(cal, dt: datetime):
+    if not cal.hours(dt.date()): return f"Не працює {dt.date():%d.%m.%Y}" if dt.date() in cal.exceptions else f"Не працює в {WEEKDAYS[dt.weekday()]}"
+    if not cal.is_slot(dt): return "Поза робочим часом"
+    return None
 
 def create_department(db: Session, dept: schemas.DepartmentCreate):
     db_dept = models.Department(name=dept.name, location=dept.location)
-    db.add(db_dept); db.commit(); db.refresh(db_dept); return db_dept
+    db.add(db_dept); db.commit(); db.refresh(db_dept); cache.reference.invalidate("departments"); return db_dept
 
 def create_doctor(db: Session, doctor: schemas.DoctorCreate):
     db_doc = models.Doctor(
         first_name=doctor.first_name, last_name=doctor.last_name, specialization=doctor.specialization,
-        department_id=doctor.department_id, price_per_visit=doctor.price_per_visit, availability_status="Available"
+        department_id=doctor.department_id, price_per_visit=doctor.price_per_visit, availability_status="Available", slot_minutes=doctor.slot_minutes
     )
     db.add(db_doc); db.commit(); db.refresh(db_doc)
     try: start_t = datetime.strptime(doctor.schedule_start, '%H:%M').time(); end_t = datetime.strptime(doctor.schedule_end, '%H:%M').time()
     except: start_t = time(9,0); end_t = time(17,0)
-    for day in ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця"]:
-        db.add(models.Schedule(doctor_id=db_doc.id, day_of_week=day, start_time=start_t, end_time=end_t))
-    db.commit(); db.refresh(db_doc); return db_doc
+    for weekday in range(5):
+        db.add(models.Schedule(doctor_id=db_doc.id, weekday=weekday, day_of_week=WEEKDAYS[weekday], start_time=start_t, end_time=end_t))
+    db.commit(); db.refresh(db_doc); cache.reference.invalidate("doctors", "schedules"); return db_doc
 
 def create_medication(db: Session, med: schemas.MedicationCreate):
-    db_med = models.Medication(medication_name=med.medication_name, manufacturer=med.manufacturer, description=med.description)
-    db.add(db_med); db.commit(); db.refresh(db_med); return db_med
+    db_med = models.Medication(medication_name=med.medication_name.strip(), manufacturer=med.manufacturer, description=med.description)
+    db.add(db_med)
+    try: db.commit()
+    except IntegrityError: db.rollback(); raise HTTPException(409, "Такі ліки вже існують")
+    db.refresh(db_med); cache.reference.invalidate("medications"); return db_med
+
+def _insert_ignore(db: Session, model):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql": from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite": from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else: return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing()
+
+def _resolve_medications(db: Session, names):
+    # normalized name -> (medication_id, catalogue name) from the cached catalogue; unknown names are
+    # upserted in one statement so concurrent completions can't create duplicates (uq_medications_name_lower)
+    wanted = {n.strip().lower(): n.strip() for n in names if n.strip()}
+    known = {m["medication_name"].strip().lower(): (m["medication_id"], m["medication_name"]) for m in get_medications(db)}
+    missing = [name for key, name in wanted.items() if key not in known]
+    if missing:
+        db.execute(_insert_ignore(db, models.Medication), [{"medication_name": n, "manufacturer": "Інше", "description": "Авто"} for n in missing])
+        m = models.Medication
+        for r in db.query(m.medication_id, m.medication_name).filter(or_(m.medication_name.in_(missing), func.lower(m.medication_name).in_([n.lower() for n in missing]))):
+            known[r.medication_name.strip().lower()] = (r.medication_id, r.medication_name)
+    return {key: known[key] for key in wanted}, bool(missing)
+
+def _check_booking(db: Session, data: schemas.AppointmentCreate):
+    # the booking rules short of the slot itself, shared with the waitlist allocator
+    now_kyiv = get_kyiv_time()
+    if data.date_time < now_kyiv.replace(tzinfo=None) - timedelta(minutes=5): raise HTTPException(400, "Минулий час")
+
+    patient = db.query(models.Patient.is_active).filter(models.Patient.id == data.patient_id).first()
+    if not patient or not patient.is_active: raise HTTPException(400, "Patient inactive")
+
+    doctor = _doctors_by_id(db).get(data.doctor_id)
+    if not doctor or doctor["availability_status"] != "Available": raise HTTPException(404, "Doctor unavailable")
+
+    err = _slot_error(_calendar(db, data.doctor_id), data.date_time)
+    if err: raise HTTPException(400, err)
 
 def create_appointment(db: Session, data: schemas.AppointmentCreate):
     try:
-        now_kyiv = get_kyiv_time()
-        if data.date_time < now_kyiv.replace(tzinfo=None) - timedelta(minutes=5): raise HTTPException(400, "Минулий час")
-        
-        patient = db.query(models.Patient).filter(models.Patient.id == data.patient_id).first()
-        if not patient or not patient.is_active: raise HTTPException(400, "Patient inactive")
-        
-        doctor = db.query(models.Doctor).filter(models.Doctor.id == data.doctor_id).first()
-        if not doctor or doctor.availability_status != "Available": raise HTTPException(404, "Doctor unavailable")
-        
-        day_str = ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця", "Субота", "Неділя"][data.date_time.weekday()]
-        sched = db.query(models.Schedule).filter(models.Schedule.doctor_id == data.doctor_id, models.Schedule.day_of_week == day_str).first()
-        if not sched: raise HTTPException(400, f"Не працює в {day_str}")
-        if data.date_time.time() < sched.start_time or data.date_time.time() >= sched.end_time: raise HTTPException(400, "Поза робочим часом")
-        
-        if db.query(models.Appointment).filter(models.Appointment.doctor_id==data.doctor_id, models.Appointment.date_time==data.date_time, models.Appointment.status!='cancelled').first():
-            raise HTTPException(409, "Час зайнятий")
+        _check_booking(db, data)
 
+        # slot conflicts are rejected by uq_appointments_doctor_slot, no pre-check SELECT
         new_appt = models.Appointment(patient_id=data.patient_id, doctor_id=data.doctor_id, date_time=data.date_time, symptoms=data.symptoms, status="scheduled")
-        db.add(new_appt); db.commit(); db.refresh(new_appt); return new_appt
+        db.add(new_appt); db.commit(); db.refresh(new_appt)
+        events.publish_slot("booked", new_appt.id, new_appt.doctor_id, new_appt.date_time, new_appt.status)
+        return new_appt
+    except IntegrityError: db.rollback(); raise HTTPException(409, "Час зайнятий")
     except Exception as e: db.rollback(); raise e
 
+def bulk_create_appointments(db: Session, data: schemas.AppointmentBulkCreate):
+    items = data.items
+    if not items: return {"succeeded": 0, "results": []}
+    min_time = get_kyiv_time().replace(tzinfo=None) - timedelta(minutes=5)
+    doc_ids = {i.doctor_id for i in items}
+    active = {r.id for r in db.query(models.Patient.id).filter(models.Patient.id.in_({i.patient_id for i in items}), models.Patient.is_active == True)}
+    docs = _doctors_by_id(db)
+    available = {d for d in doc_ids if d in docs and docs[d]["availability_status"] == "Available"}
+    taken = {(a.doctor_id, a.date_time) for a in db.query(models.Appointment.doctor_id, models.Appointment.date_time).filter(models.Appointment.doctor_id.in_(doc_ids), models.Appointment.date_time >= min(i.date_time for i in items), models.Appointment.date_time <= max(i.date_time for i in items), models.Appointment.status != 'cancelled')}
+
+    results, rows = [], []
+    for idx, it in enumerate(items):
+        err = None
+        if it.date_time < min_time: err = (400, "Минулий час")
+        elif it.patient_id not in active: err = (400, "Patient inactive")
+        elif it.doctor_id not in available: err = (404, "Doctor unavailable")
+        elif slot_err := _slot_error(_calendar(db, it.doctor_id), it.date_time): err = (400, slot_err)
+        elif (it.doctor_id, it.date_time) in taken: err = (409, "Час зайнятий")
+        if err: results.append({"index": idx, "status": err[0], "detail": err[1]}); continue
+        taken.add((it.doctor_id, it.date_time))
+        rows.append({"patient_id": it.patient_id, "doctor_id": it.doctor_id, "date_time": it.date_time, "symptoms": it.symptoms, "status": "scheduled"})
+        results.append({"index": idx, "status": 200})
+
+    ok = [r for r in results if r["status"] == 200]
+    if data.atomic and len(ok) < len(results):
+        for r in ok: r.update(status=424, detail="Пакет відхилено")
+        return {"succeeded": 0, "results": results}
+    if not rows: return {"succeeded": 0, "results": results}
+
+    stmt = insert(models.Appointment).returning(models.Appointment.id, sort_by_parameter_order=True)
+    try:
+        for r, new_id in zip(ok, db.scalars(stmt, rows).all()): r["id"] = new_id
+        db.commit()
+    except IntegrityError:
+        # a concurrent booking took one of the slots after preloading
+        db.rollback()
+        if data.atomic: raise HTTPException(409, "Час зайнятий")
+        for r, row in zip(ok, rows):
+            try:
+                with db.begin_nested(): r["id"] = db.scalars(stmt, [row]).one()
+            except IntegrityError: r.update(status=409, detail="Час зайнятий")
+        db.commit()
+    for r, row in zip(ok, rows):
+        if r["status"] == 200: events.publish_slot("booked", r["id"], row["doctor_id"], row["date_time"], row["status"])
+    return {"succeeded": sum(1 for r in ok if r["status"] == 200), "results": results}
+
 def get_slots_for_doctor(db: Session, doctor_id: int, date_str: str):
     try: target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
     except: return []
     now_kyiv = get_kyiv_time()
     if target_date < now_kyiv.date(): return []
     
-    doc = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
-    if not doc or doc.availability_status != "Available": return []
-    
-    day_name = ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця", "Субота", "Неділя"][target_date.weekday()]
-    schedule = db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id, models.Schedule.day_of_week == day_name).first()
-    if not schedule: return []
+    doc = _doctors_by_id(db).get(doctor_id)
+    if not doc or doc["availability_status"] != "Available": return []
     
-    start_d = datetime.combine(target_date, time.min); end_d = datetime.combine(target_date, time.max)
-    appts = db.query(models.Appointment).filter(models.Appointment.doctor_id==doctor_id, models.Appointment.date_time>=start_d, models.Appointment.date_time<=end_d, models.Appointment.status!='cancelled').all()
-    busy = {a.date_time.time() for a in appts}
+    slots = _calendar(db, doctor_id).slots(target_date)
+    if not slots: return []
     
-    slots = []; curr = schedule.start_time
-    while (datetime.combine(date.min, curr) + timedelta(minutes=20)).time() <= schedule.end_time:
-        is_free = curr not in busy
-        if target_date == now_kyiv.date() and curr < now_kyiv.time(): is_free = False
-        slots.append({"time": curr.strftime("%H:%M"), "is_free": is_free})
-        curr = (datetime.combine(date.min, curr) + timedelta(minutes=20)).time()
-    return slots
+    a = models.Appointment
+    busy = {_minutes(r.date_time) for r in db.query(a.date_time).filter(a.doctor_id == doctor_id, a.date_time >= datetime.combine(target_date, time.min), a.date_time < datetime.combine(target_date + timedelta(days=1), time.min), a.status != 'cancelled')}
+    cutoff = _past_cutoff(now_kyiv) if target_date == now_kyiv.date() else 0
+    return [{"time": f"{m // 60:02d}:{m % 60:02d}", "is_free": m not in busy and m >= cutoff} for m in slots]
 
+def get_board(db: Session, day: date):
+    # every available doctor's day as integer bitmaps: bit i is the slot at start + i * slot_minutes,
+    # so occupancy and the past cut-off are a few shifts and masks per doctor instead of per-slot loops
+    now_kyiv = get_kyiv_time()
+    hours = {}
+    for d in _doctors_by_id(db).values():
+        if d["availability_status"] != "Available": continue
+        cal = _calendar(db, d["id"]); slots = cal.slots(day)
+        if slots: hours[d["id"]] = (d, slots.start, len(slots), cal.slot_minutes)
+    busy = dict.fromkeys(hours, 0)
+    if hours:
+        a = models.Appointment
+        for r in db.query(a.doctor_id, a.date_time).filter(a.doctor_id.in_(list(hours)), a.date_time >= datetime.combine(day, time.min), a.date_time < datetime.combine(day + timedelta(days=1), time.min), a.status != 'cancelled'):
+            _, start, n, step = hours[r.doctor_id]
+            i, off = divmod(_minutes(r.date_time) - start, step)
+            if not off and 0 <= i < n: busy[r.doctor_id] |= 1 << i
+    today = now_kyiv.date()
+    cutoff = 0 if day > today else _past_cutoff(now_kyiv) if day == today else 24 * 60
+    res = []
+    for doc_id, (d, start, n, step) in hours.items():
+        past = (1 << min(n, max(0, -(-(cutoff - start) // step)))) - 1  # slots starting before the cut-off
+        res.append({"doctor_id": doc_id, "doctor_name": f"{d['first_name']} {d['last_name']}", "specialization": d["specialization"], "start": f"{start // 60:02d}:{start % 60:02d}", "slots": n, "slot_minutes": step,
+                    "busy": f"{busy[doc_id]:x}", "free": f"{((1 << n) - 1) & ~busy[doc_id] & ~past:x}"})
+    return {"date": day, "slot_minutes": SLOT_MINUTES, "doctors": res}
 
-def get_medications(db: Session): return db.query(models.Medication).all()
-def get_departments(db: Session): return db.query(models.Department).all()
+def get_availability(db: Session, specialization: str = None, department_id: int = None, date_from: date = None, date_to: date = None, limit: int = None):
+    now_kyiv = get_kyiv_time()
+    start = max(date_from or now_kyiv.date(), now_kyiv.date())
+    end = min(date_to or start + timedelta(days=6), start + timedelta(days=MAX_AVAILABILITY_DAYS - 1))
+    if end < start: return []
+
+    docs = [d for d in _doctors_by_id(db).values() if d["availability_status"] == "Available" and (not specialization or d["specialization"] == specialization) and (not department_id or d["department_id"] == department_id)]
+    if not docs: return []
+    doc_ids = [d["id"] for d in docs]
+
+    cals = {d: _calendar(db, d) for d in doc_ids}
+
+    busy = {}
+    for a in db.query(models.Appointment.doctor_id, models.Appointment.date_time).filter(models.Appointment.doctor_id.in_(doc_ids), models.Appointment.date_time >= datetime.combine(start, time.min), models.Appointment.date_time < datetime.combine(end + timedelta(days=1), time.min), models.Appointment.status != 'cancelled'):
+        busy.setdefault((a.doctor_id, a.date_time.date()), set()).add(a.date_time.hour * 60 + a.date_time.minute)
+
+    cutoff = _past_cutoff(now_kyiv)
+    res = []; day = start
+    while day <= end:
+        day_slots = []
+        for d in docs:
+            taken = busy.get((d["id"], day), set())
+            for m in cals[d["id"]].slots(day):
+                if m in taken or (day == now_kyiv.date() and m < cutoff): continue
+                day_slots.append((m, d))
+        day_slots.sort(key=lambda x: (x[0], x[1]["id"]))
+        for m, d in day_slots:
+            res.append({"doctor_id": d["id"], "doctor_name": f"{d['first_name']} {d['last_name']}", "specialization": d["specialization"], "date_time": datetime.combine(day, time(m // 60, m % 60))})
+            if limit and len(res) >= limit: return res
+        day += timedelta(days=1)
+    return res
+
+
+def get_medications(db: Session): return _reference(db, "medications", lambda s: _rows(s.query(*models.Medication.__table__.c).order_by(models.Medication.medication_id)))
+def get_departments(db: Session): return _reference(db, "departments", lambda s: _rows(s.query(*models.Department.__table__.c).order_by(models.Department.id)))
 def get_doctors(db: Session, specialization: str = None):
-    q = db.query(models.Doctor)
-    if specialization: q = q.filter(models.Doctor.specialization == specialization)
-    return q.all()
+    docs = _doctors_by_id(db).values()
+    return [d for d in docs if d["specialization"] == specialization] if specialization else list(docs)
+
+def _parse_date(s: str):
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try: return datetime.strptime(s, fmt).date()
+        except ValueError: pass
+    return None
 
-def get_patients(db: Session, search: str = None):
-    q = db.query(models.Patient).filter(models.Patient.is_active == True)
-    if search:
-        s = f"%{search}%"
-        q = q.filter(or_(models.Patient.first_name.ilike(s), models.Patient.last_name.ilike(s), models.Patient.phone_number.ilike(s), cast(models.Patient.date_of_birth, String).ilike(s)))
-    return q.order_by(models.Patient.id.asc()).all()
+def _like_contains(s: str):
+    return "%" + s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def get_patients(db: Session, search: str = None, cursor: int = None, limit: int = PATIENT_PAGE_SIZE):
+    # only the PatientOut columns, as dicts, so list responses skip ORM identity mapping
+    limit = max(1, min(limit or PATIENT_PAGE_SIZE, PATIENT_PAGE_MAX))
+    pt = models.Patient
+    q = db.query(pt.id, pt.first_name, pt.last_name, pt.date_of_birth, pt.phone_number, pt.version).filter(pt.is_active == True)
+    if cursor: q = q.filter(models.Patient.id > cursor)
+    s = (search or "").strip()
+    if s:
+        dob = _parse_date(s)
+        if dob: q = q.filter(models.Patient.date_of_birth == dob)
+        elif s[0].isdigit() or s[0] == "+": q = q.filter(models.Patient.phone_number.like(_like_contains(s), escape="\\"))
+        else:
+            p = func.lower(_like_contains(s))
+            q = q.filter(or_(func.lower(models.Patient.first_name).like(p, escape="\\"), func.lower(models.Patient.last_name).like(p, escape="\\")))
+    return _rows(q.order_by(models.Patient.id.asc()).limit(limit))
 
 def get_doctor_appointments(db: Session, doctor_id: int):
-    return db.query(models.Appointment).filter(models.Appointment.doctor_id == doctor_id, models.Appointment.status != 'cancelled').order_by(models.Appointment.date_time.asc()).all()
-def get_doctor_schedule_settings(db: Session, doctor_id: int): return db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).all()
+    # one joined column projection instead of ORM rows that lazy-load .patient per appointment
+    a, p = models.Appointment, models.Patient
+    rows = db.query(a.id, a.date_time, a.status, a.symptoms, a.version, p.id.label("patient_id"), p.first_name, p.last_name, p.date_of_birth, p.phone_number, p.version.label("patient_version")).join(p, p.id == a.patient_id).filter(a.doctor_id == doctor_id, a.status != 'cancelled').order_by(a.date_time.asc()).all()
+    return [{"id": r.id, "date_time": r.date_time, "status": r.status, "symptoms": r.symptoms, "version": r.version, "patient": {"id": r.patient_id, "first_name": r.first_name, "last_name": r.last_name, "date_of_birth": r.date_of_birth, "phone_number": r.phone_number, "version": r.patient_version}} for r in rows]
+def get_doctor_schedule_settings(db: Session, doctor_id: int): return _schedules_by_doctor(db).get(doctor_id, [])
+_STORES = ((models.Appointment, models.MedicalRecord, models.Prescription, models.LabTest),
+           (models.AppointmentArchive, models.MedicalRecordArchive, models.PrescriptionArchive, models.LabTestArchive))
+
+def _all_stores(build):
+    # the same select over hot and archived visits; `build(appointments, records, prescriptions, lab_tests)`
+    return union_all(*(build(*tables) for tables in _STORES)).subquery()
+
+def _all_appointments(build): return _all_stores(lambda a, *_: build(a))
+
 def get_patient_history(db: Session, patient_id: int):
-    appts = db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id, models.Appointment.status == 'completed').all()
-    res = []
-    for a in appts:
-        if a.diagnosis: res.append({"date": a.date_time, "diagnosis": a.diagnosis, "treatment_plan": "Див. рецепт", "doctor_name": f"{a.doctor.first_name} {a.doctor.last_name}"})
-    return res
+    d = models.Doctor
+    a = _all_stores(lambda t, r, *_: select(t.date_time, t.diagnosis, t.doctor_id, r.treatment_plan).outerjoin(r, r.appointment_id == t.id).where(t.patient_id == patient_id, t.status == 'completed', t.diagnosis.isnot(None), t.diagnosis != ''))
+    rows = db.query(a.c.date_time, a.c.diagnosis, a.c.treatment_plan, d.first_name, d.last_name).join(d, d.id == a.c.doctor_id).order_by(a.c.date_time.asc()).all()
+    return [{"date": r.date_time, "diagnosis": r.diagnosis, "treatment_plan": r.treatment_plan or "Див. рецепт", "doctor_name": f"{r.first_name} {r.last_name}"} for r in rows]
+
+def _parse_timeline_cursor(cursor: str):
+    try: at, appt_id = cursor.rsplit("_", 1); return datetime.fromisoformat(at), int(appt_id)
+    except ValueError: raise HTTPException(422, "Invalid cursor")
+
+def get_patient_timeline(db: Session, patient_id: int, cursor: str = None, limit: int = TIMELINE_PAGE_SIZE):
+    # four queries whatever the page size: patient + summary, the visit page (hot and archive, with the
+    # medical record), then prescriptions and lab tests for the page; doctor names come from the cache
+    p, ps = models.Patient, models.PatientSummary
+    head = db.query(p, ps).outerjoin(ps, ps.patient_id == p.id).filter(p.id == patient_id).first()
+    if not head: raise HTTPException(404, "Not found")
+    patient, summary = head
+    docs = _doctors_by_id(db)
+    doctor_name = lambda doc_id: f"{docs[doc_id]['first_name']} {docs[doc_id]['last_name']}" if doc_id in docs else None
+
+    v = _all_stores(lambda t, r, *_: select(t.id, t.date_time, t.status, t.doctor_id, t.symptoms, t.diagnosis, r.treatment_plan).outerjoin(r, r.appointment_id == t.id).where(t.patient_id == patient_id, t.status != "cancelled"))
+    q = db.query(v)
+    if cursor:
+        at, appt_id = _parse_timeline_cursor(cursor)
+        q = q.filter(or_(v.c.date_time < at, and_(v.c.date_time == at, v.c.id < appt_id)))
+    visits = [{"appointment_id": r.id, "date_time": r.date_time, "status": r.status, "doctor_id": r.doctor_id, "doctor_name": doctor_name(r.doctor_id), "specialization": docs.get(r.doctor_id, {}).get("specialization"),
+               "symptoms": r.symptoms, "diagnosis": r.diagnosis, "treatment_plan": r.treatment_plan, "prescriptions": [], "lab_tests": []} for r in q.order_by(v.c.date_time.desc(), v.c.id.desc()).limit(limit)]
+    if visits:
+        by_id = {x["appointment_id"]: x for x in visits}
+        m = models.Medication
+        rx = _all_stores(lambda _a, _r, pr, _l: select(pr.id, pr.appointment_id, pr.medication_id, pr.dosage, pr.instructions).where(pr.appointment_id.in_(list(by_id))))
+        for r in db.query(rx.c.appointment_id, m.medication_name, rx.c.dosage, rx.c.instructions).join(m, m.medication_id == rx.c.medication_id).order_by(rx.c.id):
+            by_id[r.appointment_id]["prescriptions"].append({"medication_name": r.medication_name, "dosage": r.dosage, "instructions": r.instructions})
+        labs = _all_stores(lambda _a, _r, _p, lt: select(lt.id, lt.appointment_id, lt.test_name, lt.test_date, lt.results).where(lt.appointment_id.in_(list(by_id))))
+        for r in db.query(labs).order_by(labs.c.id):
+            by_id[r.appointment_id]["lab_tests"].append({"test_name": r.test_name, "test_date": r.test_date, "results": r.results})
+
+    head = {"visits": 0, "prescriptions": 0, "lab_tests": 0, "active_prescriptions": []}
+    if summary:
+        head = {"visits": summary.visits, "prescriptions": summary.prescriptions, "lab_tests": summary.lab_tests, "last_visit_at": summary.last_visit_at,
+                "last_doctor_name": doctor_name(summary.last_doctor_id), "last_diagnosis": summary.last_diagnosis, "active_prescriptions": summary.active_prescriptions or []}
+    next_cursor = f"{visits[-1]['date_time'].isoformat()}_{visits[-1]['appointment_id']}" if len(visits) == limit else None
+    return {"patient": patient, "summary": head, "visits": visits}, next_cursor
+
+
+def export_query(entity: str, date_from: date = None, date_to: date = None, department_id: int = None):
+    # flat column selects for /export; visit dates and department narrow appointments/history, and
+    # patients to those with a matching visit. Visits are not sorted: the union streams without a server-side sort
+    d = models.Doctor
+    def visits(t):
+        q = select(t.id, t.date_time, t.status, t.patient_id, t.doctor_id, t.price, t.diagnosis)
+        if date_from: q = q.where(t.date_time >= datetime.combine(date_from, time.min))
+        if date_to: q = q.where(t.date_time < datetime.combine(date_to + timedelta(days=1), time.min))
+        if department_id is not None: q = q.where(t.doctor_id.in_(select(d.id).where(d.department_id == department_id)))
+        return q
+    if entity == "patients":
+        p = models.Patient
+        q = select(p.id, p.first_name, p.last_name, p.date_of_birth, p.phone_number, p.is_active)
+        if date_from or date_to or department_id is not None: q = q.where(p.id.in_(select(_all_appointments(visits).c.patient_id)))
+        return q.order_by(p.id)
+    if entity == "appointments":
+        a = _all_appointments(visits)
+        return select(a.c.id, a.c.date_time, a.c.status, a.c.patient_id, a.c.doctor_id, d.department_id, a.c.price, a.c.diagnosis).join(d, d.id == a.c.doctor_id, isouter=True)
+    a = _all_appointments(lambda t: visits(t).where(t.status == "completed", t.diagnosis.isnot(None), t.diagnosis != ""))
+    return (select(a.c.id.label("appointment_id"), a.c.patient_id, a.c.date_time, a.c.doctor_id, (d.first_name + " " + d.last_name).label("doctor_name"), a.c.diagnosis, a.c.price)
+            .join(d, d.id == a.c.doctor_id, isouter=True))
+
+
+def _update_versioned(db: Session, model, row_id: int, values: dict, version: int = None):
+    # one UPDATE ... RETURNING: the row lock lives only for the statement, no refresh SELECT afterwards.
+    # With `version` (If-Match) a stale edit matches no row and becomes 409 instead of overwriting
+    stmt = update(model).where(model.id == row_id).values(**values, version=model.version + 1).returning(*model.__table__.c)
+    if version is not None: stmt = stmt.where(model.version == version)
+    row = db.execute(stmt).first()
+    if row is None:
+        db.rollback()
+        if version is not None and db.query(model.id).filter(model.id == row_id).first(): raise HTTPException(409, "Запис змінено іншим користувачем")
+        raise HTTPException(404, "Not found")
+    return dict(row._mapping)
 
+def update_patient(db: Session, patient_id: int, data: schemas.PatientUpdate, version: int = None):
+    values = {k: v for k, v in data.model_dump().items() if v}
+    row = _update_versioned(db, models.Patient, patient_id, values, version)
+    db.commit(); return row
 
-def update_patient(db: Session, patient_id: int, data: schemas.PatientUpdate):
-    p = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
-    if not p: raise HTTPException(404, "Not found")
-    if data.first_name: p.first_name = data.first_name
-    if data.last_name: p.last_name = data.last_name
-    if data.phone_number: p.phone_number = data.phone_number
-    db.commit(); db.refresh(p); return p
-
-def update_doctor(db: Session, doctor_id: int, data: schemas.DoctorUpdate):
-    doc = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
-    if not doc: raise HTTPException(404, "Not found")
-    if data.first_name: doc.first_name = data.first_name
-    if data.last_name: doc.last_name = data.last_name
-    if data.specialization: doc.specialization = data.specialization
-    if data.price_per_visit: doc.price_per_visit = data.price_per_visit
-    if data.availability_status:
-        doc.availability_status = data.availability_status
-        if data.availability_status == "Available" and not db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).first():
-            for day in ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця"]:
-                db.add(models.Schedule(doctor_id=doc.id, day_of_week=day, start_time=time(9,0), end_time=time(17,0)))
-    db.commit(); db.refresh(doc); return doc
+def get_doctor(db: Session, doctor_id: int):
+    # from the table, not the reference cache: edit forms need the current version for If-Match
+    row = db.query(*models.Doctor.__table__.c).filter(models.Doctor.id == doctor_id).first()
+    if not row: raise HTTPException(404, "Not found")
+    return dict(row._mapping)
+
+def update_doctor(db: Session, doctor_id: int, data: schemas.DoctorUpdate, version: int = None):
+    values = {k: v for k, v in data.model_dump().items() if v}
+    try: row = _update_versioned(db, models.Doctor, doctor_id, values, version)
+    except HTTPException as e:
+        # the stale version may come from this worker's cached list: reload it on the next read
+        if e.status_code == 409: cache.reference.invalidate("doctors")
+        raise
+    if data.availability_status == "Available" and not db.query(models.Schedule.id).filter(models.Schedule.doctor_id == doctor_id).first():
+        db.execute(insert(models.Schedule), [{"doctor_id": doctor_id, "weekday": wd, "day_of_week": WEEKDAYS[wd], "start_time": time(9,0), "end_time": time(17,0)} for wd in range(5)])
+    db.commit(); cache.reference.invalidate("doctors", "schedules"); return row
+
+def _weekday(item: schemas.ScheduleItem):
+    # items name the day either as an index (0 = Monday) or by its Ukrainian name
+    if item.weekday is not None: return item.weekday if 0 <= item.weekday < 7 else None
+    return WEEKDAYS.index(item.day_of_week) if item.day_of_week in WEEKDAYS else None
 
 def update_doctor_schedule(db: Session, doctor_id: int, data: schemas.ScheduleUpdateList):
+    sch = models.Schedule
     for item in data.schedules:
+        wd = _weekday(item)
         try: t_s = datetime.strptime(item.start_time, '%H:%M').time(); t_e = datetime.strptime(item.end_time, '%H:%M').time()
         except: continue
-        s = db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id, models.Schedule.day_of_week == item.day_of_week).first()
-        if s: s.start_time=t_s; s.end_time=t_e
-        else: db.add(models.Schedule(doctor_id=doctor_id, day_of_week=item.day_of_week, start_time=t_s, end_time=t_e))
-    db.commit(); return {"status": "Updated"}
+        if wd is None: continue
+        stmt = update(sch).where(sch.doctor_id == doctor_id, sch.weekday == wd).values(start_time=t_s, end_time=t_e, version=sch.version + 1).returning(sch.id)
+        if item.version is not None: stmt = stmt.where(sch.version == item.version)
+        if db.execute(stmt).first(): continue
+        # a versioned item expected an existing row: it changed (or vanished) since it was read
+        if item.version is not None: db.rollback(); cache.reference.invalidate("schedules"); raise HTTPException(409, f"Графік на {WEEKDAYS[wd]} змінено іншим користувачем")
+        db.execute(insert(sch).values(doctor_id=doctor_id, weekday=wd, day_of_week=WEEKDAYS[wd], start_time=t_s, end_time=t_e))
+    db.commit(); cache.reference.invalidate("schedules"); return {"status": "Updated"}
 
-def update_appointment(db: Session, appt_id: int, data: schemas.AppointmentUpdate):
-    a = db.query(models.Appointment).filter(models.Appointment.id == appt_id).first()
-    if not a: raise HTTPException(404, "Not found")
-    if data.symptoms: a.symptoms = data.symptoms
+def get_schedule_exceptions(db: Session, doctor_id: int, date_from: date = None, date_to: date = None):
+    e = models.ScheduleException
+    q = db.query(e).filter(e.doctor_id == doctor_id)
+    if date_from: q = q.filter(e.day >= date_from)
+    if date_to: q = q.filter(e.day <= date_to)
+    return q.order_by(e.day).all()
+
+def set_schedule_exceptions(db: Session, doctor_id: int, data: schemas.ScheduleExceptionCreate):
+    # one row per date of the range, replacing what was there: a vacation, a holiday or a one-off shift
+    if doctor_id not in _doctors_by_id(db): raise HTTPException(404, "Not found")
+    last = data.date_to or data.date_from
+    if last < data.date_from or (last - data.date_from).days >= MAX_EXCEPTION_DAYS: raise HTTPException(422, "Невірний період")
+    t_s = t_e = None
+    if data.start_time or data.end_time:
+        try: t_s = datetime.strptime(data.start_time, '%H:%M').time(); t_e = datetime.strptime(data.end_time, '%H:%M').time()
+        except (TypeError, ValueError): raise HTTPException(422, "Невірний формат часу")
+        if t_s >= t_e: raise HTTPException(422, "Невірний графік")
+    e = models.ScheduleException
+    db.query(e).filter(e.doctor_id == doctor_id, e.day >= data.date_from, e.day <= last).delete(synchronize_session=False)
+    db.execute(insert(e), [{"doctor_id": doctor_id, "day": data.date_from + timedelta(days=i), "start_time": t_s, "end_time": t_e, "reason": data.reason} for i in range((last - data.date_from).days + 1)])
+    db.commit(); cache.reference.invalidate("exceptions")
+    return get_schedule_exceptions(db, doctor_id, data.date_from, last)
+
+def delete_schedule_exceptions(db: Session, doctor_id: int, date_from: date, date_to: date = None):
+    e = models.ScheduleException
+    n = db.query(e).filter(e.doctor_id == doctor_id, e.day >= date_from, e.day <= (date_to or date_from)).delete(synchronize_session=False)
+    db.commit(); cache.reference.invalidate("exceptions"); return {"deleted": n}
+
+def bulk_update_schedules(db: Session, data: schemas.ScheduleBulkUpdate):
+    doc_ids = {d.doctor_id for d in data.doctors}
+    known = {r.id for r in db.query(models.Doctor.id).filter(models.Doctor.id.in_(doc_ids), models.Doctor.availability_status != "Fired")}
+    existing = {(s.doctor_id, s.weekday): s.id for s in db.query(models.Schedule.id, models.Schedule.doctor_id, models.Schedule.weekday).filter(models.Schedule.doctor_id.in_(doc_ids))}
+
+    results, updates, inserts = [], [], {}
+    for idx, d in enumerate(data.doctors):
+        if d.doctor_id not in known: results.append({"index": idx, "status": 404, "detail": "Not found"}); continue
+        try: parsed = [(_weekday(item), datetime.strptime(item.start_time, '%H:%M').time(), datetime.strptime(item.end_time, '%H:%M').time()) for item in d.schedules]
+        except ValueError: results.append({"index": idx, "status": 422, "detail": "Невірний формат часу"}); continue
+        if any(wd is None or t_s >= t_e for wd, t_s, t_e in parsed): results.append({"index": idx, "status": 422, "detail": "Невірний графік"}); continue
+        for wd, t_s, t_e in parsed:
+            s_id = existing.get((d.doctor_id, wd))
+            if s_id: updates.append({"id": s_id, "start_time": t_s, "end_time": t_e})
+            else: inserts[(d.doctor_id, wd)] = {"doctor_id": d.doctor_id, "weekday": wd, "day_of_week": WEEKDAYS[wd], "start_time": t_s, "end_time": t_e}
+        results.append({"index": idx, "status": 200})
+
+    ok = [r for r in results if r["status"] == 200]
+    if data.atomic and len(ok) < len(results):
+        for r in ok: r.update(status=424, detail="Пакет відхилено")
+        return {"succeeded": 0, "results": results}
+    if updates:
+        db.execute(update(models.Schedule), updates)
+        db.execute(update(models.Schedule).where(models.Schedule.id.in_([u["id"] for u in updates])).values(version=models.Schedule.version + 1))
+    if inserts: db.execute(insert(models.Schedule), list(inserts.values()))
+    db.commit(); cache.reference.invalidate("schedules")
+    return {"succeeded": len(ok), "results": results}
+
+def update_appointment(db: Session, appt_id: int, data: schemas.AppointmentUpdate, version: int = None):
+    # the lock-free read brings the patient for the response and the old slot for the event feed;
+    # the write itself is a single versioned UPDATE ... RETURNING
+    a, p = models.Appointment, models.Patient
+    before = db.query(a.date_time, a.doctor_id, p.id, p.first_name, p.last_name, p.date_of_birth, p.phone_number, p.is_active, p.version).join(p, p.id == a.patient_id).filter(a.id == appt_id).first()
+    if not before: raise HTTPException(404, "Not found")
+    values = {}
+    if data.symptoms: values["symptoms"] = data.symptoms
     if data.date_time:
         if data.date_time < get_kyiv_time().replace(tzinfo=None): raise HTTPException(400, "Минулий час")
-        if db.query(models.Appointment).filter(models.Appointment.doctor_id==a.doctor_id, models.Appointment.date_time==data.date_time, models.Appointment.status!='cancelled', models.Appointment.id!=appt_id).first():
-            raise HTTPException(409, "Зайнято")
-        a.date_time = data.date_time
-    db.commit(); db.refresh(a); return a
+        # same grid as create_appointment: the unique index only catches an exact (doctor, time) match
+        cal = _calendar(db, before.doctor_id)
+        if cal is None: raise HTTPException(404, "Doctor unavailable")
+        if err := _slot_error(cal, data.date_time): raise HTTPException(400, err)
+        values["date_time"] = data.date_time
+    try: row = _update_versioned(db, a, appt_id, values, version); db.commit()
+    except IntegrityError: db.rollback(); raise HTTPException(409, "Зайнято")
+    if row["date_time"] != before.date_time: events.publish_slot("rescheduled", appt_id, row["doctor_id"], before.date_time, row["status"], is_free=True)
+    events.publish_slot("rescheduled" if row["date_time"] != before.date_time else "updated", appt_id, row["doctor_id"], row["date_time"], row["status"])
+    return {**row, "patient": {k: v for k, v in before._mapping.items() if k not in ("date_time", "doctor_id")}}
 
 def cancel_appointment(db: Session, appt_id: int):
-    a = db.query(models.Appointment).filter(models.Appointment.id == appt_id).first()
+    A = models.Appointment
+    a = db.query(A).filter(A.id == appt_id).first()
     if not a: raise HTTPException(404, "Not found")
-    a.status = "cancelled"; a.symptoms = (a.symptoms or "") + " [СКАСОВАНО]"; db.commit(); return {"status": "cancelled"}
+    # a repeated (or concurrent) cancel changes nothing and must not publish a second freed slot
+    already = HTTPException(409, "Прийом уже скасовано")
+    if a.status == "cancelled": raise already
+    if not db.query(A).filter(A.id == a.id, A.status == a.status).update({A.status: "cancelled", A.symptoms: func.coalesce(A.symptoms, "") + " [СКАСОВАНО]", A.version: A.version + 1}, synchronize_session=False): db.rollback(); raise already
+    if a.status == "completed":
+        _bump_doctor_stats(db, a.doctor_id, a.date_time.date(), -1, -(a.price or 0.0))
+        rebuild_patient_summaries(db, [a.patient_id])
+    slot = (a.id, a.doctor_id, a.date_time)
+    db.commit()
+    events.publish_slot("cancelled", *slot, "cancelled", is_free=True)
+    return {"status": "cancelled"}
+
+def get_waitlist(db: Session, patient_id: int = None, doctor_id: int = None, status: str = None):
+    w = models.WaitlistEntry
+    q = db.query(w)
+    if patient_id: q = q.filter(w.patient_id == patient_id)
+    if doctor_id: q = q.filter(w.doctor_id == doctor_id)
+    if status: q = q.filter(w.status == status)
+    return q.order_by(w.priority.desc(), w.created_at, w.id).all()
+
+def create_waitlist_entry(db: Session, data: schemas.WaitlistCreate):
+    if not data.doctor_id and not data.specialization: raise HTTPException(422, "Вкажіть лікаря або спеціалізацію")
+    today = get_kyiv_time().date()
+    first, last = max(data.date_from, today), data.date_to or data.date_from
+    if last < first or (last - first).days >= MAX_AVAILABILITY_DAYS: raise HTTPException(422, "Невірний період")
+    if data.doctor_id and data.doctor_id not in _doctors_by_id(db): raise HTTPException(404, "Doctor unavailable")
+    if not db.query(models.Patient.id).filter(models.Patient.id == data.patient_id, models.Patient.is_active == True).first(): raise HTTPException(400, "Patient inactive")
+    entry = models.WaitlistEntry(patient_id=data.patient_id, doctor_id=data.doctor_id, specialization=None if data.doctor_id else data.specialization, date_from=first, date_to=last,
+                                 priority=data.priority, note=data.note, status="waiting", created_at=get_kyiv_time())
+    db.add(entry); db.commit(); db.refresh(entry)
+    # a slot may be open already; later openings reach the entry through the waitlist worker
+    if fill_waitlist_entry(db, entry): db.refresh(entry)
+    return entry
+
+def cancel_waitlist_entry(db: Session, entry_id: int):
+    w = models.WaitlistEntry
+    entry = db.query(w).filter(w.id == entry_id).first()
+    if not entry: raise HTTPException(404, "Not found")
+    if entry.status != "waiting": raise HTTPException(409, "Запис уже не в черзі")
+    entry.status = "cancelled"; db.commit(); db.refresh(entry); return entry
+
+def _book_from_waitlist(db: Session, entry_id: int, patient_id: int, doctor_id: int, date_time: datetime, note: str = None):
+    # the create_appointment rules, then the entry claim and the booking in one transaction: a lost race
+    # (entry served elsewhere, slot retaken) leaves both untouched. Returns the appointment id or None
+    try: _check_booking(db, schemas.AppointmentCreate(patient_id=patient_id, doctor_id=doctor_id, date_time=date_time))
+    except HTTPException: db.rollback(); return None
+    w = models.WaitlistEntry
+    if not db.query(w).filter(w.id == entry_id, w.status == "waiting").update({w.status: "booked"}, synchronize_session=False): db.rollback(); return None
+    appt = models.Appointment(patient_id=patient_id, doctor_id=doctor_id, date_time=date_time, symptoms=note or "Лист очікування", status="scheduled")
+    db.add(appt)
+    try: db.flush()
+    except IntegrityError: db.rollback(); return None
+    appt_id = appt.id
+    db.query(w).filter(w.id == entry_id).update({w.appointment_id: appt_id}, synchronize_session=False)
+    db.commit()
+    events.publish_slot("booked", appt_id, doctor_id, date_time, "scheduled")
+    return appt_id
+
+def allocate_slot(db: Session, doctor_id: int, date_time: datetime):
+    # a freed slot goes to the first waiting entry for this doctor or, without a doctor, its specialization
+    doc = _doctors_by_id(db).get(doctor_id)
+    if not doc: return None
+    w, p, day = models.WaitlistEntry, models.Patient, date_time.date()
+    match = or_(w.doctor_id == doctor_id, and_(w.doctor_id.is_(None), w.specialization == doc["specialization"]))
+    candidates = db.query(w.id, w.patient_id, w.note).join(p, p.id == w.patient_id).filter(w.status == "waiting", p.is_active == True, w.date_from <= day, w.date_to >= day, match)
+    for c in candidates.order_by(w.priority.desc(), w.created_at, w.id).limit(WAITLIST_CANDIDATES).all():
+        appt_id = _book_from_waitlist(db, c.id, c.patient_id, doctor_id, date_time, c.note)
+        if appt_id: return appt_id
+        # a retaken slot ends the round; an entry served elsewhere just passes it to the next one
+        if db.query(models.Appointment.id).filter(models.Appointment.doctor_id == doctor_id, models.Appointment.date_time == date_time, models.Appointment.status != "cancelled").first(): return None
+    return None
+
+def fill_waitlist_entry(db: Session, entry):
+    # earliest open slot in the entry's window, from the same computation as GET /availability
+    doc = _doctors_by_id(db).get(entry.doctor_id) if entry.doctor_id else None
+    if entry.doctor_id and not doc: return None
+    for slot in get_availability(db, doc["specialization"] if doc else entry.specialization, None, entry.date_from, entry.date_to):
+        if entry.doctor_id and slot["doctor_id"] != entry.doctor_id: continue
+        return _book_from_waitlist(db, entry.id, entry.patient_id, slot["doctor_id"], slot["date_time"], entry.note)
+    return None
+
+def sweep_waitlist(db: Session, limit: int = WAITLIST_SWEEP_LIMIT):
+    # periodic pass behind the event feed: expires past windows and serves slots freed by other workers
+    w = models.WaitlistEntry
+    db.query(w).filter(w.status == "waiting", w.date_to < get_kyiv_time().date()).update({w.status: "expired"}, synchronize_session=False); db.commit()
+    entries = db.query(w.id, w.patient_id, w.doctor_id, w.specialization, w.date_from, w.date_to, w.note).filter(w.status == "waiting").order_by(w.priority.desc(), w.created_at, w.id).limit(limit).all()
+    return sum(1 for e in entries if fill_waitlist_entry(db, e))
 
 
 def complete_appointment(db: Session, appointment_id: int, data: schemas.DiagnosisCreate):
     try:
         appt = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
         if not appt: raise HTTPException(404, "Appointment not found")
-        
-        appt.status = "completed"
+
+        # conditional update so a repeated/concurrent completion is counted in stats only once
+        price = db.query(models.Doctor.price_per_visit).filter(models.Doctor.id == appt.doctor_id).scalar() or 0.0
+        first = db.query(models.Appointment).filter(models.Appointment.id == appt.id, models.Appointment.status != "completed").update({models.Appointment.status: "completed", models.Appointment.price: price, models.Appointment.version: models.Appointment.version + 1})
+        if first: _bump_doctor_stats(db, appt.doctor_id, appt.date_time.date(), 1, price)
         appt.diagnosis = data.diagnosis
         
         existing_record = db.query(models.MedicalRecord).filter(models.MedicalRecord.appointment_id == appt.id).first()
@@ -221,38 +634,135 @@ def complete_appointment(db: Session, appointment_id: int, data: schemas.Diagnos
             db.flush()
             med_record_id = med_record.id
         
-        for item in data.prescriptions:
-            med_name = item.medication_name.strip()
-            med = db.query(models.Medication).filter(models.Medication.medication_name == med_name).first()
-            if not med:
-                med = models.Medication(medication_name=med_name, manufacturer="Інше", description="Авто")
-                db.add(med); db.flush()
-            
-            db.add(models.Prescription(
-                appointment_id=appt.id, 
-                record_id=med_record_id, 
-                medication_id=med.medication_id, 
-                dosage=item.dosage, 
-                instructions=item.instructions
-            ))
+        meds, new_meds = _resolve_medications(db, [item.medication_name for item in data.prescriptions])
+        items = [(meds[item.medication_name.strip().lower()], item) for item in data.prescriptions if item.medication_name.strip()]
+        rows = [{"appointment_id": appt.id, "record_id": med_record_id, "medication_id": med_id, "dosage": item.dosage, "instructions": item.instructions} for (med_id, _), item in items]
+        if rows: db.execute(insert(models.Prescription), rows)
+        # catalogue spelling, as the timeline shows it, not the one typed on this visit
+        active = [{"medication_name": name, "dosage": item.dosage, "instructions": item.instructions} for (_, name), item in items]
+        if existing_record:
+            # completing again appends prescriptions, so the header lists everything on this visit
+            active = [{"medication_name": n, "dosage": d, "instructions": i} for n, d, i in db.query(models.Medication.medication_name, models.Prescription.dosage, models.Prescription.instructions).join(models.Medication, models.Medication.medication_id == models.Prescription.medication_id).filter(models.Prescription.appointment_id == appt.id).order_by(models.Prescription.id)]
+        _bump_patient_summary(db, appt.patient_id, appt.date_time, {"last_appointment_id": appt.id, "last_doctor_id": appt.doctor_id, "last_diagnosis": data.diagnosis, "active_prescriptions": active}, 1 if first else 0, len(rows))
+        slot = (appt.id, appt.doctor_id, appt.date_time)
         db.commit()
+        if new_meds: cache.reference.invalidate("medications")
+        events.publish_slot("completed", *slot, "completed")
         return {"status": "success"}
     except Exception as e: db.rollback(); raise e
 
+def _enqueue_job(db: Session, kind: str, params: dict):
+    # committed together with the change that needs it; app/jobs.py runs it after the response
+    job = models.Job(kind=kind, params=params, status="queued", processed=0, created_at=get_kyiv_time())
+    db.add(job); db.flush(); return job
+
+def get_job(db: Session, job_id: int):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if not job: raise HTTPException(404, "Not found")
+    return job
+
+def cancel_scheduled(db: Session, filters, note: str, is_free: bool = True, batch_size: int = CASCADE_BATCH_SIZE):
+    # set-based cascade for jobs: one UPDATE ... RETURNING per batch of matching scheduled visits. Yields
+    # the batch size so the caller records progress and commits, then publishes the freed slots
+    a = models.Appointment
+    batch = select(a.id).where(*filters, a.status == "scheduled").order_by(a.id).limit(batch_size)
+    while True:
+        stmt = update(a).where(a.id.in_(batch), a.status == "scheduled").values(status="cancelled", symptoms=func.coalesce(a.symptoms, "") + note, version=a.version + 1)
+        rows = db.execute(stmt.returning(a.id, a.doctor_id, a.date_time).execution_options(synchronize_session=False)).all()
+        if not rows: return
+        yield len(rows)
+        for r in rows: events.publish_slot("cancelled", r.id, r.doctor_id, r.date_time, "cancelled", is_free=is_free)
+
 def soft_delete_patient(db: Session, patient_id: int):
-    p = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
-    if not p: raise HTTPException(404, "Not found")
-    p.is_active = False
-    for a in db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id, models.Appointment.status == "scheduled").all():
-        a.status = "cancelled"; a.symptoms = (a.symptoms or "") + " [DELETED]"
-    db.commit(); return {"status": "deactivated"}
+    # the patient row and the waitlist change in the request; scheduled visits are cancelled by a job
+    p = models.Patient
+    if not db.query(p).filter(p.id == patient_id).update({p.is_active: False, p.version: p.version + 1}, synchronize_session=False): raise HTTPException(404, "Not found")
+    db.query(models.WaitlistEntry).filter(models.WaitlistEntry.patient_id == patient_id, models.WaitlistEntry.status == "waiting").update({models.WaitlistEntry.status: "cancelled"}, synchronize_session=False)
+    job = _enqueue_job(db, "cancel_patient_appointments", {"patient_id": patient_id})
+    db.commit()
+    return {"status": "deactivated", "job_id": job.id}
 
 def delete_doctor(db: Session, doctor_id: int):
-    d = db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
-    if not d: raise HTTPException(404, "Not found")
-    d.availability_status = "Fired"
-    db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).delete()
-    db.commit(); return {"status": "Fired"}
-
-def get_top_doctors(db: Session):
-    return db.query(models.Doctor.last_name, models.Doctor.specialization, func.count(models.Appointment.id).label("total_visits"), func.sum(models.Doctor.price_per_visit).label("total_revenue")).join(models.Appointment).filter(models.Appointment.status == 'completed').group_by(models.Doctor.id).order_by(func.sum(models.Doctor.price_per_visit).desc()).all()
\ No newline at end of file
+    d = models.Doctor
+    if not db.query(d).filter(d.id == doctor_id).update({d.availability_status: "Fired", d.version: d.version + 1}, synchronize_session=False): raise HTTPException(404, "Not found")
+    db.query(models.Schedule).filter(models.Schedule.doctor_id == doctor_id).delete(synchronize_session=False)
+    db.commit(); cache.reference.invalidate("doctors", "schedules"); return {"status": "Fired"}
+
+def _bump_doctor_stats(db: Session, doctor_id: int, day: date, visits: int, revenue: float):
+    st = models.DoctorDailyStats
+    upd = lambda: db.query(st).filter(st.doctor_id == doctor_id, st.day == day).update({st.total_visits: st.total_visits + visits, st.total_revenue: st.total_revenue + revenue}, synchronize_session=False)
+    if upd(): return
+    try:
+        with db.begin_nested(): db.add(st(doctor_id=doctor_id, day=day, total_visits=visits, total_revenue=revenue))
+    except IntegrityError: upd()
+
+def _bump_patient_summary(db: Session, patient_id: int, visit_at: datetime, last: dict, visits: int, prescriptions: int):
+    # counters always move; last_* only when this visit is not older than the one already recorded
+    ps = models.PatientSummary
+    counts = lambda: db.query(ps).filter(ps.patient_id == patient_id).update({ps.visits: ps.visits + visits, ps.prescriptions: ps.prescriptions + prescriptions}, synchronize_session=False)
+    if not counts():
+        try:
+            with db.begin_nested(): db.add(ps(patient_id=patient_id, visits=visits, prescriptions=prescriptions, lab_tests=0, last_visit_at=visit_at, **last)); return
+        except IntegrityError: counts()
+    db.query(ps).filter(ps.patient_id == patient_id, or_(ps.last_visit_at.is_(None), ps.last_visit_at <= visit_at)).update({ps.last_visit_at: visit_at, **{getattr(ps, k): v for k, v in last.items()}}, synchronize_session=False)
+
+def rebuild_patient_summaries(db: Session, patient_ids=None):
+    # set-based recount from hot and archive tables; the caller commits. Active prescriptions of the last
+    # visits are filled in chunks with bulk updates by primary key
+    ps, m = models.PatientSummary, models.Medication
+    scope = (lambda col: col.in_(patient_ids)) if patient_ids is not None else (lambda col: True)
+    db.query(ps).filter(scope(ps.patient_id)).delete(synchronize_session=False)
+    a = _all_appointments(lambda t: select(t.id, t.patient_id, t.doctor_id, t.date_time, t.diagnosis).where(t.status == "completed", t.patient_id.isnot(None), scope(t.patient_id)))
+    ranked = select(a, func.row_number().over(partition_by=a.c.patient_id, order_by=(a.c.date_time.desc(), a.c.id.desc())).label("rn"), func.count().over(partition_by=a.c.patient_id).label("n")).subquery()
+    db.execute(insert(ps).from_select(["patient_id", "visits", "prescriptions", "lab_tests", "last_visit_at", "last_appointment_id", "last_doctor_id", "last_diagnosis"],
+                                      select(ranked.c.patient_id, ranked.c.n, literal(0), literal(0), ranked.c.date_time, ranked.c.id, ranked.c.doctor_id, ranked.c.diagnosis).where(ranked.c.rn == 1)))
+    for column, child in ((ps.prescriptions, lambda pr, lt: pr), (ps.lab_tests, lambda pr, lt: lt)):
+        rows = _all_stores(lambda t, _r, pr, lt: select(t.patient_id).join(child(pr, lt), child(pr, lt).appointment_id == t.id).where(t.status == "completed", scope(t.patient_id)))
+        counted = select(func.count()).select_from(rows).where(rows.c.patient_id == ps.patient_id).scalar_subquery()
+        db.query(ps).filter(scope(ps.patient_id)).update({column: counted}, synchronize_session=False)
+    last = db.query(ps.patient_id, ps.last_appointment_id).filter(scope(ps.patient_id)).all()
+    for i in range(0, len(last), ARCHIVE_BATCH_SIZE):
+        chunk = dict((appt_id, pid) for pid, appt_id in last[i:i + ARCHIVE_BATCH_SIZE])
+        rx = _all_stores(lambda _a, _r, pr, _l: select(pr.id, pr.appointment_id, pr.medication_id, pr.dosage, pr.instructions).where(pr.appointment_id.in_(list(chunk))))
+        active = {pid: [] for pid in chunk.values()}
+        for r in db.query(rx.c.appointment_id, m.medication_name, rx.c.dosage, rx.c.instructions).join(m, m.medication_id == rx.c.medication_id).order_by(rx.c.id):
+            active[chunk[r.appointment_id]].append({"medication_name": r.medication_name, "dosage": r.dosage, "instructions": r.instructions})
+        db.execute(update(ps), [{"patient_id": pid, "active_prescriptions": items} for pid, items in active.items()])
+    return len(last)
+
+def rebuild_doctor_stats(db: Session):
+    st = models.DoctorDailyStats
+    # visits completed before prices were captured are valued at the doctor's current price
+    for t in (models.Appointment, models.AppointmentArchive):
+        db.query(t).filter(t.status == "completed", t.price.is_(None)).update({t.price: select(models.Doctor.price_per_visit).where(models.Doctor.id == t.doctor_id).scalar_subquery()}, synchronize_session=False)
+    db.query(st).delete(synchronize_session=False)
+    a = _all_appointments(lambda t: select(t.id, t.doctor_id, t.date_time, t.price).where(t.status == "completed", t.doctor_id.isnot(None)))
+    day = func.date(a.c.date_time)
+    db.execute(insert(st).from_select(["doctor_id", "day", "total_visits", "total_revenue"], select(a.c.doctor_id, day, func.count(a.c.id), func.coalesce(func.sum(a.c.price), 0.0)).group_by(a.c.doctor_id, day)))
+    db.commit()
+    return db.query(st).count()
+
+def get_top_doctors(db: Session, date_from: date = None, date_to: date = None):
+    st = models.DoctorDailyStats
+    q = db.query(models.Doctor.last_name, models.Doctor.specialization, func.sum(st.total_visits).label("total_visits"), func.sum(st.total_revenue).label("total_revenue")).join(st, st.doctor_id == models.Doctor.id)
+    if date_from: q = q.filter(st.day >= date_from)
+    if date_to: q = q.filter(st.day <= date_to)
+    return q.group_by(models.Doctor.id).having(func.sum(st.total_visits) > 0).order_by(func.sum(st.total_revenue).desc()).all()
+
+def archive_appointments(db: Session, before: datetime, batch_size: int = ARCHIVE_BATCH_SIZE, pause: float = 0.0):
+    # moves finished visits older than `before` (with their records, prescriptions and lab tests) to the
+    # *_archive tables; one short transaction per batch, so live bookings never wait on a long lock
+    a = models.Appointment
+    moved = 0
+    while True:
+        ids = [r[0] for r in db.query(a.id).filter(a.date_time < before, a.status != "scheduled").order_by(a.id).limit(batch_size)]
+        if not ids: return moved
+        for hot, cold, key in ((a, models.AppointmentArchive, a.id), (models.MedicalRecord, models.MedicalRecordArchive, models.MedicalRecord.appointment_id),
+                               (models.Prescription, models.PrescriptionArchive, models.Prescription.appointment_id), (models.LabTest, models.LabTestArchive, models.LabTest.appointment_id)):
+            cols = [c.name for c in hot.__table__.columns]
+            db.execute(insert(cold).from_select(cols, select(*hot.__table__.c).where(key.in_(ids))))
+        for hot in (models.Prescription, models.LabTest, models.MedicalRecord):
+            db.execute(delete(hot).where(hot.appointment_id.in_(ids)))
+        db.execute(delete(a).where(a.id.in_(ids)))
+        db.commit(); moved += len(ids)
+        if pause: sleep(pause)
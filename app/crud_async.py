@@ -0,0 +1,32 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud
+
+
+# Each coroutine runs the sync crud function on the AsyncSession's connection via run_sync,
+# so validation rules stay in one place while I/O goes through the async driver.
+# `load` names relationships the response model reads; they must be loaded inside run_sync.
+def _async(fn, load=()):
+    def call(db, *args, **kwargs):
+        res = fn(db, *args, **kwargs)
+        for attr in load: getattr(res, attr)
+        return res
+    async def wrapper(db: AsyncSession, *args, **kwargs): return await db.run_sync(call, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = fn.__name__
+    return wrapper
+
+
+get_departments = _async(crud.get_departments)
+get_doctors = _async(crud.get_doctors)
+get_medications = _async(crud.get_medications)
+get_patients = _async(crud.get_patients)
+get_doctor_schedule_settings = _async(crud.get_doctor_schedule_settings)
+get_slots_for_doctor = _async(crud.get_slots_for_doctor)
+get_availability = _async(crud.get_availability)
+get_doctor_appointments = _async(crud.get_doctor_appointments)
+get_patient_history = _async(crud.get_patient_history)
+get_top_doctors = _async(crud.get_top_doctors)
+create_appointment = _async(crud.create_appointment, load=("patient",))
+bulk_create_appointments = _async(crud.bulk_create_appointments)
+update_appointment = _async(crud.update_appointment)
+cancel_appointment = _async(crud.cancel_appointment)
+complete_appointment = _async(crud.complete_appointment)
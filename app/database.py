@@ -1,12 +1,62 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
+import time
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", "5"))
+PRIMARY_COOKIE = "db_primary_until"
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
 
-engine = create_engine(DATABASE_URL)
+
+def async_url(url: str):
+    scheme, rest = url.split("://", 1)
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0])
+    return f"{driver}://{rest}" if driver else None
+
+def engine_options(url: str, is_async: bool = False):
+    opts = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.startswith("sqlite"): return opts
+    opts.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    if DB_STATEMENT_TIMEOUT_MS and url.startswith("postgresql"):
+        opts["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}} if is_async else {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return opts
+
+
+# async mode: DB_ASYNC=1 derives the driver URL from DATABASE_URL, ASYNC_DATABASE_URL overrides it
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (async_url(DATABASE_URL) if DATABASE_URL and os.getenv("DB_ASYNC") == "1" else None)
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# optional streaming replica for read-only endpoints; info["primary"] lets code that fills process-wide
+# caches go to the primary instead of a lagging copy
+replica_engine = None
+ReadSessionLocal = None
+if REPLICA_DATABASE_URL:
+    replica_engine = create_engine(REPLICA_DATABASE_URL, **engine_options(REPLICA_DATABASE_URL))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, info={"primary": SessionLocal})
+
+async_engine = None
+AsyncSessionLocal = None
+async_replica_engine = None
+AsyncReadSessionLocal = None
+if ASYNC_DATABASE_URL:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    # the async reads follow the same replica routing; reference caches still load through the sync primary
+    ASYNC_REPLICA_DATABASE_URL = os.getenv("ASYNC_REPLICA_DATABASE_URL") or (async_url(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None)
+    if ASYNC_REPLICA_DATABASE_URL:
+        async_replica_engine = create_async_engine(ASYNC_REPLICA_DATABASE_URL, **engine_options(ASYNC_REPLICA_DATABASE_URL, is_async=True))
+        AsyncReadSessionLocal = async_sessionmaker(async_replica_engine, autoflush=False, expire_on_commit=False, info={"primary": SessionLocal})
+
 Base = declarative_base()
 
 def get_db():
@@ -14,4 +64,60 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def route_read(request: Request, primary, replica):
+    # a client that wrote within READ_AFTER_WRITE_SECONDS keeps reading its own writes from the primary
+    if replica is None: return primary
+    try: sticky = float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError: sticky = False
+    return primary if sticky else replica
+
+def get_read_db(request: Request):
+    db = route_read(request, SessionLocal, ReadSessionLocal)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(request: Request):
+    async with route_read(request, AsyncSessionLocal, AsyncReadSessionLocal)() as db:
+        yield db
+
+def get_session_factory():
+    # for work that outlives the request scope (streamed responses), which opens its own sessions
+    return SessionLocal
+
+def get_read_session_factory(request: Request):
+    return route_read(request, SessionLocal, ReadSessionLocal)
+
+
+class ReadYourWrites:
+    # ASGI wrapper: a successful write response sets a short-lived cookie that pins the client's reads
+    # to the primary until the replica has caught up
+    def __init__(self, app, seconds: float = READ_AFTER_WRITE_SECONDS):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"): return await self.app(scope, receive, send)
+        async def mark(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = f"{PRIMARY_COOKIE}={time.time() + self.seconds:.3f}; Max-Age={int(self.seconds) or 1}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = [*message.get("headers", []), (b"set-cookie", cookie.encode())]
+            await send(message)
+        await self.app(scope, receive, mark)
+
+def warm_pool(n: int = DB_POOL_SIZE):
+    # open up to `n` pooled connections at once so the first concurrent requests skip the connect handshake
+    conns = []
+    try:
+        for e in filter(None, (engine, replica_engine)):
+            for _ in range(max(1, min(n, DB_POOL_SIZE))): conns.append(e.connect())
+        conns[0].execute(text("SELECT 1"))
+    finally:
+        for c in conns: c.close()
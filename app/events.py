@@ -0,0 +1,80 @@
+import asyncio
+import json
+import threading
+
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+FREED = "freed"  # topic with every slot that became free, for the waitlist worker
+
+
+# In-process pub/sub for slot changes. Write paths publish after commit from any thread (sync endpoints
+# run on the threadpool); each subscriber is an asyncio.Queue on the loop that created it. A deployment
+# with several workers swaps `broker` for an object with the same publish/subscribe interface that relays
+# through an external bus (Redis pub/sub, Postgres LISTEN/NOTIFY).
+class Subscription:
+    def __init__(self, broker, topic):
+        self.broker = broker
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def offer(self, event):
+        # a consumer this far behind reloads its view instead of replaying every delta
+        if self.queue.full():
+            while not self.queue.empty(): self.queue.get_nowait()
+            event = {"type": "resync"}
+        self.queue.put_nowait(event)
+
+    async def get(self): return await self.queue.get()
+
+    def close(self): self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subs = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic) -> Subscription:
+        sub = Subscription(self, topic)
+        with self._lock: self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subs.get(sub.topic)
+            if subs:
+                subs.discard(sub)
+                if not subs: del self._subs[sub.topic]
+
+    def publish(self, topic, event):
+        with self._lock: subs = list(self._subs.get(topic, ()))
+        for sub in subs:
+            try: sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError: self.unsubscribe(sub)  # loop already closed
+
+    def subscribers(self): return sum(len(s) for s in self._subs.values())
+
+
+broker = LocalBroker()
+
+
+def publish_slot(kind: str, appointment_id: int, doctor_id: int, date_time, status: str, is_free: bool = False):
+    # delta for one slot of a doctor's day; is_free tells a booking page whether the slot reopened
+    event = {"type": kind, "appointment_id": appointment_id, "doctor_id": doctor_id, "date": date_time.date().isoformat(),
+             "time": date_time.strftime("%H:%M"), "status": status, "is_free": is_free}
+    broker.publish(doctor_id, event)
+    if is_free: broker.publish(FREED, event)
+
+
+async def stream(doctor_id: int, day=None):
+    # Server-Sent Events for one doctor (optionally one day); comments keep idle proxies from closing it
+    sub = broker.subscribe(doctor_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try: event = await asyncio.wait_for(sub.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError: yield ": ping\n\n"; continue
+            if day is not None and event.get("date") not in (None, day.isoformat()): continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally: sub.close()
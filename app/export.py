@@ -0,0 +1,43 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from fastapi.responses import StreamingResponse
+from . import crud
+
+EXPORT_CHUNK = 5000
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _cell(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+def _csv(columns, partitions):
+    buf = io.StringIO(); writer = csv.writer(buf)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows([_cell(v) for v in row] for row in rows)
+        yield buf.getvalue(); buf.seek(0); buf.truncate()
+    if buf.tell(): yield buf.getvalue()
+
+def _ndjson(columns, partitions):
+    for rows in partitions:
+        yield "".join(json.dumps(dict(zip(columns, map(_cell, row))), ensure_ascii=False) + "\n" for row in rows)
+
+
+def rows(session_factory, stmt, fmt: str):
+    # runs after the endpoint has returned, so it owns its session; yield_per keeps a server-side
+    # cursor on Postgres and only EXPORT_CHUNK rows in memory at a time
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK))
+        encode = _csv if fmt == "csv" else _ndjson
+        for chunk in encode(list(result.keys()), result.partitions()): yield chunk.encode()
+    finally: db.close()
+
+
+def stream(session_factory, entity: str, fmt: str, date_from: date = None, date_to: date = None, department_id: int = None):
+    # a sync iterator: Starlette pulls it on the threadpool, so a long export does not hold the event loop
+    stmt = crud.export_query(entity, date_from, date_to, department_id)
+    filename = f"{entity}-{date.today().isoformat()}.{fmt}"
+    return StreamingResponse(rows(session_factory, stmt, fmt), media_type=MEDIA_TYPES[fmt], headers={"Content-Disposition": f'attachment; filename="{filename}"'})
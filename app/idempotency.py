@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from . import database, models
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1") == "1"
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")  # memory | db
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))  # db store: an unfinished first request older than this was lost
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1 << 20)))
+HEADER = b"idempotency-key"
+UNSAFE = {"POST", "PUT", "PATCH", "DELETE"}
+SKIP_HEADERS = {"set-cookie", "server-timing"}
+
+
+# A store maps "<client> <method> <path> <key>" to the fingerprint of the first request body and, once it has
+# finished, its response (status, headers, body). reserve() answers one of: "new" (caller executes and
+# then calls complete() or release()), "replay" (with the stored response), "busy" (the first request is
+# still running) or "mismatch" (the key was used with another body).
+class MemoryStore:
+    blocking = False
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS, ttl: float = IDEMPOTENCY_TTL):
+        self.max_keys, self.ttl = max_keys, ttl
+        self.hits = self.misses = self.evictions = self.expirations = self.conflicts = 0
+        self._data = OrderedDict()  # key -> [expires_at, fingerprint, response or None], LRU order
+        self._lock = threading.Lock()
+
+    def reserve(self, key: str, fingerprint: str):
+        now = time.monotonic()
+        with self._lock:
+            while self._data:
+                oldest = next(iter(self._data.values()))
+                if oldest[0] > now: break
+                self._data.popitem(last=False); self.expirations += 1
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                # replays move a key to the LRU tail without extending it, so the head sweep can miss it
+                del self._data[key]; self.expirations += 1; entry = None
+            if entry is None:
+                self._data[key] = [now + self.ttl, fingerprint, None]
+                while len(self._data) > self.max_keys: self._data.popitem(last=False); self.evictions += 1
+                self.misses += 1
+                return "new", None
+            self._data.move_to_end(key)
+            if entry[1] != fingerprint: return "mismatch", None
+            if entry[2] is None: self.conflicts += 1; return "busy", None
+            self.hits += 1
+            return "replay", entry[2]
+
+    def complete(self, key: str, response):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None: entry[2] = response
+
+    def release(self, key: str):
+        with self._lock: self._data.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"store": "memory", "hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions, "expirations": self.expirations, "conflicts": self.conflicts, "entries": len(self._data)}
+
+
+class TableStore(MemoryStore):
+    # the same protocol over the idempotency_keys table, shared by every worker; one short transaction per call
+    blocking = True
+
+    def __init__(self, engine, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE_SECONDS):
+        super().__init__(0, ttl)
+        self.engine, self.lease = engine, lease
+
+    def reserve(self, key: str, fingerprint: str):
+        t = models.IdempotencyKey.__table__
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            self.expirations += conn.execute(delete(t).where(t.c.key == key, t.c.created_at < now - timedelta(seconds=self.ttl))).rowcount or 0
+            row = conn.execute(select(t.c.fingerprint, t.c.status, t.c.headers, t.c.body, t.c.created_at).where(t.c.key == key)).first()
+            if row is None:
+                try:
+                    with conn.begin_nested(): conn.execute(insert(t).values(key=key, fingerprint=fingerprint, created_at=now))
+                except IntegrityError: self.conflicts += 1; return "busy", None
+                self.misses += 1
+                return "new", None
+            if row.status is None and row.created_at < now - timedelta(seconds=self.lease):
+                # the first request died without complete()/release(): the retry takes the key over,
+                # guarded by the old created_at so only one retry wins
+                taken = conn.execute(update(t).where(t.c.key == key, t.c.status.is_(None), t.c.created_at == row.created_at).values(fingerprint=fingerprint, created_at=now)).rowcount
+                if taken: self.misses += 1; return "new", None
+                self.conflicts += 1; return "busy", None
+        if row.fingerprint != fingerprint: return "mismatch", None
+        if row.status is None: self.conflicts += 1; return "busy", None
+        self.hits += 1
+        return "replay", (row.status, row.headers, row.body)
+
+    def complete(self, key: str, response):
+        t = models.IdempotencyKey.__table__
+        status, headers, body = response
+        with self.engine.begin() as conn: conn.execute(update(t).where(t.c.key == key).values(status=status, headers=headers, body=body))
+
+    def release(self, key: str):
+        t = models.IdempotencyKey.__table__
+        with self.engine.begin() as conn: conn.execute(delete(t).where(t.c.key == key, t.c.status.is_(None)))
+
+    def purge(self):
+        t = models.IdempotencyKey.__table__
+        with self.engine.begin() as conn: return conn.execute(delete(t).where(t.c.created_at < datetime.utcnow() - timedelta(seconds=self.ttl))).rowcount
+
+    def stats(self): return {**super().stats(), "store": "db", "entries": None}
+
+
+def default_store():
+    if IDEMPOTENCY_STORE == "db":
+        return TableStore(database.engine)
+    return MemoryStore()
+
+
+store = default_store() if IDEMPOTENCY_ENABLED else None
+
+
+async def _plain(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _client(scope):
+    # whose key it is: a hash of the Authorization header when the request carries one, else the peer
+    # address, so another client reusing a guessed key executes its own request instead of a replay
+    auth = next((v for k, v in scope["headers"] if k == b"authorization"), None)
+    who = auth or (scope.get("client") or ("",))[0].encode()
+    return hashlib.sha256(who).hexdigest()[:16]
+
+
+class IdempotencyMiddleware:
+    # ASGI: an unsafe request with an Idempotency-Key runs once; a retry with the same key and body gets
+    # the stored response (marked Idempotent-Replayed) without reaching the endpoint. 5xx and oversized
+    # responses are not stored, so the retry executes again
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.store = backend or store or default_store()
+
+    async def _call(self, fn, *args):
+        return await run_in_threadpool(fn, *args) if self.store.blocking else fn(*args)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in UNSAFE: return await self.app(scope, receive, send)
+        key = next((v for k, v in scope["headers"] if k == HEADER), None)
+        if not key: return await self.app(scope, receive, send)
+        if len(key) > 255: return await _plain(send, 400, "Занадто довгий Idempotency-Key")
+
+        chunks, more = [], True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect": return
+            chunks.append(message.get("body", b"")); more = message.get("more_body", False)
+        body = b"".join(chunks)
+        slot = f"{_client(scope)} {scope['method']} {scope['path']} {key.decode('latin-1')}"
+        state, stored = await self._call(self.store.reserve, slot, hashlib.sha256(body).hexdigest())
+        if state == "mismatch": return await _plain(send, 422, "Idempotency-Key вже використано для іншого запиту")
+        if state == "busy": return await _plain(send, 409, "Запит із цим Idempotency-Key ще виконується")
+        if state == "replay":
+            status, headers, content = stored
+            await send({"type": "http.response.start", "status": status, "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers] + [(b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": content})
+            return
+
+        delivered = False
+        async def replay_body():
+            nonlocal delivered
+            if delivered: return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        response = {"status": 500, "headers": [], "body": [], "size": 0}
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in message.get("headers", []) if k.decode("latin-1").lower() not in SKIP_HEADERS]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b"")); response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try: await self.app(scope, replay_body, capture)
+        except BaseException:
+            await self._call(self.store.release, slot)
+            raise
+        if response["status"] >= 500 or response["size"] > IDEMPOTENCY_MAX_BODY: await self._call(self.store.release, slot)
+        else: await self._call(self.store.complete, slot, (response["status"], response["headers"], b"".join(response["body"])))
+
+    def stats(self): return self.store.stats()
@@ -0,0 +1,100 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from . import crud, models
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # 0 runs jobs inline in the caller
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", str(crud.CASCADE_BATCH_SIZE)))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "900"))  # a running job without a heartbeat for this long is re-queued
+log = logging.getLogger("hospital.jobs")
+
+
+def _cascade(filters, note, is_free):
+    # (count, run) for a crud.cancel_scheduled cascade; filters are built from the job params
+    a = models.Appointment
+    count = lambda db, params: db.query(func.count(a.id)).filter(*filters(params), a.status == "scheduled").scalar()
+    run = lambda db, params, batch_size: crud.cancel_scheduled(db, filters(params), note, is_free, batch_size)
+    return count, run
+
+def _once(fn):
+    # maintenance operations that commit on their own and report one total at the end
+    def run(db, params, batch_size): yield fn(db, params, batch_size)
+    return None, run
+
+def _rebuild_summaries(db, params, batch_size):
+    n = crud.rebuild_patient_summaries(db); db.commit(); return n
+
+A = models.Appointment
+KINDS = {
+    "cancel_patient_appointments": _cascade(lambda p: [A.patient_id == p["patient_id"]], " [DELETED]", True),
+    "rebuild_stats": _once(lambda db, p, _: crud.rebuild_doctor_stats(db)),
+    "rebuild_summaries": _once(_rebuild_summaries),
+    "archive": _once(lambda db, p, batch_size: crud.archive_appointments(db, datetime.fromisoformat(p["before"]), batch_size)),
+}
+
+
+def enqueue(db, data):
+    # maintenance jobs requested through POST /jobs/
+    params = {}
+    if data.kind == "archive": params["before"] = (crud.get_kyiv_time() - timedelta(days=data.older_than_days or crud.ARCHIVE_RETENTION_DAYS)).isoformat()
+    job = crud._enqueue_job(db, data.kind, params)
+    db.commit(); db.refresh(job); return job
+
+
+class JobRunner:
+    # a local thread pool over the persisted jobs table: the request commits the job row, the runner
+    # claims it (queued -> running in one UPDATE, so every worker may submit it but only one runs it),
+    # executes it with its own session and commits the progress and a heartbeat with every batch
+    def __init__(self, workers: int = JOB_WORKERS, batch_size: int = JOB_BATCH_SIZE, lease: int = JOB_LEASE_SECONDS):
+        self.batch_size, self.lease = batch_size, lease
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="job") if workers else None
+
+    def submit(self, session_factory, job_id: int):
+        if self.executor is None: return self.run(session_factory, job_id)
+        self.executor.submit(self.run, session_factory, job_id)
+
+    def run(self, session_factory, job_id: int):
+        j = models.Job
+        db = session_factory()
+        set_job = lambda **values: db.query(j).filter(j.id == job_id).update({getattr(j, k): v for k, v in values.items()}, synchronize_session=False)
+        try:
+            now = crud.get_kyiv_time()
+            claimed = db.query(j).filter(j.id == job_id, j.status == "queued").update({j.status: "running", j.started_at: now, j.heartbeat_at: now, j.processed: 0}, synchronize_session=False)
+            db.commit()
+            if not claimed: return
+            job = db.query(j.kind, j.params).filter(j.id == job_id).one()
+            count, run = KINDS[job.kind]
+            params = job.params or {}
+            set_job(total=count(db, params) if count else None); db.commit()
+            processed = 0
+            for n in run(db, params, self.batch_size):
+                processed += n
+                set_job(processed=processed, heartbeat_at=crud.get_kyiv_time()); db.commit()
+            set_job(status="done", finished_at=crud.get_kyiv_time()); db.commit()
+        except Exception as e:
+            db.rollback()
+            log.exception("job %s failed", job_id)
+            set_job(status="failed", error=str(e)[:1000], finished_at=crud.get_kyiv_time()); db.commit()
+        finally: db.close()
+
+    def resume(self, session_factory):
+        # queued jobs, plus running ones whose worker stopped sending heartbeats (every kind is safe to
+        # run again); other workers resuming at the same time lose the claim in run()
+        j = models.Job
+        db = session_factory()
+        try:
+            stale = crud.get_kyiv_time() - timedelta(seconds=self.lease)
+            db.query(j).filter(j.status == "running", func.coalesce(j.heartbeat_at, j.started_at) < stale).update({j.status: "queued"}, synchronize_session=False)
+            db.commit()
+            ids = [r[0] for r in db.query(j.id).filter(j.status == "queued").order_by(j.id)]
+        finally: db.close()
+        for job_id in ids: self.submit(session_factory, job_id)
+        return len(ids)
+
+    def shutdown(self):
+        if self.executor: self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+runner = JobRunner()
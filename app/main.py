@@ -1,20 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from . import models, schemas, crud, database
+from typing import List, Literal, Optional
+from datetime import date as date_type
+from . import models, schemas, crud, database, cache, metrics, migrations, export, events, serialization, waitlist, idempotency, jobs
+import logging
+import os
 
-models.Base.metadata.create_all(bind=database.engine)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE") == "1"
+log = logging.getLogger("hospital")
 app = FastAPI(title="Hospital System API")
+if database.async_engine is not None:
+    from . import api_async
+    app.include_router(api_async.router)
+if idempotency.IDEMPOTENCY_ENABLED: app.add_middleware(idempotency.IdempotencyMiddleware)
+if database.replica_engine is not None: app.add_middleware(database.ReadYourWrites)  # outermost: replays also refresh the cookie
+if metrics.METRICS_ENABLED:
+    metrics.install(database.engine)
+    if database.replica_engine is not None: metrics.install(database.replica_engine, "replica")
+    app.middleware("http")(metrics.middleware)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 get_db = database.get_db
+get_read_db = database.get_read_db
 
 @app.on_event("startup")
 def on_startup():
-    db = database.SessionLocal(); crud.seed_data(db); db.close()
+    # schema and demo data belong to `python -m app.cli init-db`; a worker only warms the pool and caches
+    if AUTO_MIGRATE: migrations.migrate(database.engine)
+    try:
+        database.warm_pool()
+        db = database.SessionLocal()
+        try: crud.warm_reference_cache(db)
+        finally: db.close()
+    except SQLAlchemyError as e: log.warning("startup warm-up skipped (run `python -m app.cli init-db`?): %s", e)
+
+@app.on_event("startup")
+async def start_waitlist_worker():
+    if waitlist.WAITLIST_WORKER:
+        waitlist.worker = waitlist.WaitlistWorker(database.get_session_factory())
+        waitlist.worker.start()
+
+@app.on_event("shutdown")
+async def stop_waitlist_worker():
+    if waitlist.worker: await waitlist.worker.stop()
+
+@app.on_event("startup")
+def resume_jobs():
+    try: jobs.runner.resume(database.get_session_factory())
+    except SQLAlchemyError as e: log.warning("job resume skipped: %s", e)
+
+@app.on_event("shutdown")
+def stop_jobs(): jobs.runner.shutdown()
 
 # UI
 @app.get("/", response_class=HTMLResponse)
@@ -24,57 +64,131 @@ async def read_doctor_view(request: Request): return templates.TemplateResponse(
 @app.get("/admin/doctors", response_class=HTMLResponse)
 async def read_admin_doctors(request: Request): return templates.TemplateResponse("doctors_manage.html", {"request": request})
 
+reference_response = serialization.reference_response
+
+def if_match(request: Request):
+    # If-Match: "<version>" from a previous response's ETag; absent or * means an unconditional update
+    value = request.headers.get("if-match")
+    if not value or value.strip() == "*": return None
+    try: return int(value.strip().removeprefix("W/").strip('"'))
+    except ValueError: raise HTTPException(400, "Invalid If-Match")
+
+def versioned(response: Response, row):
+    response.headers["ETag"] = f'"{row["version"]}"'
+    return row
+
+def started(session_factory, result):
+    # the job row is committed with the change; its cascade runs on the job pool, progress at /jobs/{id}
+    jobs.runner.submit(session_factory, result["job_id"])
+    return result
+
 # API
 @app.get("/departments/", response_model=List[schemas.DepartmentOut])
-def read_departments(db: Session = Depends(get_db)): return crud.get_departments(db)
+def read_departments(request: Request, db: Session = Depends(get_read_db)): return reference_response(request, "departments", crud.get_departments(db))
 @app.post("/departments/")
 def create_department(dept: schemas.DepartmentCreate, db: Session = Depends(get_db)): return crud.create_department(db, dept)
 
 @app.get("/patients/", response_model=List[schemas.PatientOut])
-def read_patients(search: Optional[str] = None, db: Session = Depends(get_db)): return crud.get_patients(db, search)
+def read_patients(response: Response, search: Optional[str] = None, cursor: Optional[int] = None, limit: int = Query(crud.PATIENT_PAGE_SIZE, ge=1, le=crud.PATIENT_PAGE_MAX), db: Session = Depends(get_read_db)):
+    patients = crud.get_patients(db, search, cursor, limit)
+    headers = {"X-Next-Cursor": str(patients[-1]["id"])} if len(patients) == limit else {}
+    response.headers.update(headers)
+    return serialization.respond(patients, headers)
 @app.post("/patients/", response_model=schemas.PatientOut)
 def create_patient(patient: schemas.PatientCreate, db: Session = Depends(get_db)):
     db_patient = models.Patient(first_name=patient.first_name, last_name=patient.last_name, date_of_birth=patient.date_of_birth, phone_number=patient.phone_number)
     db.add(db_patient); db.commit(); db.refresh(db_patient); return db_patient
 @app.put("/patients/{patient_id}", response_model=schemas.PatientOut)
-def update_patient_info(patient_id: int, data: schemas.PatientUpdate, db: Session = Depends(get_db)): return crud.update_patient(db, patient_id, data)
+def update_patient_info(patient_id: int, data: schemas.PatientUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)): return versioned(response, crud.update_patient(db, patient_id, data, version))
 @app.delete("/patients/{patient_id}")
-def delete_patient(patient_id: int, db: Session = Depends(get_db)): return crud.soft_delete_patient(db, patient_id)
+def delete_patient(patient_id: int, db: Session = Depends(get_db), session_factory=Depends(database.get_session_factory)): return started(session_factory, crud.soft_delete_patient(db, patient_id))
 
 @app.get("/doctors/")
-def read_doctors(specialization: str = None, db: Session = Depends(get_db)): return crud.get_doctors(db, specialization)
+def read_doctors(request: Request, specialization: str = None, db: Session = Depends(get_read_db)): return reference_response(request, "doctors", crud.get_doctors(db, specialization), f"-{specialization}" if specialization else "")
 @app.post("/doctors/", response_model=schemas.DoctorOut)
 def create_doctor(doctor: schemas.DoctorCreate, db: Session = Depends(get_db)): return crud.create_doctor(db, doctor)
+@app.get("/doctors/{doctor_id}", response_model=schemas.DoctorOut)
+def read_doctor(doctor_id: int, response: Response, db: Session = Depends(get_db)): return versioned(response, crud.get_doctor(db, doctor_id))
 @app.put("/doctors/{doctor_id}")
-def update_doctor(doctor_id: int, data: schemas.DoctorUpdate, db: Session = Depends(get_db)): return crud.update_doctor(db, doctor_id, data)
+def update_doctor(doctor_id: int, data: schemas.DoctorUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)): return versioned(response, crud.update_doctor(db, doctor_id, data, version))
 @app.delete("/doctors/{doctor_id}")
 def delete_doctor(doctor_id: int, db: Session = Depends(get_db)): return crud.delete_doctor(db, doctor_id)
 @app.get("/doctors/{doctor_id}/schedule")
-def get_doctor_schedule(doctor_id: int, db: Session = Depends(get_db)): return crud.get_doctor_schedule_settings(db, doctor_id)
+def get_doctor_schedule(request: Request, doctor_id: int, db: Session = Depends(get_read_db)): return reference_response(request, "schedules", crud.get_doctor_schedule_settings(db, doctor_id), f"-{doctor_id}")
 @app.put("/doctors/{doctor_id}/schedule")
 def update_schedule(doctor_id: int, data: schemas.ScheduleUpdateList, db: Session = Depends(get_db)): return crud.update_doctor_schedule(db, doctor_id, data)
+@app.get("/doctors/{doctor_id}/exceptions", response_model=List[schemas.ScheduleExceptionOut])
+def get_schedule_exceptions(doctor_id: int, date_from: Optional[date_type] = None, date_to: Optional[date_type] = None, db: Session = Depends(get_read_db)): return crud.get_schedule_exceptions(db, doctor_id, date_from, date_to)
+@app.post("/doctors/{doctor_id}/exceptions", response_model=List[schemas.ScheduleExceptionOut])
+def set_schedule_exceptions(doctor_id: int, data: schemas.ScheduleExceptionCreate, db: Session = Depends(get_db)): return crud.set_schedule_exceptions(db, doctor_id, data)
+@app.delete("/doctors/{doctor_id}/exceptions")
+def delete_schedule_exceptions(doctor_id: int, date_from: date_type, date_to: Optional[date_type] = None, db: Session = Depends(get_db)): return crud.delete_schedule_exceptions(db, doctor_id, date_from, date_to)
+@app.put("/schedules/bulk", response_model=schemas.BulkResult)
+def bulk_update_schedules(data: schemas.ScheduleBulkUpdate, db: Session = Depends(get_db)): return crud.bulk_update_schedules(db, data)
 @app.get("/doctors/{doctor_id}/slots", response_model=List[schemas.TimeSlot])
-def get_slots(doctor_id: int, date: str, db: Session = Depends(get_db)): return crud.get_slots_for_doctor(db, doctor_id, date)
+def get_slots(doctor_id: int, date: str, db: Session = Depends(get_read_db)): return crud.get_slots_for_doctor(db, doctor_id, date)
+@app.get("/board", response_model=schemas.Board)
+def get_board(date: Optional[date_type] = None, db: Session = Depends(get_read_db)): return crud.get_board(db, date or crud.get_kyiv_time().date())
+@app.get("/availability", response_model=List[schemas.AvailableSlot])
+def get_availability(specialization: Optional[str] = None, department_id: Optional[int] = None, date_from: Optional[date_type] = None, date_to: Optional[date_type] = None, limit: Optional[int] = Query(None, ge=1, le=crud.AVAILABILITY_LIMIT_MAX), db: Session = Depends(get_read_db)):
+    return crud.get_availability(db, specialization, department_id, date_from, date_to, limit)
 
 @app.post("/medications/")
 def create_medication(med: schemas.MedicationCreate, db: Session = Depends(get_db)): return crud.create_medication(db, med)
 @app.get("/medications/")
-def read_medications(db: Session = Depends(get_db)): return crud.get_medications(db)
+def read_medications(request: Request, db: Session = Depends(get_read_db)): return reference_response(request, "medications", crud.get_medications(db))
 
 @app.post("/appointments/", response_model=schemas.AppointmentOut)
 def book_appointment(appt: schemas.AppointmentCreate, db: Session = Depends(get_db)): return crud.create_appointment(db, appt)
+@app.post("/appointments/bulk", response_model=schemas.BulkResult)
+def book_appointments_bulk(data: schemas.AppointmentBulkCreate, db: Session = Depends(get_db)): return crud.bulk_create_appointments(db, data)
 @app.get("/doctors/{doctor_id}/appointments", response_model=List[schemas.AppointmentOut])
-def get_doc_appointments(doctor_id: int, db: Session = Depends(get_db)): return crud.get_doctor_appointments(db, doctor_id)
+def get_doc_appointments(doctor_id: int, db: Session = Depends(get_read_db)): return serialization.respond(crud.get_doctor_appointments(db, doctor_id))
 @app.post("/appointments/{appt_id}/complete")
 def complete_visit(appt_id: int, data: schemas.DiagnosisCreate, db: Session = Depends(get_db)): return crud.complete_appointment(db, appt_id, data)
 @app.put("/appointments/{appt_id}", response_model=schemas.AppointmentOut)
-def reschedule_appointment(appt_id: int, data: schemas.AppointmentUpdate, db: Session = Depends(get_db)): return crud.update_appointment(db, appt_id, data)
+def reschedule_appointment(appt_id: int, data: schemas.AppointmentUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)): return versioned(response, crud.update_appointment(db, appt_id, data, version))
 @app.post("/appointments/{appt_id}/cancel")
 def cancel_appointment(appt_id: int, db: Session = Depends(get_db)): return crud.cancel_appointment(db, appt_id)
 
+@app.post("/waitlist/", response_model=schemas.WaitlistOut)
+def join_waitlist(data: schemas.WaitlistCreate, db: Session = Depends(get_db)): return crud.create_waitlist_entry(db, data)
+@app.get("/waitlist/", response_model=List[schemas.WaitlistOut])
+def read_waitlist(patient_id: Optional[int] = None, doctor_id: Optional[int] = None, status: Optional[str] = None, db: Session = Depends(get_read_db)): return crud.get_waitlist(db, patient_id, doctor_id, status)
+@app.delete("/waitlist/{entry_id}", response_model=schemas.WaitlistOut)
+def leave_waitlist(entry_id: int, db: Session = Depends(get_db)): return crud.cancel_waitlist_entry(db, entry_id)
+
+@app.post("/jobs/", response_model=schemas.JobOut)
+def start_job(data: schemas.JobCreate, db: Session = Depends(get_db), session_factory=Depends(database.get_session_factory)):
+    job = jobs.enqueue(db, data)
+    jobs.runner.submit(session_factory, job.id)
+    return job
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+def read_job(job_id: int, db: Session = Depends(get_db)): return crud.get_job(db, job_id)
+
+@app.get("/events/doctors/{doctor_id}")
+async def doctor_events(doctor_id: int, date: Optional[date_type] = None):
+    # slot deltas for open booking pages and doctor dashboards instead of re-polling slots/appointments
+    return StreamingResponse(events.stream(doctor_id, date), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/cache/stats")
+def cache_stats(): return cache.reference.stats()
+@app.get("/idempotency/stats")
+def idempotency_stats(): return idempotency.store.stats() if idempotency.store is not None else {}
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics(): return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/patients/{patient_id}/history", response_model=List[schemas.MedicalRecordOut])
-def get_history(patient_id: int, db: Session = Depends(get_db)): return crud.get_patient_history(db, patient_id)
+def get_history(patient_id: int, db: Session = Depends(get_read_db)): return crud.get_patient_history(db, patient_id)
+@app.get("/patients/{patient_id}/timeline", response_model=schemas.PatientTimeline)
+def get_timeline(patient_id: int, response: Response, cursor: Optional[str] = None, limit: int = Query(crud.TIMELINE_PAGE_SIZE, ge=1, le=crud.TIMELINE_PAGE_MAX), db: Session = Depends(get_read_db)):
+    timeline, next_cursor = crud.get_patient_timeline(db, patient_id, cursor, limit)
+    if next_cursor: response.headers["X-Next-Cursor"] = next_cursor
+    return timeline
+@app.get("/export/{entity}")
+def export_rows(entity: Literal[crud.EXPORT_ENTITIES], format: Literal["csv", "ndjson"] = "csv", date_from: Optional[date_type] = None, date_to: Optional[date_type] = None, department_id: Optional[int] = None, session_factory=Depends(database.get_read_session_factory)):
+    return export.stream(session_factory, entity, format, date_from, date_to, department_id)
 @app.get("/analytics/doctors", response_model=List[schemas.DoctorStats])
-def get_analytics(db: Session = Depends(get_db)):
-    stats = crud.get_top_doctors(db)
+def get_analytics(date_from: Optional[date_type] = None, date_to: Optional[date_type] = None, db: Session = Depends(get_read_db)):
+    stats = crud.get_top_doctors(db, date_from, date_to)
     return [schemas.DoctorStats(last_name=row.last_name, specialization=row.specialization or "General", total_visits=row.total_visits, total_revenue=row.total_revenue or 0.0) for row in stats]
\ No newline at end of file
@@ -0,0 +1,163 @@
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from fastapi import Request
+import logging
+import os
+import sys
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+log = logging.getLogger("hospital.metrics")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "rows")
+    def __init__(self): self.statements = 0; self.sql_seconds = 0.0; self.rows = 0
+
+_current: ContextVar = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets; self.counts = [0] * len(buckets); self.sum = 0.0; self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets): self.counts[i] += 1
+        self.sum += value; self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1, help=""):
+        with self._lock:
+            self.help.setdefault(name, ("counter", help))
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, labels, value, buckets, help=""):
+        with self._lock:
+            self.help.setdefault(name, ("histogram", help))
+            h = self.histograms.get((name, labels))
+            if h is None: h = self.histograms[(name, labels)] = Histogram(buckets)
+            h.observe(value)
+
+    def render(self, extra=()):
+        fmt = lambda labels: "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        out = []
+        with self._lock:
+            for name, (kind, help) in sorted(self.help.items()):
+                out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                if kind == "counter":
+                    out += [f"{name}{fmt(labels)} {v}" for (n, labels), v in sorted(self.counters.items()) if n == name]
+                    continue
+                for (n, labels), h in sorted(self.histograms.items(), key=lambda x: x[0]):
+                    if n != name: continue
+                    acc = 0
+                    for le, c in zip(h.buckets, h.counts):
+                        acc += c; out.append(f"{name}_bucket{fmt(labels + (('le', le),))} {acc}")
+                    out += [f"{name}_bucket{fmt(labels + (('le', '+Inf'),))} {h.count}", f"{name}_sum{fmt(labels)} {round(h.sum, 6)}", f"{name}_count{fmt(labels)} {h.count}"]
+        for name, kind, help, value in extra:
+            out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+def install(engine, role: str = "primary"):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.statements += 1; stats.sql_seconds += elapsed
+            # only writes: rowcount of a SELECT is -1 or driver-specific until the rows are fetched
+            if cursor.description is None and cursor.rowcount > 0: stats.rows += cursor.rowcount
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            registry.inc("db_slow_queries_total", (("engine", role),), help=f"SQL statements slower than SLOW_QUERY_MS={SLOW_QUERY_MS:g}")
+            log.warning("slow query %.1fms on %s: %s", elapsed * 1000, role, " ".join(statement.split())[:500])
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if context.connection is not None and context.connection.info.get("query_start"): context.connection.info["query_start"].pop()
+
+
+class Sampler(threading.Thread):
+    # statistical profiler: every PROFILE_INTERVAL records the innermost app/ frame of every thread
+    # (sync endpoints run on the threadpool, so requests served concurrently share the samples)
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = Counter(); self._done = threading.Event(); self._me = None
+
+    def run(self):
+        self._me = threading.get_ident()
+        while not self._done.wait(PROFILE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == self._me: continue
+                while frame is not None and not frame.f_code.co_filename.startswith(APP_DIR): frame = frame.f_back
+                if frame is not None: self.samples[f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"] += 1
+
+    def stop(self):
+        self._done.set(); self.join()
+        return self.samples.most_common(10)
+
+
+async def middleware(request: Request, call_next):
+    stats = RequestStats(); token = _current.set(stats)
+    sampler = None
+    if request.headers.get(PROFILE_HEADER) == "1": sampler = Sampler(); sampler.start()
+    started = time.perf_counter(); status = 500
+    try:
+        response = await call_next(request); status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+        top = sampler.stop() if sampler else None
+        route = request.scope.get("route")
+        labels = (("method", request.method), ("route", route.path if route else "unmatched"))
+        registry.inc("http_requests_total", labels + (("status", status),), help="HTTP requests by route and status")
+        registry.observe("http_request_duration_seconds", labels, elapsed, DURATION_BUCKETS, help="Request wall time")
+        registry.observe("db_statements_per_request", labels, stats.statements, STATEMENT_BUCKETS, help="SQL statements issued per request")
+        registry.inc("db_time_seconds_total", labels, round(stats.sql_seconds, 6), help="Time spent in SQL by route")
+        registry.inc("db_rows_written_total", labels, stats.rows, help="Rows inserted, updated or deleted by SQL by route")
+    response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.1f}, db;dur={stats.sql_seconds * 1000:.1f};desc=\"{stats.statements} statements\""
+    if top is not None:
+        log.info("profile %s %s: %s", request.method, request.url.path, top)
+        response.headers[PROFILE_HEADER] = "; ".join(f"{frame}={n}" for frame, n in top[:5])
+    return response
+
+
+def render():
+    from . import cache, idempotency
+    ref = cache.reference.stats()
+    extra = [("reference_cache_hits_total", "counter", "Reference cache hits", ref["hits"]),
+             ("reference_cache_misses_total", "counter", "Reference cache misses", ref["misses"])]
+    if idempotency.store is not None:
+        idem = idempotency.store.stats()
+        extra += [("idempotency_hits_total", "counter", "Idempotency-Key replays served from the store", idem["hits"]),
+                  ("idempotency_misses_total", "counter", "Idempotency-Key requests executed", idem["misses"]),
+                  ("idempotency_evictions_total", "counter", "Idempotency-Key entries evicted by the size limit", idem["evictions"]),
+                  ("idempotency_expirations_total", "counter", "Idempotency-Key entries dropped after IDEMPOTENCY_TTL", idem["expirations"]),
+                  ("idempotency_conflicts_total", "counter", "Idempotency-Key retries rejected while the first request ran", idem["conflicts"])]
+    return registry.render(extra=extra)
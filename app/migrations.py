@@ -0,0 +1,162 @@
+from datetime import datetime
+from sqlalchemy import inspect, select, func, text, update, delete
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from . import models
+from .calendars import WEEKDAYS
+
+# Versioned schema migrations. Every step is idempotent, so a database
+# created by the old import-time create_all is brought up to date by running the list from 1.
+# Indexes use CREATE INDEX IF NOT EXISTS: the inspector does not report expression indexes on SQLite.
+
+
+def _create_indexes(conn: Connection, table, *names):
+    for index in table.indexes:
+        if index.name in names: conn.execute(CreateIndex(index, if_not_exists=True))
+
+def _add_column(conn: Connection, table, column):
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table.name)}: return
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+    if column.server_default is not None: ddl += f" DEFAULT {column.server_default.arg.text}"
+    if not column.nullable: ddl += " NOT NULL"
+    conn.execute(text(ddl))
+
+def _require_unique(conn: Connection, what: str, query):
+    dupes = conn.execute(query.limit(5)).all()
+    if dupes: raise RuntimeError(f"cannot enforce unique {what}, resolve duplicates first: {dupes}")
+
+
+def m001_initial(conn: Connection):
+    models.Base.metadata.create_all(bind=conn)
+
+def m002_appointment_price(conn: Connection):
+    _add_column(conn, models.Appointment.__table__, models.Appointment.__table__.c.price)
+
+def m003_slot_uniqueness(conn: Connection):
+    a = models.Appointment
+    _require_unique(conn, "(doctor_id, date_time) for active appointments", select(a.doctor_id, a.date_time, func.count()).where(a.status != "cancelled").group_by(a.doctor_id, a.date_time).having(func.count() > 1))
+    _create_indexes(conn, a.__table__, "uq_appointments_doctor_slot")
+
+def m004_patient_search_indexes(conn: Connection):
+    _create_indexes(conn, models.Patient.__table__, "ix_patients_first_name_lower", "ix_patients_last_name_lower", "ix_patients_phone_prefix", "ix_patients_date_of_birth")
+
+def m005_medication_name_index(conn: Connection):
+    # concurrent completions already created case variants of one name: fold each group into its lowest
+    # id (prescriptions are re-pointed, hot and archived) before the unique index can be built
+    m = models.Medication.__table__
+    name = func.lower(m.c.medication_name)
+    groups = {}
+    for mid, key in conn.execute(select(m.c.medication_id, name).where(name.in_(select(name).group_by(name).having(func.count() > 1))).order_by(m.c.medication_id)):
+        groups.setdefault(key, []).append(mid)
+    tables = [t for t in (models.Prescription.__table__, models.PrescriptionArchive.__table__) if inspect(conn).has_table(t.name)]
+    for keep, *dupes in groups.values():
+        for t in tables: conn.execute(update(t).where(t.c.medication_id.in_(dupes)).values(medication_id=keep))
+        conn.execute(delete(m).where(m.c.medication_id.in_(dupes)))
+    _create_indexes(conn, m, "uq_medications_name_lower")
+
+def m006_hot_path_indexes(conn: Connection):
+    _create_indexes(conn, models.Appointment.__table__, "ix_appointments_doctor_date", "ix_appointments_patient_status_date", "ix_appointments_status_date")
+    _create_indexes(conn, models.Schedule.__table__, "ix_schedules_doctor_day")
+    _create_indexes(conn, models.Prescription.__table__, "ix_prescriptions_appointment")
+
+def m007_archive_tables(conn: Connection):
+    models.Base.metadata.create_all(bind=conn, tables=[m.__table__ for m in (models.AppointmentArchive, models.MedicalRecordArchive, models.PrescriptionArchive, models.LabTestArchive)])
+
+def m008_row_versions(conn: Connection):
+    for model in (models.Doctor, models.Patient, models.Appointment, models.Schedule, models.AppointmentArchive):
+        _add_column(conn, model.__table__, model.__table__.c.version)
+
+def m009_patient_summaries(conn: Connection):
+    from .crud import rebuild_patient_summaries
+    models.PatientSummary.__table__.create(bind=conn, checkfirst=True)
+    _create_indexes(conn, models.LabTest.__table__, "ix_lab_tests_appointment")
+    with Session(bind=conn) as db: rebuild_patient_summaries(db); db.flush()
+
+def m010_calendar(conn: Connection):
+    # integer weekdays replace the name lookups, per-doctor slot length, date exceptions
+    s = models.Schedule.__table__
+    _add_column(conn, models.Doctor.__table__, models.Doctor.__table__.c.slot_minutes)
+    _add_column(conn, s, s.c.weekday)
+    for weekday, name in enumerate(WEEKDAYS): conn.execute(update(s).where(s.c.day_of_week == name, s.c.weekday.is_(None)).values(weekday=weekday))
+    conn.execute(text("DROP INDEX IF EXISTS ix_schedules_doctor_day"))
+    _create_indexes(conn, s, "ix_schedules_doctor_weekday")
+    models.ScheduleException.__table__.create(bind=conn, checkfirst=True)
+
+def m011_waitlist(conn: Connection):
+    models.WaitlistEntry.__table__.create(bind=conn, checkfirst=True)
+
+def m012_idempotency_keys(conn: Connection):
+    models.IdempotencyKey.__table__.create(bind=conn, checkfirst=True)
+
+def m013_jobs(conn: Connection):
+    models.Job.__table__.create(bind=conn, checkfirst=True)
+
+def m014_waitlist_appointment_fk(conn: Connection):
+    # waitlist.appointment_id loses its foreign key so crud.archive_appointments can move booked visits
+    w = models.WaitlistEntry.__table__
+    fks = [fk for fk in inspect(conn).get_foreign_keys(w.name) if fk["referred_table"] == "appointments"]
+    if not fks: return
+    if conn.dialect.name != "sqlite":
+        for fk in fks: conn.execute(text(f'ALTER TABLE {w.name} DROP CONSTRAINT "{fk["name"]}"'))
+        return
+    # SQLite cannot drop a constraint: rebuild the table
+    for index in w.indexes: conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    conn.execute(text(f"ALTER TABLE {w.name} RENAME TO {w.name}_old"))
+    w.create(bind=conn)
+    cols = ", ".join(c.name for c in w.columns)
+    conn.execute(text(f"INSERT INTO {w.name} ({cols}) SELECT {cols} FROM {w.name}_old"))
+    conn.execute(text(f"DROP TABLE {w.name}_old"))
+
+def m015_job_heartbeat(conn: Connection):
+    j = models.Job.__table__
+    _add_column(conn, j, j.c.heartbeat_at)
+
+def m016_patient_trigram_indexes(conn: Connection):
+    # substring search (LIKE '%ченко%') on PostgreSQL goes through pg_trgm GIN indexes; they are not in
+    # models because create_all in m001 would need the extension first. SQLite scans.
+    if conn.dialect.name != "postgresql": return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for name, expr in (("ix_patients_first_name_trgm", "lower(first_name)"), ("ix_patients_last_name_trgm", "lower(last_name)"), ("ix_patients_phone_trgm", "phone_number")):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON patients USING gin ({expr} gin_trgm_ops)"))
+
+
+MIGRATIONS = [
+    (1, "initial schema", m001_initial),
+    (2, "appointments.price", m002_appointment_price),
+    (3, "unique active slot per doctor", m003_slot_uniqueness),
+    (4, "patient search indexes", m004_patient_search_indexes),
+    (5, "unique medication names", m005_medication_name_index),
+    (6, "appointment/schedule hot path indexes", m006_hot_path_indexes),
+    (7, "archive tables for old visits", m007_archive_tables),
+    (8, "row versions for optimistic concurrency", m008_row_versions),
+    (9, "patient summaries for the timeline header", m009_patient_summaries),
+    (10, "calendar: integer weekdays, slot length, exceptions", m010_calendar),
+    (11, "waitlist", m011_waitlist),
+    (12, "stored Idempotency-Key responses", m012_idempotency_keys),
+    (13, "background jobs", m013_jobs),
+    (14, "waitlist.appointment_id without foreign key", m014_waitlist_appointment_fk),
+    (15, "jobs.heartbeat_at", m015_job_heartbeat),
+    (16, "trigram indexes for patient substring search", m016_patient_trigram_indexes),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def applied_versions(engine: Engine):
+    if not inspect(engine).has_table(models.SchemaMigration.__tablename__): return set()
+    with engine.connect() as conn: return {r[0] for r in conn.execute(select(models.SchemaMigration.version))}
+
+def pending(engine: Engine):
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+def migrate(engine: Engine, target: int = None):
+    applied = []
+    for version, name, upgrade in pending(engine):
+        if target is not None and version > target: break
+        with engine.begin() as conn:
+            models.SchemaMigration.__table__.create(bind=conn, checkfirst=True)
+            upgrade(conn)
+            conn.execute(models.SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append((version, name))
+    return applied
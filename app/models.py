@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Boolean, Text, TIMESTAMP, Time, Float
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Boolean, Text, TIMESTAMP, Time, Float, Index, Table, JSON, LargeBinary, text, func
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -18,6 +18,8 @@ class Doctor(Base):
     availability_status = Column(String(50), default="Available")
     price_per_visit = Column(Float, default=500.0)
     department_id = Column(Integer, ForeignKey("departments.id"))
+    slot_minutes = Column(Integer, nullable=False, default=20, server_default=text("20"))
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # optimistic concurrency, bumped by every UPDATE
     department = relationship("Department", back_populates="doctors")
     appointments = relationship("Appointment", back_populates="doctor")
     schedules = relationship("Schedule", back_populates="doctor")
@@ -30,8 +32,16 @@ class Patient(Base):
     date_of_birth = Column(Date, nullable=False)
     phone_number = Column(String(20), unique=True)
     is_active = Column(Boolean, default=True) 
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     appointments = relationship("Appointment", back_populates="patient")
     medical_record = relationship("MedicalRecord", back_populates="patient", uselist=False)
+    __table_args__ = (
+        # prefix lookups stay index range scans; substring search uses the pg_trgm indexes from migrations.m016
+        Index("ix_patients_first_name_lower", func.lower(first_name).label("first_name_lower"), postgresql_ops={"first_name_lower": "text_pattern_ops"}),
+        Index("ix_patients_last_name_lower", func.lower(last_name).label("last_name_lower"), postgresql_ops={"last_name_lower": "text_pattern_ops"}),
+        Index("ix_patients_phone_prefix", "phone_number", postgresql_ops={"phone_number": "varchar_pattern_ops"}),
+        Index("ix_patients_date_of_birth", "date_of_birth"),
+    )
 
 class Appointment(Base):
     __tablename__ = "appointments"
@@ -40,13 +50,23 @@ class Appointment(Base):
     status = Column(String(20), default="scheduled")
     diagnosis = Column(Text)
     symptoms = Column(Text)
+    price = Column(Float)
     patient_id = Column(Integer, ForeignKey("patients.id"))
     doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     patient = relationship("Patient", back_populates="appointments")
     doctor = relationship("Doctor", back_populates="appointments")
     medical_record = relationship("MedicalRecord", back_populates="appointment", uselist=False)
     prescriptions = relationship("Prescription", back_populates="appointment")
     lab_tests = relationship("LabTest", back_populates="appointment")
+    __table_args__ = (
+        # one active booking per doctor per slot; cancelled rows free the slot
+        Index("uq_appointments_doctor_slot", "doctor_id", "date_time", unique=True, postgresql_where=text("status != 'cancelled'"), sqlite_where=text("status != 'cancelled'")),
+        # doctor's day/range scans including cancelled rows, patient history and cascades, status sweeps
+        Index("ix_appointments_doctor_date", "doctor_id", "date_time"),
+        Index("ix_appointments_patient_status_date", "patient_id", "status", "date_time"),
+        Index("ix_appointments_status_date", "status", "date_time"),
+    )
 
 class MedicalRecord(Base):
     __tablename__ = "medical_records"
@@ -69,6 +89,7 @@ class Medication(Base):
     manufacturer = Column(String(100))
     description = Column(Text)
     prescriptions = relationship("Prescription", back_populates="medication")
+    __table_args__ = (Index("uq_medications_name_lower", func.lower(medication_name), unique=True),)
 
 class Prescription(Base):
     __tablename__ = "prescriptions"
@@ -81,15 +102,31 @@ class Prescription(Base):
     appointment = relationship("Appointment", back_populates="prescriptions")
     medical_record = relationship("MedicalRecord", back_populates="prescriptions")
     medication = relationship("Medication", back_populates="prescriptions")
+    __table_args__ = (Index("ix_prescriptions_appointment", "appointment_id"),)
 
 class Schedule(Base):
     __tablename__ = "schedules"
     id = Column(Integer, primary_key=True, index=True)
     doctor_id = Column(Integer, ForeignKey("doctors.id"))
-    day_of_week = Column(String(20))
+    weekday = Column(Integer)  # 0 = Monday, as date.weekday()
+    day_of_week = Column(String(20))  # display name, kept in step with weekday
     start_time = Column(Time)
     end_time = Column(Time)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
     doctor = relationship("Doctor", back_populates="schedules")
+    __table_args__ = (Index("ix_schedules_doctor_weekday", "doctor_id", "weekday"),)
+
+class ScheduleException(Base):
+    # one date of a doctor's calendar that overrides the weekly rule: another shift, or a day off
+    # (vacation, holiday) when start_time/end_time are empty
+    __tablename__ = "schedule_exceptions"
+    id = Column(Integer, primary_key=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    start_time = Column(Time)
+    end_time = Column(Time)
+    reason = Column(String(200))
+    __table_args__ = (Index("uq_schedule_exceptions_doctor_day", "doctor_id", "day", unique=True),)
 
 class LabTest(Base):
     __tablename__ = "lab_tests"
@@ -98,4 +135,95 @@ class LabTest(Base):
     test_name = Column(String(100), nullable=False)
     test_date = Column(Date)
     results = Column(Text)
-    appointment = relationship("Appointment", back_populates="lab_tests")
\ No newline at end of file
+    appointment = relationship("Appointment", back_populates="lab_tests")
+    __table_args__ = (Index("ix_lab_tests_appointment", "appointment_id"),)
+
+class DoctorDailyStats(Base):
+    __tablename__ = "doctor_daily_stats"
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_visits = Column(Integer, nullable=False, default=0)
+    total_revenue = Column(Float, nullable=False, default=0.0)
+
+class WaitlistEntry(Base):
+    # a patient waiting for any slot of a doctor (or of a specialization) in [date_from, date_to];
+    # a freed slot goes to the highest priority, then the oldest matching entry
+    __tablename__ = "waitlist"
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("patients.id"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    specialization = Column(String(100))
+    date_from = Column(Date, nullable=False)
+    date_to = Column(Date, nullable=False)
+    priority = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    note = Column(Text)
+    status = Column(String(20), nullable=False, default="waiting", server_default=text("'waiting'"))  # waiting, booked, cancelled, expired
+    appointment_id = Column(Integer)  # no foreign key: the booked visit may move to appointments_archive
+    created_at = Column(TIMESTAMP, nullable=False)
+    __table_args__ = (Index("ix_waitlist_status_doctor", "status", "doctor_id", "date_from"), Index("ix_waitlist_status_specialization", "status", "specialization", "date_from"))
+
+# Chart header for /patients/{id}/timeline, maintained by crud.complete_appointment (rebuild: python -m app.cli rebuild-summaries).
+# last_* point at the latest completed visit, which may already live in the archive tables.
+class PatientSummary(Base):
+    __tablename__ = "patient_summaries"
+    patient_id = Column(Integer, ForeignKey("patients.id"), primary_key=True)
+    visits = Column(Integer, nullable=False, default=0)
+    prescriptions = Column(Integer, nullable=False, default=0)
+    lab_tests = Column(Integer, nullable=False, default=0)
+    last_visit_at = Column(TIMESTAMP)
+    last_appointment_id = Column(Integer)
+    last_doctor_id = Column(Integer)
+    last_diagnosis = Column(Text)
+    active_prescriptions = Column(JSON)  # [{medication_name, dosage, instructions}] from the last visit
+
+# Cold storage for visits past the retention window (crud.archive_appointments). Same columns as the
+# hot table, without foreign keys or defaults, so old rows can be moved in batches without touching
+# the hot indexes; reads that need the full history union both tables.
+def _archive_of(table, *indexes):
+    return Table(f"{table.name}_archive", Base.metadata, *[Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in table.columns], *indexes)
+
+class AppointmentArchive(Base):
+    __table__ = _archive_of(Appointment.__table__, Index("ix_appointments_archive_patient_date", "patient_id", "date_time"), Index("ix_appointments_archive_doctor_date", "doctor_id", "date_time"))
+
+class MedicalRecordArchive(Base):
+    __table__ = _archive_of(MedicalRecord.__table__, Index("ix_medical_records_archive_appointment", "appointment_id"))
+
+class PrescriptionArchive(Base):
+    __table__ = _archive_of(Prescription.__table__, Index("ix_prescriptions_archive_appointment", "appointment_id"))
+
+class LabTestArchive(Base):
+    __table__ = _archive_of(LabTest.__table__, Index("ix_lab_tests_archive_appointment", "appointment_id"))
+
+# Background work started by a request or an operator (app/jobs.py): cascades of soft deletes and
+# maintenance rebuilds. Progress is committed per batch, so GET /jobs/{id} can follow it
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    params = Column(JSON)
+    status = Column(String(20), nullable=False, default="queued", server_default=text("'queued'"))  # queued, running, done, failed
+    total = Column(Integer)  # rows to process when known up front
+    processed = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    error = Column(Text)
+    created_at = Column(TIMESTAMP, nullable=False)
+    started_at = Column(TIMESTAMP)
+    heartbeat_at = Column(TIMESTAMP)  # last committed batch; a stale running job is re-queued by JobRunner.resume
+    finished_at = Column(TIMESTAMP)
+    __table_args__ = (Index("ix_jobs_status", "status"),)
+
+# Responses stored per Idempotency-Key when IDEMPOTENCY_STORE=db (app/idempotency.py); status is NULL
+# while the first request is still running
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(300), primary_key=True)  # "<client> <method> <path> <Idempotency-Key>"
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(Integer)
+    headers = Column(JSON)
+    body = Column(LargeBinary)
+    created_at = Column(TIMESTAMP, nullable=False, index=True)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False)
+    applied_at = Column(TIMESTAMP, nullable=False)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime, date, time
-from typing import Optional, List
+from typing import Literal, Optional, List
 
 class DepartmentCreate(BaseModel):
     name: str
@@ -31,6 +31,7 @@ class DoctorCreate(BaseModel):
     price_per_visit: float
     schedule_start: Optional[str] = "09:00"
     schedule_end: Optional[str] = "17:00"
+    slot_minutes: int = Field(20, ge=5, le=240)
 
 class DoctorUpdate(BaseModel):
     first_name: Optional[str] = None
@@ -38,6 +39,7 @@ class DoctorUpdate(BaseModel):
     specialization: Optional[str] = None
     price_per_visit: Optional[float] = None
     availability_status: Optional[str] = None
+    slot_minutes: Optional[int] = Field(None, ge=5, le=240)
 
 class DoctorOut(BaseModel):
     id: int
@@ -46,20 +48,106 @@ class DoctorOut(BaseModel):
     specialization: str
     price_per_visit: float
     availability_status: str
+    slot_minutes: Optional[int] = None
+    version: Optional[int] = None
     class Config: from_attributes = True
 
 class ScheduleItem(BaseModel):
-    day_of_week: str
+    day_of_week: Optional[str] = None  # Ukrainian name, or
+    weekday: Optional[int] = None  # 0 = Monday
     start_time: str
     end_time: str
+    version: Optional[int] = None  # from GET /doctors/{id}/schedule; a changed row is rejected with 409
 
 class ScheduleUpdateList(BaseModel):
     schedules: List[ScheduleItem]
 
+class DoctorScheduleUpdate(ScheduleUpdateList):
+    doctor_id: int
+
+class ScheduleBulkUpdate(BaseModel):
+    doctors: List[DoctorScheduleUpdate]
+    atomic: bool = False
+
+class ScheduleExceptionCreate(BaseModel):
+    date_from: date
+    date_to: Optional[date] = None  # inclusive, defaults to date_from
+    start_time: Optional[str] = None  # both empty: day off
+    end_time: Optional[str] = None
+    reason: Optional[str] = None
+
+class ScheduleExceptionOut(BaseModel):
+    id: int
+    day: date
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+    reason: Optional[str] = None
+    class Config: from_attributes = True
+
 class TimeSlot(BaseModel):
     time: str
     is_free: bool
 
+class BoardDoctor(BaseModel):
+    doctor_id: int
+    doctor_name: str
+    specialization: Optional[str] = None
+    start: str
+    slots: int
+    slot_minutes: int
+    busy: str  # hex bitmap, bit i = slot start + i * slot_minutes is booked
+    free: str  # hex bitmap of bookable slots (not booked, not in the past)
+
+class Board(BaseModel):
+    date: date
+    slot_minutes: int  # default slot length; each doctor row carries its own
+    doctors: List[BoardDoctor]
+
+class AvailableSlot(BaseModel):
+    doctor_id: int
+    doctor_name: str
+    specialization: Optional[str] = None
+    date_time: datetime
+
+class WaitlistCreate(BaseModel):
+    patient_id: int
+    doctor_id: Optional[int] = None  # a specific doctor, or
+    specialization: Optional[str] = None  # any doctor of the specialization
+    date_from: date
+    date_to: Optional[date] = None  # inclusive, defaults to date_from
+    priority: int = 0  # higher is served first
+    note: Optional[str] = None
+
+class WaitlistOut(BaseModel):
+    id: int
+    patient_id: int
+    doctor_id: Optional[int] = None
+    specialization: Optional[str] = None
+    date_from: date
+    date_to: date
+    priority: int
+    status: str
+    appointment_id: Optional[int] = None
+    created_at: datetime
+    class Config: from_attributes = True
+
+class JobCreate(BaseModel):
+    kind: Literal["rebuild_stats", "rebuild_summaries", "archive"]
+    older_than_days: Optional[int] = None  # archive only
+
+class JobOut(BaseModel):
+    id: int
+    kind: str
+    params: Optional[dict] = None
+    status: str
+    total: Optional[int] = None
+    processed: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config: from_attributes = True
+
 class MedicationCreate(BaseModel):
     medication_name: str
     manufacturer: str
@@ -71,6 +159,20 @@ class AppointmentCreate(BaseModel):
     date_time: datetime
     symptoms: Optional[str] = None
 
+class AppointmentBulkCreate(BaseModel):
+    items: List[AppointmentCreate]
+    atomic: bool = False
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: int
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkResult(BaseModel):
+    succeeded: int
+    results: List[BulkItemResult]
+
 class AppointmentUpdate(BaseModel):
     date_time: Optional[datetime] = None
     symptoms: Optional[str] = None
@@ -87,6 +189,7 @@ class DiagnosisCreate(BaseModel):
 
 class PatientOut(PatientBase):
     id: int
+    version: Optional[int] = None
     class Config: from_attributes = True
 
 class AppointmentOut(BaseModel):
@@ -95,6 +198,7 @@ class AppointmentOut(BaseModel):
     status: str
     patient: PatientOut
     symptoms: Optional[str]
+    version: Optional[int] = None
     class Config: from_attributes = True
 
 class MedicalRecordOut(BaseModel):
@@ -104,6 +208,43 @@ class MedicalRecordOut(BaseModel):
     doctor_name: str
     class Config: from_attributes = True
 
+class TimelinePrescription(BaseModel):
+    medication_name: str
+    dosage: Optional[str] = None
+    instructions: Optional[str] = None
+
+class TimelineLabTest(BaseModel):
+    test_name: str
+    test_date: Optional[date] = None
+    results: Optional[str] = None
+
+class TimelineVisit(BaseModel):
+    appointment_id: int
+    date_time: datetime
+    status: str
+    doctor_id: Optional[int] = None
+    doctor_name: Optional[str] = None
+    specialization: Optional[str] = None
+    symptoms: Optional[str] = None
+    diagnosis: Optional[str] = None
+    treatment_plan: Optional[str] = None
+    prescriptions: List[TimelinePrescription] = []
+    lab_tests: List[TimelineLabTest] = []
+
+class PatientSummaryOut(BaseModel):
+    visits: int = 0
+    prescriptions: int = 0
+    lab_tests: int = 0
+    last_visit_at: Optional[datetime] = None
+    last_doctor_name: Optional[str] = None
+    last_diagnosis: Optional[str] = None
+    active_prescriptions: List[TimelinePrescription] = []
+
+class PatientTimeline(BaseModel):
+    patient: PatientOut
+    summary: PatientSummaryOut
+    visits: List[TimelineVisit]
+
 class DoctorStats(BaseModel):
     last_name: str
     specialization: str
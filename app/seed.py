@@ -0,0 +1,81 @@
+"""Demo and synthetic data for an empty database: `python -m app.cli seed` / `init-db`.
+
+Rows are generated lazily and written with chunked executemany inserts, so memory stays flat at any size.
+Appointments never collide on (doctor_id, date_time); the last FUTURE_DAYS working days are left as
+scheduled visits, everything before that is completed (with diagnosis and price) or cancelled.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import insert, func, select
+from . import models
+
+CHUNK = 10_000
+SLOTS_PER_DAY = 24  # 09:00-17:00 by 20 minutes
+FUTURE_DAYS = 10
+DEPARTMENTS = ["Хірургія", "Терапія", "Неврологія", "Педіатрія", "Кардіологія", "Онкологія", "Урологія", "Офтальмологія", "Дерматологія", "Ендокринологія"]
+WORKDAYS = ["Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця"]
+FIRST_NAMES = ["Іван", "Петро", "Максим", "Анна", "Олена", "Марія", "Дмитро", "Ірина", "Андрій", "Наталія"]
+SURNAMES = ["Шевченко", "Коваленко", "Бойко", "Ткаченко", "Кравчук", "Олійник", "Вовк", "Поліщук", "Бондар", "Мельник", "Савчук", "Марченко"]
+DIAGNOSES = ["ГРВІ", "Гіпертонія", "Мігрень", "Гастрит", "Бронхіт", "Остеохондроз", "Алергія"]
+MEDICATIONS = [("Аспірин", "Bayer", "Жар"), ("Ібупрофен", "Дарниця", "Біль"), ("Вітамін C", "Віт", "Імун")]
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK: yield chunk; chunk = []
+    if chunk: yield chunk
+
+
+def _write(conn, table, rows):
+    n = 0
+    for chunk in _chunks(rows):
+        conn.execute(insert(table), chunk); n += len(chunk)
+    return n
+
+
+def slot_datetime(first_monday: date, slot: int):
+    # slot index -> working-day datetime, weekends skipped
+    day, k = divmod(slot, SLOTS_PER_DAY)
+    week, wd = divmod(day, 5)
+    return datetime.combine(first_monday + timedelta(days=7 * week + wd), time(9, 0)) + timedelta(minutes=20 * k)
+
+
+def is_empty(engine):
+    with engine.connect() as conn: return not conn.execute(select(models.Doctor.id).limit(1)).first()
+
+
+def generate(engine, doctors=15, patients=25, appointments=0, medications=len(MEDICATIONS), seed=42):
+    # one transaction; refuses to run on a database that already has doctors
+    rnd = random.Random(seed)
+    stats = {}
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(models.Doctor)).scalar(): raise RuntimeError("database is not empty")
+        n_depts = min(len(DEPARTMENTS), max(doctors, 1))
+        stats["departments"] = _write(conn, models.Department.__table__, ({"name": n, "location": chr(65 + i)} for i, n in enumerate(DEPARTMENTS[:n_depts])))
+        dept_ids = [r[0] for r in conn.execute(select(models.Department.id).order_by(models.Department.id))]
+        stats["doctors"] = _write(conn, models.Doctor.__table__, ({"first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(SURNAMES), "specialization": DEPARTMENTS[i % n_depts], "department_id": dept_ids[i % n_depts], "price_per_visit": rnd.choice([500, 700, 1000]), "availability_status": "Available"} for i in range(doctors)))
+        docs = conn.execute(select(models.Doctor.id, models.Doctor.price_per_visit).order_by(models.Doctor.id)).all()
+        stats["schedules"] = _write(conn, models.Schedule.__table__, ({"doctor_id": d.id, "weekday": wd, "day_of_week": day, "start_time": time(9, 0), "end_time": time(17, 0)} for d in docs for wd, day in enumerate(WORKDAYS)))
+        stats["medications"] = _write(conn, models.Medication.__table__, (dict(zip(("medication_name", "manufacturer", "description"), MEDICATIONS[i] if i < len(MEDICATIONS) else (f"Препарат {i}", "Generic", "-"))) for i in range(medications)))
+        stats["patients"] = _write(conn, models.Patient.__table__, ({"first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(SURNAMES), "date_of_birth": date(1940, 1, 1) + timedelta(days=rnd.randrange(30000)), "phone_number": f"+380{i:09d}", "is_active": True} for i in range(patients)))
+        pat_lo, pat_hi = conn.execute(select(func.min(models.Patient.id), func.max(models.Patient.id))).one()
+        if not appointments or not docs or pat_lo is None: return stats
+
+        per_doctor = -(-appointments // len(docs))
+        total_days = -(-per_doctor // SLOTS_PER_DAY)
+        today = date.today()
+        first_monday = today - timedelta(days=today.weekday()) - timedelta(weeks=(total_days - FUTURE_DAYS) // 5 + 1)
+        now = datetime.now()
+        def appts():
+            for i in range(appointments):
+                doc = docs[i % len(docs)]
+                dt = slot_datetime(first_monday, i // len(docs))
+                row = {"doctor_id": doc.id, "patient_id": rnd.randint(pat_lo, pat_hi), "date_time": dt, "symptoms": "-", "status": "scheduled", "diagnosis": None, "price": None}
+                if dt < now:
+                    if rnd.random() < 0.85: row.update(status="completed", diagnosis=rnd.choice(DIAGNOSES), price=doc.price_per_visit)
+                    else: row["status"] = "cancelled"
+                yield row
+        stats["appointments"] = _write(conn, models.Appointment.__table__, appts())
+    return stats
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from . import cache
+
+try: import orjson
+except ImportError: orjson = None
+
+# FAST_JSON=0 hands list rows back to FastAPI (response_model validation + jsonable_encoder), the
+# baseline the benchmarks compare against
+FAST_JSON = os.getenv("FAST_JSON", "1") == "1"
+
+
+def _default(o):
+    if isinstance(o, (datetime, date, time)): return o.isoformat()
+    if isinstance(o, Decimal): return float(o)
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    if orjson is not None: return orjson.dumps(content, default=_default)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # content is already plain dicts/lists shaped like the response model: no per-row validation
+    def render(self, content) -> bytes: return dumps(content)
+
+
+def respond(rows, headers: dict = None):
+    return FastJSONResponse(rows, headers=headers) if FAST_JSON else rows
+
+
+def reference_response(request: Request, key: str, data, variant: str = ""):
+    # ETag of the cached reference table (plus a digest of the filter, which may be Cyrillic and headers
+    # are latin-1); 304 when the client copy is current
+    etag = cache.reference.etag(key)
+    if etag is None: return data
+    if variant: variant = "-" + hashlib.md5(variant.encode()).hexdigest()[:12]
+    etag = f'"{etag}{variant}"'
+    if request.headers.get("if-none-match") == etag: return Response(status_code=304, headers={"ETag": etag})
+    return FastJSONResponse(data, headers={"ETag": etag}) if FAST_JSON else JSONResponse(jsonable_encoder(data), headers={"ETag": etag})
@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from . import crud, events
+
+WAITLIST_WORKER = os.getenv("WAITLIST_WORKER", "1") == "1"
+WAITLIST_SWEEP_SECONDS = float(os.getenv("WAITLIST_SWEEP_SECONDS", "60"))
+log = logging.getLogger("hospital.waitlist")
+
+
+# Event-driven slot reallocation: every slot published as free (cancellation, patient deactivation,
+# reschedule) is offered to the waitlist right away; a periodic sweep, and a resync after the queue
+# overflowed, catch openings this process did not see. Database work runs on the threadpool with
+# sessions from `session_factory`, so the event loop never blocks on it.
+class WaitlistWorker:
+    def __init__(self, session_factory, sweep_seconds: float = WAITLIST_SWEEP_SECONDS):
+        self.session_factory = session_factory
+        self.sweep_seconds = sweep_seconds
+        self.task = None
+        self.sub = None
+
+    def handle(self, event):
+        db = self.session_factory()
+        try:
+            if event.get("type") == "resync": return crud.sweep_waitlist(db)
+            return crud.allocate_slot(db, event["doctor_id"], datetime.fromisoformat(f"{event['date']}T{event['time']}"))
+        finally: db.close()
+
+    async def run(self):
+        while True:
+            try: event = await asyncio.wait_for(self.sub.get(), self.sweep_seconds)
+            except asyncio.TimeoutError: event = {"type": "resync"}
+            try: await run_in_threadpool(self.handle, event)
+            except Exception: log.exception("waitlist allocation failed for %s", event)
+
+    def start(self):
+        # subscribes before returning, so nothing freed after start() is missed
+        self.sub = events.broker.subscribe(events.FREED)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is None: return
+        self.task.cancel()
+        try: await self.task
+        except asyncio.CancelledError: pass
+        self.sub.close()
+        self.task = self.sub = None
+
+
+worker = None
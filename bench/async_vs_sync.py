@@ -0,0 +1,75 @@
+"""Sync vs async throughput on the slots and booking endpoints.
+
+Each mode runs in its own interpreter so the app is imported with the matching env:
+
+    python -m bench.async_vs_sync --database-url sqlite:///./bench.db --requests 2000 --concurrency 64
+
+Prints one JSON document: {"sync": {...}, "async": {...}} with req/s and latency percentiles per workload.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+from datetime import date, datetime, timedelta, time as dtime
+from .harness import drive
+
+DOCTORS = 50
+PATIENTS = 200
+
+
+def prepare():
+    from app import models, database, crud, migrations
+    migrations.migrate(database.engine)
+    db = database.SessionLocal()
+    try:
+        db.query(models.Appointment).filter(models.Appointment.symptoms == "bench").delete(synchronize_session=False)
+        dept = db.query(models.Department).filter(models.Department.name == "Bench").first()
+        if not dept:
+            dept = models.Department(name="Bench", location="B"); db.add(dept); db.flush()
+            docs = [models.Doctor(first_name="Bench", last_name=f"Doc{i}", specialization="Bench", department_id=dept.id, price_per_visit=500, availability_status="Available") for i in range(DOCTORS)]
+            db.add_all(docs); db.flush()
+            db.add_all([models.Schedule(doctor_id=d.id, weekday=wd, day_of_week=day, start_time=dtime(8, 0), end_time=dtime(20, 0)) for d in docs for wd, day in enumerate(crud.WEEKDAYS)])
+            db.add_all([models.Patient(first_name="Bench", last_name=f"Pat{i}", date_of_birth=date(1990, 1, 1), phone_number=f"+38099{i:07d}") for i in range(PATIENTS)])
+        db.commit()
+        doc_ids = [r.id for r in db.query(models.Doctor.id).filter(models.Doctor.department_id == dept.id)]
+        pat_ids = [r.id for r in db.query(models.Patient.id).filter(models.Patient.first_name == "Bench")]
+        return doc_ids, pat_ids
+    finally: db.close()
+
+
+async def run_mode(n, concurrency):
+    import httpx
+    from app.main import app
+    doc_ids, pat_ids = prepare()
+    days = [date.today() + timedelta(days=d) for d in range(1, 60)]
+    rnd = random.Random(42)
+    slot_reqs = [("GET", f"/doctors/{rnd.choice(doc_ids)}/slots?date={rnd.choice(days).isoformat()}", None) for _ in range(n)]
+    grid = [(d, datetime.combine(day, dtime(8, 0)) + timedelta(minutes=20 * k)) for day in days for k in range(36) for d in doc_ids]
+    book_reqs = [("POST", "/appointments/", {"patient_id": rnd.choice(pat_ids), "doctor_id": d, "date_time": dt.isoformat(), "symptoms": "bench"}) for d, dt in rnd.sample(grid, min(n, len(grid)))]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        return {"slots": await drive(client, slot_reqs, concurrency), "booking": await drive(client, book_reqs, concurrency)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mode", choices=["sync", "async"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args.requests, args.concurrency))))
+        return
+    report = {}
+    for mode in ("sync", "async"):
+        env = dict(os.environ, DATABASE_URL=args.database_url, DB_ASYNC="1" if mode == "async" else "0")
+        out = subprocess.run([sys.executable, "-m", "bench.async_vs_sync", "--mode", mode, "--requests", str(args.requests), "--concurrency", str(args.concurrency)], env=env, capture_output=True, text=True, check=True)
+        report[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,23 @@
+"""Diff two bench.run reports: python -m bench.compare before.json after.json"""
+import json
+import sys
+
+METRICS = ["rps", "p50_ms", "p95_ms", "p99_ms", "rows_per_sec", "queries_per_request"]
+COLD_START = ["import_ms", "startup_ms", "process_ms"]
+
+
+def main():
+    if len(sys.argv) != 3: raise SystemExit(__doc__)
+    with open(sys.argv[1]) as f: before = json.load(f)
+    with open(sys.argv[2]) as f: after = json.load(f)
+    print(f"{'workload':<22}{'metric':<22}{before['meta'].get('commit') or 'before':>12}{after['meta'].get('commit') or 'after':>12}{'change':>10}")
+    sections = [("cold_start", after["meta"].get("cold_start") or {}, before["meta"].get("cold_start") or {}, COLD_START)]
+    sections += [(name, a, before["workloads"].get(name, {}), METRICS) for name, a in after["workloads"].items()]
+    for name, a, b, metrics in sections:
+        for m in metrics:
+            if a.get(m) is None or b.get(m) is None: continue
+            change = f"{(a[m] - b[m]) / b[m] * 100:+.1f}%" if b[m] else "n/a"
+            print(f"{name:<22}{m:<22}{b[m]:>12}{a[m]:>12}{change:>10}")
+
+
+if __name__ == "__main__": main()
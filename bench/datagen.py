@@ -0,0 +1,32 @@
+"""Synthetic hospital dataset for benchmarks.
+
+    python -m bench.datagen --database-url sqlite:///./bench.db --doctors 1000 --patients 1000000 --appointments 10000000
+
+Same generator as `python -m app.cli seed` (app/seed.py), with benchmark-sized defaults.
+"""
+import argparse
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:///./bench.db")
+    parser.add_argument("--doctors", type=int, default=100)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--appointments", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    os.environ.setdefault("DATABASE_URL", args.database_url)
+    from app import crud, migrations, seed
+    engine = create_engine(args.database_url)
+    migrations.migrate(engine)
+    try: print(seed.generate(engine, args.doctors, args.patients, args.appointments, 50, args.seed))
+    except RuntimeError as e: raise SystemExit(str(e))
+    with Session(engine) as db:
+        print(f"doctor_daily_stats rows: {crud.rebuild_doctor_stats(db)}")
+        print(f"patient_summaries rows: {crud.rebuild_patient_summaries(db)}"); db.commit()
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+
+def percentile(values, q):
+    if not values: return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+
+class QueryCounter:
+    # counts statements on an engine via before_cursor_execute
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args): self.count += 1
+
+
+async def drive(client, requests, concurrency, counter: QueryCounter = None):
+    latencies, errors, rows = [], 0, 0
+    queue = list(reversed(requests))
+    queries_before = counter.count if counter else 0
+    async def worker():
+        nonlocal errors, rows
+        while queue:
+            method, url, body = queue.pop()
+            t0 = time.perf_counter()
+            res = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - t0)
+            if res.status_code >= 400: errors += 1
+            elif method == "GET" and res.headers.get("content-type", "").startswith("application/json"):
+                data = res.json()
+                rows += len(data) if isinstance(data, list) else 1
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    n = len(latencies)
+    report = {"requests": n, "errors": errors, "rps": round(n / elapsed, 1), "p50_ms": percentile(latencies, 0.5), "p95_ms": percentile(latencies, 0.95), "p99_ms": percentile(latencies, 0.99), "rows_per_sec": round(rows / elapsed, 1)}
+    if counter: report["queries_per_request"] = round((counter.count - queries_before) / max(n, 1), 2)
+    return report
+
+
+COLD_START = """
+import asyncio, json, time
+t0 = time.perf_counter()
+from app.main import app
+t1 = time.perf_counter()
+asyncio.run(app.router.startup())
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": round((t1 - t0) * 1000, 1), "startup_ms": round((t2 - t1) * 1000, 1)}))
+"""
+
+def cold_start(database_url: str):
+    # a fresh interpreter per measurement: what a new uvicorn worker pays before serving its first request
+    import json, os, subprocess, sys
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", COLD_START], env=dict(os.environ, DATABASE_URL=database_url), capture_output=True, text=True, check=True)
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    report["process_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return report
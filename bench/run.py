@@ -0,0 +1,94 @@
+"""Latency/throughput benchmark for the hospital API.
+
+    python -m bench.datagen --database-url sqlite:///./bench.db --patients 100000 --appointments 1000000
+    python -m bench.run --database-url sqlite:///./bench.db --requests 500 --concurrency 16 --output before.json
+    python -m bench.compare before.json after.json
+
+The app runs in-process behind httpx.ASGITransport against the given database (SQLite or Postgres).
+Each workload reports p50/p95/p99 latency, req/s, rows/s and SQL statements per request as JSON;
+meta.cold_start is the import + startup time of a fresh worker process.
+FAST_JSON=0 measures list endpoints through response_model validation instead of the direct encoder.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+from datetime import date, datetime, time, timedelta
+
+WORKLOADS = ["slots", "availability", "booking", "patient_search", "patient_list", "doctors_list", "history", "doctor_appointments", "analytics"]
+
+
+def git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception: return None
+
+
+def build_requests(db, models, n, rnd):
+    from sqlalchemy import func
+    from app.seed import SURNAMES
+    doc_ids = [r.id for r in db.query(models.Doctor.id).filter(models.Doctor.availability_status == "Available")]
+    pat_lo, pat_hi = db.query(func.min(models.Patient.id), func.max(models.Patient.id)).one()
+    if not doc_ids or pat_lo is None: raise SystemExit("empty database, run python -m bench.datagen first")
+    specs = [r[0] for r in db.query(models.Doctor.specialization).distinct()]
+    days = [date.today() + timedelta(days=d) for d in range(1, 30)]
+    # bookings go far beyond any generated visit so they never conflict with the dataset
+    far = [date.today() + timedelta(days=d) for d in range(400, 800) if (date.today() + timedelta(days=d)).weekday() < 5]
+    slots = set()
+    while len(slots) < min(n, len(far) * 24 * len(doc_ids)):
+        slots.add((rnd.choice(doc_ids), datetime.combine(rnd.choice(far), time(9, 0)) + timedelta(minutes=20 * rnd.randrange(24))))
+    booking = [("POST", "/appointments/", {"patient_id": rnd.randint(pat_lo, pat_hi), "doctor_id": d, "date_time": dt.isoformat(), "symptoms": "bench"}) for d, dt in sorted(slots)]
+    return {
+        "slots": [("GET", f"/doctors/{rnd.choice(doc_ids)}/slots?date={rnd.choice(days).isoformat()}", None) for _ in range(n)],
+        "availability": [("GET", f"/availability?specialization={rnd.choice(specs)}&limit=20", None) for _ in range(n)],
+        "booking": booking,
+        "patient_search": [("GET", f"/patients/?search={rnd.choice(SURNAMES)[:rnd.randint(2, 5)]}", None) if rnd.random() < 0.7 else ("GET", f"/patients/?search=%2B380{rnd.randint(0, 99):02d}", None) for _ in range(n)],
+        "patient_list": [("GET", f"/patients/?cursor={rnd.randint(pat_lo, pat_hi)}&limit=200", None) for _ in range(max(1, n // 5))],
+        "doctors_list": [("GET", "/doctors/", None) for _ in range(n)],
+        "history": [("GET", f"/patients/{rnd.randint(pat_lo, pat_hi)}/history", None) for _ in range(n)],
+        "doctor_appointments": [("GET", f"/doctors/{rnd.choice(doc_ids)}/appointments", None) for _ in range(max(1, n // 10))],
+        "analytics": [("GET", "/analytics/doctors", None) for _ in range(max(1, n // 10))],
+    }
+
+
+async def run(args):
+    import httpx
+    from app import database, models
+    from app.main import app
+    from .harness import drive, QueryCounter, cold_start
+
+    db = database.SessionLocal()
+    try:
+        db.query(models.Appointment).filter(models.Appointment.symptoms == "bench").delete(synchronize_session=False); db.commit()
+        requests = build_requests(db, models, args.requests, random.Random(args.seed))
+        sizes = {t: db.query(m).count() for t, m in (("doctors", models.Doctor), ("patients", models.Patient), ("appointments", models.Appointment))}
+    finally: db.close()
+
+    counter = QueryCounter(database.engine)
+    report = {"meta": {"commit": git_commit(), "dialect": database.engine.dialect.name, "python": platform.python_version(), "requests": args.requests, "concurrency": args.concurrency, "sizes": sizes, "timestamp": datetime.now().isoformat(timespec="seconds"), "cold_start": cold_start(args.database_url)}, "workloads": {}}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        for name in args.workloads:
+            report["workloads"][name] = await drive(client, requests[name], args.concurrency, counter)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./bench.db"))
+    parser.add_argument("--requests", type=int, default=500, help="requests per workload")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+
+    report = json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f: f.write(report + "\n")
+    else: print(report)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,9 @@
+import pytest
+from app import cache
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    cache.reference.clear()
+    yield
+    cache.reference.clear()
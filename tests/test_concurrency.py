@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, date, time
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from app import models, schemas, crud
+from app.database import Base
+import os
+import pytest
+
+
+WORKERS = 32
+ATTEMPTS = 400
+SLOTS = 8
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    url = os.getenv("LOAD_TEST_DATABASE_URL", f"sqlite:///{tmp_path / 'load.db'}")
+    connect_args = {"check_same_thread": False, "timeout": 60} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=WORKERS, max_overflow=0)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+
+def test_concurrent_booking_never_double_books(session_factory):
+    db = session_factory()
+    dept = models.Department(name="Load", location="L"); db.add(dept); db.commit()
+    doc = models.Doctor(first_name="Load", last_name="Doc", specialization="Test", department_id=dept.id, price_per_visit=500, availability_status="Available")
+    db.add(doc); db.commit()
+    for wd, day in enumerate(crud.WEEKDAYS): db.add(models.Schedule(doctor_id=doc.id, weekday=wd, day_of_week=day, start_time=time(9, 0), end_time=time(17, 0)))
+    patients = [models.Patient(first_name="P", last_name=str(i), date_of_birth=date(1990, 1, 1), phone_number=f"+38050{i:07d}") for i in range(ATTEMPTS)]
+    db.add_all(patients); db.commit()
+    doc_id, pat_ids = doc.id, [p.id for p in patients]
+    db.close()
+
+    day = (datetime.now() + timedelta(days=2)).replace(hour=9, minute=0, second=0, microsecond=0)
+    slots = [day + timedelta(minutes=20 * i) for i in range(SLOTS)]
+
+    def book(i):
+        s = session_factory()
+        try:
+            crud.create_appointment(s, schemas.AppointmentCreate(patient_id=pat_ids[i], doctor_id=doc_id, date_time=slots[i % SLOTS]))
+            return 200
+        except HTTPException as e: return e.status_code
+        finally: s.close()
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        codes = list(pool.map(book, range(ATTEMPTS)))
+
+    assert codes.count(200) == SLOTS
+    assert codes.count(409) == ATTEMPTS - SLOTS
+
+    db = session_factory()
+    per_slot = db.query(models.Appointment.date_time, func.count()).filter(models.Appointment.status != 'cancelled').group_by(models.Appointment.date_time).all()
+    db.close()
+    assert len(per_slot) == SLOTS and all(n == 1 for _, n in per_slot)
@@ -1,10 +1,12 @@
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from app.main import app
-from app.database import Base, get_db
+from app.database import Base, get_db, get_read_db, get_session_factory, get_read_session_factory
+from app import crud, models
 import pytest
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 
@@ -26,9 +28,20 @@ def override_get_db():
         db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
+app.dependency_overrides[get_read_session_factory] = lambda: TestingSessionLocal
 
 client = TestClient(app)
 
+@contextmanager
+def count_queries():
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try: yield statements
+    finally: event.remove(engine, "before_cursor_execute", listener)
+
 @pytest.fixture(autouse=True)
 def run_before_and_after_tests():
     Base.metadata.create_all(bind=engine)
@@ -99,4 +112,749 @@ def test_workflow_create_appointment():
     assert appt_res.status_code == 200, f"Error creating appt: {appt_res.text}"
     data = appt_res.json()
     assert data["status"] == "scheduled"
-    assert data["patient"]["id"] == pat_id
\ No newline at end of file
+    assert data["patient"]["id"] == pat_id
+
+def next_weekday():
+    day = datetime.now() + timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def create_doctor(dept_id, specialization="Test", **extra):
+    res = client.post("/doctors/", json={"first_name": "Doc", "last_name": "House", "specialization": specialization, "department_id": dept_id, "price_per_visit": 500, **extra})
+    assert res.status_code == 200, res.text
+    return res.json()["id"]
+
+def create_patient(phone="+380111111111", **extra):
+    res = client.post("/patients/", json={"first_name": "Pat", "last_name": "Rick", "date_of_birth": "1990-01-01", "phone_number": phone, **extra})
+    assert res.status_code == 200, res.text
+    return res.json()["id"]
+
+def test_availability_across_doctors(monkeypatch):
+    dept_id = client.post("/departments/", json={"name": "Cardio", "location": "E"}).json()["id"]
+    doc_a = create_doctor(dept_id, "Кардіолог")
+    doc_b = create_doctor(dept_id, "Кардіолог", schedule_start="10:00", schedule_end="12:00")
+    create_doctor(dept_id, "Хірург")
+    pat_id = create_patient()
+    day = next_weekday()
+    assert client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_a, "date_time": day.replace(hour=9).isoformat()}).status_code == 200
+
+    res = client.get("/availability", params={"specialization": "Кардіолог", "date_from": day.date().isoformat(), "date_to": day.date().isoformat(), "limit": 5})
+    assert res.status_code == 200, res.text
+    slots = [(s["doctor_id"], s["date_time"][11:16]) for s in res.json()]
+    assert slots == [(doc_a, "09:20"), (doc_a, "09:40"), (doc_a, "10:00"), (doc_b, "10:00"), (doc_a, "10:20")]
+
+    res = client.get("/availability", params={"department_id": dept_id, "date_from": day.date().isoformat(), "date_to": day.date().isoformat()})
+    assert len(res.json()) == 23 + 24 + 6
+    assert {client.get("/availability", params={"limit": n}).status_code for n in (0, -1, 501)} == {422}
+
+    # a slot that started this minute is gone from /availability, as from /slots
+    monkeypatch.setattr(crud, "get_kyiv_time", lambda: day.replace(hour=10, second=30))
+    res = client.get("/availability", params={"specialization": "Кардіолог", "date_from": day.date().isoformat(), "limit": 2})
+    assert [(s["doctor_id"], s["date_time"][11:16]) for s in res.json()] == [(doc_a, "10:20"), (doc_b, "10:20")]
+    assert {s["time"]: s["is_free"] for s in client.get(f"/doctors/{doc_b}/slots", params={"date": day.date().isoformat()}).json()}.get("10:00") is not True
+
+def test_slot_conflicts_come_from_unique_index(monkeypatch):
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_a, pat_b = create_patient("+380111111111"), create_patient("+380222222222")
+    day = next_weekday()
+    first = client.post("/appointments/", json={"patient_id": pat_a, "doctor_id": doc_id, "date_time": day.replace(hour=10).isoformat()})
+    second = client.post("/appointments/", json={"patient_id": pat_b, "doctor_id": doc_id, "date_time": day.replace(hour=11).isoformat()})
+    assert client.post("/appointments/", json={"patient_id": pat_b, "doctor_id": doc_id, "date_time": day.replace(hour=10).isoformat()}).status_code == 409
+    assert client.put(f"/appointments/{second.json()['id']}", json={"date_time": day.replace(hour=10).isoformat()}).status_code == 409
+    # off the slot grid (overlapping the 10:00 visit) or outside working days is rejected like a booking
+    saturday = day + timedelta(days=(5 - day.weekday()) % 7)
+    for moved in (day.replace(hour=10, minute=7), day.replace(hour=18), saturday.replace(hour=10)):
+        assert client.put(f"/appointments/{second.json()['id']}", json={"date_time": moved.isoformat()}).status_code == 400
+
+    freed = []
+    monkeypatch.setattr(crud.events, "publish_slot", lambda *args, **kw: freed.append(args))
+    assert client.post(f"/appointments/{first.json()['id']}/cancel").status_code == 200
+    assert client.post(f"/appointments/{first.json()['id']}/cancel").status_code == 409  # a second cancel frees nothing
+    assert len(freed) == 1
+    res = client.put(f"/appointments/{second.json()['id']}", json={"date_time": day.replace(hour=10).isoformat()})
+    assert res.status_code == 200, res.text
+
+def test_patients_keyset_pagination_and_search():
+    ids = [create_patient(f"+38050000000{i}", last_name=f"Шевченко{i}") for i in range(5)]
+    create_patient("+380670000000", last_name="Бойко", date_of_birth="1985-03-02")
+
+    res = client.get("/patients/", params={"limit": 2})
+    assert [p["id"] for p in res.json()] == ids[:2]
+    res = client.get("/patients/", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [p["id"] for p in res.json()] == ids[2:4]
+    assert client.get("/patients/", params={"limit": 1000}).status_code == 422
+
+    assert len(client.get("/patients/", params={"search": "Шевч"}).json()) == 5
+    assert len(client.get("/patients/", params={"search": "ченко"}).json()) == 5  # substring, as before the indexes
+    assert len(client.get("/patients/", params={"search": "+38067"}).json()) == 1
+    assert len(client.get("/patients/", params={"search": "0670000"}).json()) == 1
+    assert client.get("/patients/", params={"search": "02.03.1985"}).json()[0]["last_name"] == "Бойко"
+    assert client.get("/patients/", params={"search": "%"}).json() == []
+    res = client.get("/patients/", params={"search": "Шевч", "limit": 5})
+    assert "X-Next-Cursor" in res.headers
+
+def test_analytics_reads_incremental_daily_stats():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+    visit = {"diagnosis": "ГРВІ", "treatment_plan": "Спокій", "prescriptions": []}
+    ids = [client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=h).isoformat()}).json()["id"] for h in (9, 10, 11)]
+    for appt_id in ids: assert client.post(f"/appointments/{appt_id}/complete", json=visit).status_code == 200
+    assert client.post(f"/appointments/{ids[0]}/complete", json=visit).status_code == 200
+
+    client.put(f"/doctors/{doc_id}", json={"price_per_visit": 1000})
+    client.post(f"/appointments/{ids[2]}/cancel")
+    stats = client.get("/analytics/doctors").json()
+    assert stats == [{"last_name": "House", "specialization": "Test", "total_visits": 2, "total_revenue": 1000.0}]
+    assert client.get("/analytics/doctors", params={"date_from": (day + timedelta(days=1)).date().isoformat()}).json() == []
+
+    db = TestingSessionLocal()
+    try: assert crud.rebuild_doctor_stats(db) == 1
+    finally: db.close()
+    assert client.get("/analytics/doctors").json() == stats
+
+def test_listings_issue_bounded_queries():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    day = next_weekday()
+    for i in range(6):
+        pat_id = create_patient(f"+38050000000{i}")
+        appt_id = client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=9 + i).isoformat()}).json()["id"]
+        client.post(f"/appointments/{appt_id}/complete", json={"diagnosis": f"Діагноз {i}", "treatment_plan": "-", "prescriptions": []})
+
+    with count_queries() as statements:
+        res = client.get(f"/doctors/{doc_id}/appointments")
+    assert len(res.json()) == 6 and res.json()[0]["patient"]["phone_number"] == "+380500000000"
+    assert len(statements) <= 1, statements
+
+    with count_queries() as statements:
+        res = client.get(f"/patients/{pat_id}/history")
+    assert res.json()[0]["diagnosis"] == "Діагноз 5" and res.json()[0]["doctor_name"] == "Doc House"
+    assert len(statements) <= 1, statements
+
+def test_bulk_booking_and_schedule_import():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+    items = [{"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=h).isoformat()} for h in (9, 10, 10, 20)]
+
+    res = client.post("/appointments/bulk", json={"items": items, "atomic": True}).json()
+    assert res["succeeded"] == 0 and [r["status"] for r in res["results"]] == [424, 424, 409, 400]
+    assert client.get(f"/doctors/{doc_id}/appointments").json() == []
+
+    with count_queries() as statements:
+        res = client.post("/appointments/bulk", json={"items": items}).json()
+    assert res["succeeded"] == 2 and [r["status"] for r in res["results"]] == [200, 200, 409, 400]
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) <= 4
+    assert [a["id"] for a in client.get(f"/doctors/{doc_id}/appointments").json()] == [r["id"] for r in res["results"][:2]]
+
+    other_id = create_doctor(dept_id)
+    rota = {"doctors": [{"doctor_id": doc_id, "schedules": [{"day_of_week": "Понеділок", "start_time": "08:00", "end_time": "12:00"}]},
+                        {"doctor_id": other_id, "schedules": [{"day_of_week": "Субота", "start_time": "10:00", "end_time": "14:00"}]},
+                        {"doctor_id": 999, "schedules": []}]}
+    res = client.put("/schedules/bulk", json=rota).json()
+    assert res["succeeded"] == 2 and [r["status"] for r in res["results"]] == [200, 200, 404]
+    sched = {s["day_of_week"]: s["start_time"] for s in client.get(f"/doctors/{doc_id}/schedule").json()}
+    assert sched["Понеділок"].startswith("08:00")
+    assert "Субота" in {s["day_of_week"] for s in client.get(f"/doctors/{other_id}/schedule").json()}
+
+def test_async_routes_share_crud_rules(tmp_path):
+    pytest.importorskip("aiosqlite")
+    from fastapi import FastAPI
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    import shutil
+    from fastapi import Request
+    from sqlalchemy.pool import NullPool
+    from app import api_async, cache, database, models, schemas
+
+    url = f"{tmp_path / 'async.db'}"
+    sync_engine = create_engine(f"sqlite:///{url}")
+    Base.metadata.create_all(bind=sync_engine)
+    db = sessionmaker(bind=sync_engine)()
+    dept = crud.create_department(db, schemas.DepartmentCreate(name="Async", location="A"))
+    doc_id = crud.create_doctor(db, schemas.DoctorCreate(first_name="Doc", last_name="Async", specialization="Test", department_id=dept.id, price_per_visit=500)).id
+    patient = models.Patient(first_name="Pat", last_name="Async", date_of_birth=datetime(1990, 1, 1).date(), phone_number="+380999999999")
+    db.add(patient); db.commit(); pat_id = patient.id
+    db.close(); sync_engine.dispose()
+    shutil.copy(url, tmp_path / "replica.db")  # a replica that will lag behind the bookings below
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{url}", poolclass=NullPool)
+    replica_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+    factory = async_sessionmaker(async_engine, expire_on_commit=False)
+    replica_factory = async_sessionmaker(replica_engine, expire_on_commit=False, info={"primary": sessionmaker(bind=create_engine(f"sqlite:///{url}"))})
+    async def override_get_async_db():
+        async with factory() as s: yield s
+    async def override_get_async_read_db(request: Request):
+        async with database.route_read(request, factory, replica_factory)() as s: yield s
+    async_app = FastAPI()
+    async_app.include_router(api_async.router)
+    async_app.dependency_overrides[database.get_async_db] = override_get_async_db
+    async_app.dependency_overrides[database.get_async_read_db] = override_get_async_read_db
+    cache.reference.clear()
+
+    day = next_weekday()
+    with TestClient(database.ReadYourWrites(async_app, seconds=60)) as async_client:
+        booking = {"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=10).isoformat()}
+        res = async_client.post("/appointments/", json=booking)
+        assert res.status_code == 200, res.text
+        assert res.json()["patient"]["id"] == pat_id
+        assert async_client.post("/appointments/", json=booking).status_code == 409
+        slots = {s["time"]: s["is_free"] for s in async_client.get(f"/doctors/{doc_id}/slots", params={"date": day.date().isoformat()}).json()}
+        assert slots["10:00"] is False and slots["10:20"] is True  # own write, pinned to the primary
+        assert len(async_client.get(f"/doctors/{doc_id}/appointments").json()) == 1
+        async_client.cookies.clear()
+        assert async_client.get(f"/doctors/{doc_id}/appointments").json() == []  # replica has not caught up
+
+        res = async_client.get("/departments/")
+        assert res.json()[0]["name"] == "Async" and async_client.get("/departments/", headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+        res = async_client.get("/patients/", params={"limit": 1})
+        assert res.headers["X-Next-Cursor"] == str(pat_id) and res.json()[0]["last_name"] == "Async"
+
+def test_reference_cache_etag_and_invalidation():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    first = client.get("/doctors/")
+    etag = first.headers["ETag"]
+
+    with count_queries() as statements:
+        assert client.get("/doctors/").json() == first.json()
+        assert client.get("/doctors/", headers={"If-None-Match": etag}).status_code == 304
+        client.get(f"/doctors/{doc_id}/slots", params={"date": next_weekday().date().isoformat()})
+    assert len(statements) == 3  # schedules and exceptions cache loads + the day's appointments
+    create_doctor(dept_id, "Хірургія")
+    surgeons = client.get("/doctors/", params={"specialization": "Хірургія"})
+    assert surgeons.status_code == 200 and [d["specialization"] for d in surgeons.json()] == ["Хірургія"]
+    assert surgeons.headers["ETag"] != client.get("/doctors/").headers["ETag"]
+    assert client.get("/doctors/", params={"specialization": "Хірургія"}, headers={"If-None-Match": surgeons.headers["ETag"]}).status_code == 304
+    assert client.get("/cache/stats").json()["hits"] >= 3
+
+    client.put(f"/doctors/{doc_id}", json={"availability_status": "Vacation"})
+    res = client.get("/doctors/", headers={"If-None-Match": etag})
+    assert res.status_code == 200 and res.headers["ETag"] != etag
+    booking = {"patient_id": pat_id, "doctor_id": doc_id, "date_time": next_weekday().replace(hour=10).isoformat()}
+    assert client.post("/appointments/", json=booking).status_code == 404
+
+def test_complete_appointment_resolves_medications_in_bulk():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    assert client.post("/medications/", json={"medication_name": "Аспірин", "manufacturer": "Bayer", "description": "Жар"}).status_code == 200
+    assert client.post("/medications/", json={"medication_name": " Аспірин ", "manufacturer": "Bayer", "description": "Жар"}).status_code == 409
+    appt_id = client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": next_weekday().replace(hour=9).isoformat()}).json()["id"]
+    items = [{"medication_name": n, "dosage": "1", "instructions": "-"} for n in ("Аспірин", "Нурофен", " Нурофен ", "Ношпа")]
+
+    with count_queries() as statements:
+        res = client.post(f"/appointments/{appt_id}/complete", json={"diagnosis": "ГРВІ", "treatment_plan": "-", "prescriptions": items})
+    assert res.status_code == 200, res.text
+    assert len([s for s in statements if "medications" in s]) == 3  # catalogue load, upsert of new names, id lookup
+    assert sorted(m["medication_name"] for m in client.get("/medications/").json()) == sorted(["Аспірин", "Нурофен", "Ношпа"])
+
+    db = TestingSessionLocal()
+    try: assert db.query(models.Prescription).filter(models.Prescription.appointment_id == appt_id).count() == 4
+    finally: db.close()
+
+def test_metrics_middleware_records_sql_per_route(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    from sqlalchemy import text
+    from app import metrics
+
+    metrics_engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    metrics.install(metrics_engine)
+    mini = FastAPI()
+    mini.middleware("http")(metrics.middleware)
+    @mini.get("/items/{item_id}")
+    def read_item(item_id: int):
+        with metrics_engine.connect() as conn: return {"id": conn.execute(text("SELECT :i"), {"i": item_id}).scalar(), "two": conn.execute(text("SELECT 2")).scalar()}
+    @mini.post("/items")
+    def write_items():
+        with metrics_engine.begin() as conn:
+            conn.execute(text("CREATE TABLE IF NOT EXISTS items (id INTEGER)"))
+            conn.execute(text("INSERT INTO items VALUES (1), (2), (3)"))
+        return {}
+    replica = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    metrics.install(replica, "replica")
+    @mini.get("/replica")
+    def read_replica():
+        with replica.connect() as conn: return {"one": conn.execute(text("SELECT 1")).scalar()}
+    mini.get("/metrics", response_class=PlainTextResponse)(metrics.render)
+
+    mini_client = TestClient(mini)
+    assert "db;dur=" in mini_client.get("/items/1").headers["Server-Timing"]
+    assert mini_client.get("/items/2", headers={"X-Profile": "1"}).status_code == 200
+    body = mini_client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2' in body
+    assert 'db_statements_per_request_bucket{method="GET",route="/items/{item_id}",le="2"} 2' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 2' in body
+    assert "reference_cache_hits_total" in body
+    assert 'db_rows_written_total{method="GET",route="/items/{item_id}"} 0' in body  # SELECTs add no row count
+    mini_client.post("/items")
+    assert 'db_rows_written_total{method="POST",route="/items"} 3' in mini_client.get("/metrics").text
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    assert "1 statements" in mini_client.get("/replica").headers["Server-Timing"]
+    body = mini_client.get("/metrics").text
+    assert 'db_statements_per_request_bucket{method="GET",route="/replica",le="1"} 1' in body and 'db_slow_queries_total{engine="replica"} 1' in body
+
+def test_migrations_upgrade_legacy_schema(tmp_path):
+    from sqlalchemy import inspect, text
+    from app import migrations
+
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with legacy.begin() as conn:
+        # the pre-migration schema: tables from create_all, no hot-path indexes, no price column
+        Base.metadata.create_all(bind=conn, tables=[t for t in Base.metadata.sorted_tables if t.name != "schema_migrations"])
+        for (name,) in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")).all(): conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text("ALTER TABLE appointments DROP COLUMN price"))
+        conn.execute(text("ALTER TABLE patients DROP COLUMN version"))
+        conn.execute(text("ALTER TABLE schedules DROP COLUMN weekday"))
+        conn.execute(text("INSERT INTO schedules (doctor_id, day_of_week, start_time, end_time) VALUES (1, 'Середа', '09:00:00', '17:00:00')"))
+        # case variants left behind by concurrent completions
+        conn.execute(text("INSERT INTO medications (medication_id, medication_name) VALUES (1, 'Aspirin'), (2, 'aspirin'), (3, 'ASPIRIN'), (4, 'Nurofen')"))
+        conn.execute(text("INSERT INTO prescriptions (id, medication_id, dosage) VALUES (1, 2, '1'), (2, 3, '1'), (3, 4, '1')"))
+
+    assert [v for v, _ in migrations.migrate(legacy)] == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.migrate(legacy) == [] and migrations.applied_versions(legacy) == {v for v, _, _ in migrations.MIGRATIONS}
+    indexes = {i["name"] for i in inspect(legacy).get_indexes("appointments")}
+    assert {"uq_appointments_doctor_slot", "ix_appointments_doctor_date", "ix_appointments_patient_status_date"} <= indexes
+    assert "price" in {c["name"] for c in inspect(legacy).get_columns("appointments")}
+    assert "version" in {c["name"] for c in inspect(legacy).get_columns("patients")}
+    assert "ix_schedules_doctor_weekday" in {i["name"] for i in inspect(legacy).get_indexes("schedules")}
+    with legacy.connect() as conn: assert conn.execute(text("SELECT weekday FROM schedules")).scalar() == 2
+    with legacy.connect() as conn:
+        assert conn.execute(text("SELECT medication_id, medication_name FROM medications ORDER BY 1")).all() == [(1, "Aspirin"), (4, "Nurofen")]
+        assert conn.execute(text("SELECT medication_id FROM prescriptions ORDER BY id")).scalars().all() == [1, 1, 4]
+    legacy.dispose()
+
+def test_archived_visits_stay_in_history_and_stats():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+    visit = {"diagnosis": "ГРВІ", "treatment_plan": "Спокій", "prescriptions": [{"medication_name": "Аспірин", "dosage": "1", "instructions": "-"}]}
+    ids = [client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=h).isoformat()}).json()["id"] for h in (9, 10, 11)]
+    for appt_id in ids[:2]: assert client.post(f"/appointments/{appt_id}/complete", json=visit).status_code == 200
+    history = client.get(f"/patients/{pat_id}/history").json()
+
+    db = TestingSessionLocal()
+    try:
+        assert crud.archive_appointments(db, day.replace(hour=10, minute=30), batch_size=1) == 2
+        assert [a.id for a in db.query(models.Appointment)] == [ids[2]]
+        assert db.query(models.PrescriptionArchive).count() == 2 and db.query(models.Prescription).count() == 0
+        assert db.query(models.MedicalRecordArchive).count() == 2
+        assert crud.rebuild_doctor_stats(db) == 1
+    finally: db.close()
+    assert client.get(f"/patients/{pat_id}/history").json() == history and len(history) == 2
+    assert client.get("/analytics/doctors").json()[0]["total_visits"] == 2
+
+def test_export_streams_csv_and_ndjson_with_filters():
+    import csv, io, json
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    other_dept = client.post("/departments/", json={"name": "Other", "location": "B"}).json()["id"]
+    doc_id, other_doc = create_doctor(dept_id), create_doctor(other_dept)
+    pat_a, pat_b = create_patient("+380111111111"), create_patient("+380222222222")
+    day = next_weekday()
+    visit = {"diagnosis": "ГРВІ", "treatment_plan": "Спокій", "prescriptions": []}
+    first = client.post("/appointments/", json={"patient_id": pat_a, "doctor_id": doc_id, "date_time": day.replace(hour=9).isoformat()}).json()["id"]
+    client.post("/appointments/", json={"patient_id": pat_b, "doctor_id": other_doc, "date_time": day.replace(hour=9).isoformat()})
+    client.post(f"/appointments/{first}/complete", json=visit)
+
+    res = client.get("/export/patients")
+    assert res.status_code == 200 and res.headers["content-type"].startswith("text/csv")
+    assert [r["phone_number"] for r in csv.DictReader(io.StringIO(res.text))] == ["+380111111111", "+380222222222"]
+    res = client.get("/export/appointments", params={"format": "ndjson", "department_id": dept_id})
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert [(r["id"], r["status"], r["department_id"]) for r in rows] == [(first, "completed", dept_id)]
+    assert rows[0]["date_time"] == day.replace(hour=9).isoformat()
+    assert len(client.get("/export/patients", params={"format": "ndjson", "department_id": other_dept}).text.splitlines()) == 1
+    history = list(csv.DictReader(io.StringIO(client.get("/export/history").text)))
+    assert [(int(r["patient_id"]), r["diagnosis"], r["doctor_name"]) for r in history] == [(pat_a, "ГРВІ", "Doc House")]
+    assert client.get("/export/history", params={"date_from": (day + timedelta(days=1)).date().isoformat()}).text.splitlines() == ["appointment_id,patient_id,date_time,doctor_id,doctor_name,diagnosis,price"]
+    assert client.get("/export/doctors").status_code == 422
+
+def test_board_encodes_each_doctor_day_as_bitmaps():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_a = create_doctor(dept_id)
+    doc_b = create_doctor(dept_id, schedule_start="10:00", schedule_end="11:00")
+    pat_id = create_patient()
+    day = next_weekday()
+    for doc, h, m in ((doc_a, 9, 0), (doc_a, 9, 40), (doc_b, 10, 20)):
+        assert client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc, "date_time": day.replace(hour=h, minute=m).isoformat()}).status_code == 200
+
+    with count_queries() as statements:
+        board = client.get("/board", params={"date": day.date().isoformat()}).json()
+    assert len([s for s in statements if "FROM appointments" in s]) == 1
+    rows = {d["doctor_id"]: d for d in board["doctors"]}
+    assert (rows[doc_a]["start"], rows[doc_a]["slots"], rows[doc_a]["busy"]) == ("09:00", 24, "5")
+    assert int(rows[doc_a]["free"], 16) == (1 << 24) - 1 - 0b101
+    assert (rows[doc_b]["start"], rows[doc_b]["slots"], rows[doc_b]["busy"], rows[doc_b]["free"]) == ("10:00", 3, "2", "5")
+    slots = client.get(f"/doctors/{doc_a}/slots", params={"date": day.date().isoformat()}).json()
+    assert [i for i, s in enumerate(slots) if not s["is_free"]] == [0, 2]
+    past = client.get("/board", params={"date": (day - timedelta(days=7)).date().isoformat()}).json()
+    assert {d["free"] for d in past["doctors"]} == {"0"}
+
+def test_slot_changes_are_pushed_to_doctor_subscribers():
+    import asyncio, json
+    from app import events
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+
+    async def scenario():
+        feed = events.stream(doc_id, day.date())
+        assert await feed.__anext__() == "retry: 3000\n\n"
+        received = asyncio.ensure_future(feed.__anext__())
+        await asyncio.sleep(0)
+        other_day = (day + timedelta(days=7)).replace(hour=9).isoformat()
+        await asyncio.to_thread(client.post, "/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": other_day})
+        res = await asyncio.to_thread(client.post, "/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=10).isoformat()})
+        booked = await asyncio.wait_for(received, 2)
+        await asyncio.to_thread(client.put, f"/appointments/{res.json()['id']}", json={"date_time": day.replace(hour=11).isoformat()})
+        moved = [await asyncio.wait_for(feed.__anext__(), 2) for _ in range(2)]
+        await feed.aclose()
+        return booked, moved
+
+    booked, moved = asyncio.run(scenario())
+    assert booked.startswith("event: booked\n")
+    assert json.loads(booked.split("data: ", 1)[1]) | {"appointment_id": 0} == {"type": "booked", "appointment_id": 0, "doctor_id": doc_id, "date": day.date().isoformat(), "time": "10:00", "status": "scheduled", "is_free": False}
+    assert [(json.loads(m.split("data: ", 1)[1])["time"], json.loads(m.split("data: ", 1)[1])["is_free"]) for m in moved] == [("10:00", True), ("11:00", False)]
+    assert events.broker.subscribers() == 0
+
+def test_versioned_updates_reject_stale_edits():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+
+    with count_queries() as statements:
+        res = client.put(f"/patients/{pat_id}", json={"last_name": "Morty"}, headers={"If-Match": '"1"'})
+    assert res.status_code == 200 and res.headers["ETag"] == '"2"' and res.json()["last_name"] == "Morty"
+    assert [s.split()[0] for s in statements] == ["UPDATE"]
+    stale = client.put(f"/patients/{pat_id}", json={"last_name": "Smith"}, headers={"If-Match": '"1"'})
+    assert stale.status_code == 409
+    assert client.put(f"/patients/{pat_id}", json={"last_name": "Smith"}).json()["version"] == 3
+    assert client.put("/patients/9999", json={"last_name": "X"}, headers={"If-Match": '"1"'}).status_code == 404
+
+    assert client.put(f"/doctors/{doc_id}", json={"price_per_visit": 700}, headers={"If-Match": '"1"'}).json()["version"] == 2
+    assert client.put(f"/doctors/{doc_id}", json={"price_per_visit": 900}, headers={"If-Match": '"1"'}).status_code == 409
+    assert client.get("/doctors/").json()[0]["price_per_visit"] == 700
+    # another worker's cached list can lag: the edit form reads the version from the table
+    from app import cache
+    with TestingSessionLocal() as s: stale = {doc_id: {**crud.get_doctors(s)[0], "version": 1}}
+    cache.reference.invalidate("doctors"); cache.reference.get("doctors", lambda: stale)
+    assert client.get("/doctors/").json()[0]["version"] == 1
+    res = client.get(f"/doctors/{doc_id}")
+    assert res.json()["version"] == 2 and res.headers["ETag"] == '"2"' and client.get("/doctors/9999").status_code == 404
+    assert client.put(f"/doctors/{doc_id}", json={"price_per_visit": 900}, headers={"If-Match": '"1"'}).status_code == 409
+    assert client.get("/doctors/").json()[0]["version"] == 2  # the 409 dropped the stale cache entry
+
+    appt = client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=10).isoformat()}).json()
+    res = client.put(f"/appointments/{appt['id']}", json={"date_time": day.replace(hour=11).isoformat()}, headers={"If-Match": f'"{appt["version"]}"'})
+    assert res.status_code == 200 and res.json()["patient"]["last_name"] == "Smith" and res.json()["date_time"].endswith("11:00:00")
+    assert client.put(f"/appointments/{appt['id']}", json={"symptoms": "x"}, headers={"If-Match": f'"{appt["version"]}"'}).status_code == 409
+
+    monday = next(s for s in client.get(f"/doctors/{doc_id}/schedule").json() if s["day_of_week"] == "Понеділок")
+    item = {"day_of_week": "Понеділок", "start_time": "08:00", "end_time": "12:00", "version": monday["version"]}
+    assert client.put(f"/doctors/{doc_id}/schedule", json={"schedules": [item]}).status_code == 200
+    assert client.put(f"/doctors/{doc_id}/schedule", json={"schedules": [item]}).status_code == 409
+
+def test_seed_cli_generates_bulk_dataset(tmp_path):
+    from app import migrations, seed
+    target = create_engine(f"sqlite:///{tmp_path / 'seed.db'}")
+    migrations.migrate(target)
+    assert seed.is_empty(target)
+    stats = seed.generate(target, doctors=4, patients=30, appointments=200)
+    assert stats == {"departments": 4, "doctors": 4, "schedules": 20, "medications": 3, "patients": 30, "appointments": 200}
+    with sessionmaker(bind=target)() as db:
+        assert db.query(models.Appointment).filter(models.Appointment.status == "scheduled").count() > 0
+        assert db.query(models.Appointment.doctor_id, models.Appointment.date_time).distinct().count() == 200
+    with pytest.raises(RuntimeError): seed.generate(target)
+    target.dispose()
+
+def test_patient_timeline_pages_visits_with_summary_header():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_id = create_patient()
+    day = next_weekday()
+    ids = [client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": day.replace(hour=h).isoformat()}).json()["id"] for h in (9, 10, 11)]
+    for appt_id, diagnosis, spelling in zip(ids[:2], ("ГРВІ", "Грип"), ("Аспірин", " аспірин ")):
+        visit = {"diagnosis": diagnosis, "treatment_plan": f"План {diagnosis}", "prescriptions": [{"medication_name": spelling, "dosage": "1", "instructions": "-"}]}
+        assert client.post(f"/appointments/{appt_id}/complete", json=visit).status_code == 200
+    db = TestingSessionLocal()
+    try: db.add(models.LabTest(appointment_id=ids[0], test_name="ЗАК", results="норма")); db.commit()
+    finally: db.close()
+
+    client.get(f"/patients/{pat_id}/timeline")  # warms the doctor cache
+    with count_queries() as statements: res = client.get(f"/patients/{pat_id}/timeline", params={"limit": 2})
+    assert res.status_code == 200, res.text
+    assert len(statements) == 4
+    body = res.json()
+    assert body["summary"]["visits"] == 2 and body["summary"]["prescriptions"] == 2
+    assert body["summary"]["last_diagnosis"] == "Грип" and body["summary"]["active_prescriptions"][0]["medication_name"] == "Аспірин"
+    assert [v["appointment_id"] for v in body["visits"]] == [ids[2], ids[1]]
+    assert body["visits"][1]["treatment_plan"] == "План Грип" and body["visits"][1]["doctor_name"] == "Doc House"
+    assert body["visits"][1]["prescriptions"][0]["medication_name"] == "Аспірин"  # header and visits use the catalogue spelling
+    page = client.get(f"/patients/{pat_id}/timeline", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [v["appointment_id"] for v in page.json()["visits"]] == [ids[0]] and "X-Next-Cursor" not in page.headers
+    assert page.json()["visits"][0]["lab_tests"][0]["test_name"] == "ЗАК"
+    assert client.get(f"/patients/{pat_id}/timeline", params={"cursor": "bad"}).status_code == 422
+    assert client.get("/patients/999999/timeline").status_code == 404
+
+    assert client.post(f"/appointments/{ids[1]}/cancel").status_code == 200
+    summary = client.get(f"/patients/{pat_id}/timeline").json()["summary"]
+    assert (summary["visits"], summary["lab_tests"], summary["last_diagnosis"]) == (1, 1, "ГРВІ")
+    db = TestingSessionLocal()
+    try:
+        crud.archive_appointments(db, day.replace(hour=23))
+        assert crud.rebuild_patient_summaries(db) == 1; db.commit()
+    finally: db.close()
+    assert client.get(f"/patients/{pat_id}/timeline").json()["summary"] == summary
+
+def test_reads_go_to_replica_except_right_after_own_write():
+    from fastapi import Request
+    from app import cache, database
+    replica = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica)
+    ReplicaSession = sessionmaker(autocommit=False, autoflush=False, bind=replica, info={"primary": TestingSessionLocal})
+    def read_db(request: Request):
+        db = database.route_read(request, TestingSessionLocal, ReplicaSession)()
+        try: yield db
+        finally: db.close()
+    app.dependency_overrides[get_read_db] = read_db
+    try:
+        routed = TestClient(database.ReadYourWrites(app, seconds=60))
+        res = routed.post("/patients/", json={"first_name": "Pat", "last_name": "Rick", "date_of_birth": "1990-01-01", "phone_number": "+380111111111"})
+        assert database.PRIMARY_COOKIE in res.cookies
+        assert len(routed.get("/patients/").json()) == 1  # own write, still pinned to the primary
+        routed.cookies.clear()
+        assert routed.get("/patients/").json() == []  # replica has not caught up
+        cache.reference.clear()
+        routed.post("/departments/", json={"name": "TestDept", "location": "A1"}); routed.cookies.clear()
+        assert [d["name"] for d in routed.get("/departments/").json()] == ["TestDept"]  # reference cache loads from the primary
+    finally:
+        app.dependency_overrides[get_read_db] = override_get_db
+        replica.dispose()
+
+def test_fast_json_lists_match_validated_responses(monkeypatch):
+    from app import serialization
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    pat_ids = [create_patient(phone=f"+38011111111{i}") for i in range(3)]
+    for i, pat_id in enumerate(pat_ids):
+        assert client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": next_weekday().replace(hour=9 + i).isoformat(), "symptoms": "Кашель"}).status_code == 200
+    urls = ["/patients/?limit=2", "/patients/?search=Ri", f"/doctors/{doc_id}/appointments", "/doctors/"]
+    fast = [client.get(url) for url in urls]
+    monkeypatch.setattr(serialization, "FAST_JSON", False)
+    for url, res in zip(urls, fast):
+        slow = client.get(url)
+        assert res.status_code == slow.status_code == 200
+        assert res.json() == slow.json() and res.headers.get("X-Next-Cursor") == slow.headers.get("X-Next-Cursor")
+    assert fast[0].headers["X-Next-Cursor"] == str(pat_ids[1])
+
+def test_calendar_exceptions_and_slot_length():
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id, schedule_start="09:00", schedule_end="11:00", slot_minutes=30)
+    pat_id = create_patient()
+    day = next_weekday()
+    slots = client.get(f"/doctors/{doc_id}/slots", params={"date": day.date().isoformat()}).json()
+    assert [s["time"] for s in slots] == ["09:00", "09:30", "10:00", "10:30"]
+    book = lambda dt: client.post("/appointments/", json={"patient_id": pat_id, "doctor_id": doc_id, "date_time": dt.isoformat()})
+    assert book(day.replace(hour=9, minute=20)).json()["detail"] == "Поза робочим часом"  # off the 30-minute grid
+
+    vacation = {"date_from": day.date().isoformat(), "date_to": (day + timedelta(days=1)).date().isoformat(), "reason": "Відпустка"}
+    assert len(client.post(f"/doctors/{doc_id}/exceptions", json=vacation).json()) == 2
+    assert client.get(f"/doctors/{doc_id}/slots", params={"date": day.date().isoformat()}).json() == []
+    assert book(day.replace(hour=9)).status_code == 400
+    saturday = day + timedelta(days=(5 - day.weekday()) % 7)
+    assert client.post(f"/doctors/{doc_id}/exceptions", json={"date_from": saturday.date().isoformat(), "start_time": "12:00", "end_time": "13:00"}).status_code == 200
+    board = {d["doctor_id"]: d for d in client.get("/board", params={"date": saturday.date().isoformat()}).json()["doctors"]}
+    assert (board[doc_id]["start"], board[doc_id]["slots"], board[doc_id]["slot_minutes"]) == ("12:00", 2, 30)
+
+    with count_queries() as statements: assert book(saturday.replace(hour=12, minute=30)).status_code == 200
+    assert not [s for s in statements if "schedule" in s]  # checked against the compiled calendar
+    assert client.delete(f"/doctors/{doc_id}/exceptions", params={"date_from": day.date().isoformat(), "date_to": (day + timedelta(days=1)).date().isoformat()}).json() == {"deleted": 2}
+    assert book(day.replace(hour=9)).status_code == 200
+    assert client.post(f"/doctors/{doc_id}/exceptions", json={"date_from": day.date().isoformat(), "start_time": "12:00"}).status_code == 422
+
+def test_waitlist_worker_rebooks_freed_slots_by_priority():
+    import asyncio
+    from app import waitlist
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id, schedule_start="09:00", schedule_end="09:40")
+    day = next_weekday()
+    first, second, late, urgent = (create_patient(phone=f"+38022222222{i}") for i in range(4))
+    ids = [client.post("/appointments/", json={"patient_id": p, "doctor_id": doc_id, "date_time": day.replace(hour=9, minute=m).isoformat()}).json()["id"] for p, m in ((first, 0), (second, 20))]
+    wait = lambda pat, **extra: client.post("/waitlist/", json={"patient_id": pat, "date_from": day.date().isoformat(), **extra})
+    assert wait(late, doctor_id=doc_id).json()["status"] == "waiting"
+    assert wait(urgent, specialization="Test", priority=5).json()["status"] == "waiting"
+    assert wait(late).status_code == 422
+
+    async def scenario():
+        worker = waitlist.WaitlistWorker(TestingSessionLocal, sweep_seconds=60)
+        worker.start()
+        try:
+            await asyncio.to_thread(client.post, f"/appointments/{ids[0]}/cancel")
+            for _ in range(200):
+                if client.get("/waitlist/", params={"status": "booked"}).json(): break
+                await asyncio.sleep(0.01)
+        finally: await worker.stop()
+    asyncio.run(scenario())
+
+    booked = client.get("/waitlist/", params={"status": "booked"}).json()
+    assert [e["patient_id"] for e in booked] == [urgent]
+    appts = {a["id"]: a for a in client.get(f"/doctors/{doc_id}/appointments").json()}
+    assert appts[booked[0]["appointment_id"]]["patient"]["id"] == urgent and appts[booked[0]["appointment_id"]]["date_time"].endswith("09:00:00")
+
+    db = TestingSessionLocal()
+    try:
+        assert client.post(f"/appointments/{ids[1]}/cancel").status_code == 200
+        assert crud.sweep_waitlist(db) == 1  # no worker running: the periodic sweep serves the entry
+    finally: db.close()
+    entries = {e["patient_id"]: e for e in client.get("/waitlist/").json()}
+    assert entries[late]["status"] == "booked"
+    assert client.delete(f"/waitlist/{entries[late]['id']}").status_code == 409
+
+def test_idempotency_key_replays_writes_without_reexecuting(monkeypatch):
+    from app import idempotency
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id = create_doctor(dept_id)
+    patient = {"first_name": "Retry", "last_name": "Wifi", "date_of_birth": "1990-01-01", "phone_number": "+380333333333"}
+    first = client.post("/patients/", json=patient, headers={"Idempotency-Key": "pat-1"})
+    again = client.post("/patients/", json=patient, headers={"Idempotency-Key": "pat-1"})
+    assert first.status_code == again.status_code == 200 and again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true" and "Idempotent-Replayed" not in first.headers
+    assert client.post("/patients/", json={**patient, "last_name": "Other"}, headers={"Idempotency-Key": "pat-1"}).status_code == 422
+    other = client.post("/patients/", json={**patient, "phone_number": "+380333333334"}, headers={"Idempotency-Key": "pat-1", "Authorization": "Bearer other"})
+    assert other.status_code == 200 and other.json()["id"] != first.json()["id"]  # another client's key is its own: no 422, no replay
+    pat_id = first.json()["id"]
+
+    booking = {"patient_id": pat_id, "doctor_id": doc_id, "date_time": next_weekday().replace(hour=9).isoformat()}
+    booked = [client.post("/appointments/", json=booking, headers={"Idempotency-Key": "book-1"}) for _ in range(2)]
+    assert [r.status_code for r in booked] == [200, 200] and booked[0].json()["id"] == booked[1].json()["id"]
+    assert client.post("/appointments/", json=booking).status_code == 409  # without a key the retry is a new booking
+    appt_id = booked[0].json()["id"]
+    done = {"diagnosis": "ГРВІ", "treatment_plan": "-", "prescriptions": [{"medication_name": "Аспірин", "dosage": "1", "instructions": "-"}]}
+    with count_queries() as statements:
+        replies = [client.post(f"/appointments/{appt_id}/complete", json=done, headers={"Idempotency-Key": "done-1"}) for _ in range(3)]
+    assert {r.status_code for r in replies} == {200} and len({r.text for r in replies}) == 1
+    assert len([s for s in statements if "INSERT INTO prescriptions" in s]) == 1
+    db = TestingSessionLocal()
+    try: assert db.query(models.Prescription).filter(models.Prescription.appointment_id == appt_id).count() == 1 and db.query(models.Patient).count() == 2
+    finally: db.close()
+    assert idempotency.store.stats()["hits"] >= 3
+
+    store = idempotency.MemoryStore(max_keys=2, ttl=60)
+    for key in ("a", "b", "c"):
+        assert store.reserve(key, "f")[0] == "new"; store.complete(key, (200, [], b"{}"))
+    assert store.reserve("a", "f")[0] == "new" and store.reserve("c", "f") == ("replay", (200, [], b"{}"))
+    assert store.stats()["evictions"] == 2 and store.stats()["hits"] == 1
+    assert store.reserve("a", "f")[0] == "busy"  # first attempt still running
+    clock = [1000.0]
+    monkeypatch.setattr(idempotency.time, "monotonic", lambda: clock[0])
+    store = idempotency.MemoryStore(max_keys=10, ttl=10)
+    store.reserve("old", "f"); store.complete("old", (200, [], b"{}"))
+    clock[0] += 8; store.reserve("young", "f")
+    assert store.reserve("old", "f")[0] == "replay"  # now behind "young" in LRU order
+    clock[0] += 3
+    assert store.reserve("old", "f")[0] == "new" and store.stats()["expirations"] == 1
+
+    table = idempotency.TableStore(engine, ttl=60)
+    assert table.reserve("POST /patients/ k", "f")[0] == "new" and table.reserve("POST /patients/ k", "f")[0] == "busy"
+    table.complete("POST /patients/ k", (201, [["content-type", "application/json"]], b"{}"))
+    assert table.reserve("POST /patients/ k", "f") == ("replay", (201, [["content-type", "application/json"]], b"{}"))
+    assert table.reserve("POST /patients/ k", "g")[0] == "mismatch"
+    assert table.reserve("POST /patients/ lost", "f")[0] == "new" and table.reserve("POST /patients/ lost", "f")[0] == "busy"
+    with engine.begin() as conn:  # the first request crashed a while ago
+        conn.execute(models.IdempotencyKey.__table__.update().values(created_at=datetime.utcnow() - timedelta(seconds=table.lease + 1)).where(models.IdempotencyKey.key == "POST /patients/ lost"))
+    assert table.reserve("POST /patients/ lost", "f")[0] == "new" and table.reserve("POST /patients/ lost", "f")[0] == "busy"
+
+def test_delete_cascades_run_as_batched_jobs(monkeypatch, tmp_path):
+    from app import jobs, migrations
+    monkeypatch.setattr(jobs, "runner", jobs.JobRunner(workers=0, batch_size=2))
+    dept_id = client.post("/departments/", json={"name": "TestDept", "location": "A1"}).json()["id"]
+    doc_id, other_doc = create_doctor(dept_id), create_doctor(dept_id)
+    pat_id, other_pat = create_patient(), create_patient(phone="+380444444444")
+    day = next_weekday()
+    book = lambda pat, doc, hour: client.post("/appointments/", json={"patient_id": pat, "doctor_id": doc, "date_time": day.replace(hour=hour).isoformat()}).json()["id"]
+    mine = [book(pat_id, doc_id, h) for h in (9, 10, 11)]
+    kept = book(other_pat, other_doc, 9)
+
+    with count_queries() as statements:
+        res = client.delete(f"/patients/{pat_id}")
+    assert res.status_code == 200 and res.json()["status"] == "deactivated"
+    assert len([s for s in statements if s.startswith("UPDATE appointments")]) == 3  # two batches and the empty probe
+    job = client.get(f"/jobs/{res.json()['job_id']}").json()
+    assert (job["kind"], job["status"], job["total"], job["processed"]) == ("cancel_patient_appointments", "done", 3, 3)
+    assert client.delete(f"/patients/{pat_id + 100}").status_code == 404
+    assert client.delete(f"/doctors/{other_doc}").json() == {"status": "Fired"}  # firing a doctor leaves the booked visits alone
+    db = TestingSessionLocal()
+    try: assert dict(db.query(models.Appointment.id, models.Appointment.status).filter(models.Appointment.id.in_(mine + [kept]))) == {**{i: "cancelled" for i in mine}, kept: "scheduled"}
+    finally: db.close()
+    assert client.post("/jobs/", json={"kind": "rebuild_summaries"}).json()["kind"] == "rebuild_summaries"
+    assert client.get("/jobs/999").status_code == 404
+
+    # the pool path: a worker thread with its own sessions, and jobs left queued are resumed
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    migrations.migrate(file_engine)
+    Local = sessionmaker(bind=file_engine)
+    db = Local()
+    try:
+        db.add(models.Patient(id=1, first_name="A", last_name="B", date_of_birth=day.date(), phone_number="+380555555555"))
+        db.add_all([models.Appointment(patient_id=1, doctor_id=None, date_time=day.replace(hour=h), status="scheduled") for h in range(9, 14)])
+        job_id = crud._enqueue_job(db, "cancel_patient_appointments", {"patient_id": 1}).id; db.commit()
+    finally: db.close()
+    pool = jobs.JobRunner(workers=1, batch_size=2)
+    assert pool.resume(Local) == 1
+    pool.executor.shutdown(wait=True)
+    db = Local()
+    try:
+        done = db.query(models.Job).filter(models.Job.id == job_id).one()
+        assert (done.status, done.total, done.processed) == ("done", 5, 5)
+        assert db.query(models.Appointment).filter(models.Appointment.status == "cancelled", models.Appointment.symptoms.like("%[DELETED]")).count() == 5
+    finally: db.close()
+    # every worker submits resumed jobs, only the one that claims the row runs it; a running job is
+    # re-queued only after its heartbeat goes stale
+    pool.run(Local, job_id)
+    db = Local()
+    try:
+        assert db.query(models.Job.processed).filter(models.Job.id == job_id).scalar() == 5
+        db.query(models.Job).filter(models.Job.id == job_id).update({models.Job.status: "running", models.Job.heartbeat_at: crud.get_kyiv_time()}); db.commit()
+        assert jobs.JobRunner(workers=0).resume(Local) == 0
+        db.query(models.Job).filter(models.Job.id == job_id).update({models.Job.heartbeat_at: crud.get_kyiv_time() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)}); db.commit()
+        assert jobs.JobRunner(workers=0).resume(Local) == 1
+        assert db.query(models.Job.status).filter(models.Job.id == job_id).scalar() == "done"
+    finally: db.close()
+    file_engine.dispose()
+
+def test_archive_moves_waitlist_bookings_with_foreign_keys_enforced(tmp_path):
+    from sqlalchemy import inspect, text
+    from app import migrations
+    fk_engine = create_engine(f"sqlite:///{tmp_path / 'fk.db'}")
+    event.listen(fk_engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    migrations.migrate(fk_engine, target=13)
+    with fk_engine.begin() as conn:
+        # waitlist as the first version of migration 011 created it, with a foreign key to appointments
+        conn.execute(text("DROP TABLE waitlist"))
+        conn.execute(text("CREATE TABLE waitlist (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL REFERENCES patients(id), doctor_id INTEGER REFERENCES doctors(id), "
+                          "specialization VARCHAR(100), date_from DATE NOT NULL, date_to DATE NOT NULL, priority INTEGER DEFAULT 0 NOT NULL, note TEXT, "
+                          "status VARCHAR(20) DEFAULT 'waiting' NOT NULL, appointment_id INTEGER REFERENCES appointments(id), created_at TIMESTAMP NOT NULL)"))
+    day = datetime(2020, 3, 2, 9)
+    db = sessionmaker(bind=fk_engine)()
+    try:
+        db.add(models.Patient(id=1, first_name="A", last_name="B", date_of_birth=day.date(), phone_number="+380666666666"))
+        db.add(models.Appointment(id=1, patient_id=1, date_time=day, status="completed")); db.flush()
+        db.add(models.WaitlistEntry(patient_id=1, date_from=day.date(), date_to=day.date(), status="booked", appointment_id=1, created_at=day)); db.commit()
+    finally: db.close()
+    assert 14 in [v for v, _ in migrations.migrate(fk_engine)]
+    assert {fk["referred_table"] for fk in inspect(fk_engine).get_foreign_keys("waitlist")} == {"patients", "doctors"}
+    db = sessionmaker(bind=fk_engine)()
+    try:
+        assert crud.archive_appointments(db, day + timedelta(days=1)) == 1
+        assert db.query(models.AppointmentArchive.id).scalar() == 1 and db.query(models.WaitlistEntry.appointment_id).scalar() == 1
+    finally: db.close()
+    fk_engine.dispose()